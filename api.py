@@ -0,0 +1,262 @@
+"""Headless chat, retrieval and engine-listing API over the same `core` package as the UI.
+
+Callers authenticate with a Google OAuth access token (cloud-platform and email
+scopes) in `Authorization: Bearer ...`. The token must be issued to an allowed
+OAuth client (API_ALLOWED_AUDIENCES) for an account in API_ALLOWED_DOMAINS or
+API_ALLOWED_PRINCIPALS. Vertex calls then run under the caller's own identity
+and share the per-user quota scheduler with the Streamlit pages. With
+API_ALLOW_ADC=1, requests without a token use the service's Application
+Default Credentials instead.
+
+Workers are stateless: conversation history travels with each /chat request,
+so any number of them can run side by side.
+
+Usage:
+    python api.py                      # API_PORT (8000), API_WORKERS (4) workers
+    uvicorn api:app --workers 4 --port 8000
+
+    curl -N -H "Authorization: Bearer $(gcloud auth print-access-token)" \\
+        -d '{"message": "What is covered?", "engines": ["Default Shared Engine"]}' \\
+        -H "Content-Type: application/json" localhost:8000/chat
+"""
+import contextlib
+import hashlib
+import json
+import threading
+import time
+from typing import List, Literal, Optional
+
+import google.auth
+import google.oauth2.credentials
+import requests
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+import core.config as config
+from core import telemetry
+from core.adk_agent import get_adk_session
+from core.clients import get_clients
+from core.jobs import get_job_queue
+from core.rag import list_corpora
+from core.rerank import rerank
+from core.retrieval import RetrievalError, multi_corpus_retrieve
+from core.storage import get_retrieval_params, load_rag_engines, load_system_instruction
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Every worker also runs job workers, so queued and orphaned jobs resume without the UI
+    get_job_queue()
+    yield
+
+
+app = FastAPI(title="MI RAG API", lifespan=lifespan)
+
+# -------------------------------
+# Auth
+# -------------------------------
+TOKENINFO_URL = "https://oauth2.googleapis.com/tokeninfo"
+
+# sha256(token) -> (principal, credentials, expires_at). Reusing the credentials
+# object keeps the client pool from rebuilding the caller's clients per request.
+_token_cache = {}
+_token_lock = threading.Lock()
+_adc = None
+
+
+def _authorize(info):
+    """Principal of a tokeninfo response, or 403 unless the token was issued to an allowed
+    OAuth client for an allowed account. Any Google account can mint a valid token."""
+    if not {info.get("aud"), info.get("azp")} & set(config.API_ALLOWED_AUDIENCES):
+        raise HTTPException(status_code=403, detail="Token was not issued for this application")
+    email = info.get("email")
+    verified = str(info.get("email_verified", "")).lower() == "true"
+    if not email or not verified:
+        raise HTTPException(status_code=403, detail="Token carries no verified email (add the email scope)")
+    domain = email.rsplit("@", 1)[-1].lower()
+    if email not in config.API_ALLOWED_PRINCIPALS and domain not in (d.lower() for d in config.API_ALLOWED_DOMAINS):
+        raise HTTPException(status_code=403, detail=f"{email} is not allowed to use this API")
+    return email
+
+
+def _token_identity(token):
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    now = time.time()
+    with _token_lock:
+        cached = _token_cache.get(key)
+        if cached and cached[2] > now:
+            return cached[0], cached[1]
+        for stale in [k for k, v in _token_cache.items() if v[2] <= now]:
+            del _token_cache[stale]
+
+    response = requests.get(TOKENINFO_URL, params={"access_token": token}, timeout=10)
+    if response.status_code != 200:
+        raise HTTPException(status_code=401, detail="Invalid or expired access token")
+    info = response.json()
+    principal = _authorize(info)
+    credentials = google.oauth2.credentials.Credentials(token)
+    with _token_lock:
+        _token_cache[key] = (principal, credentials, now + int(info.get("expires_in", 300)))
+    return principal, credentials
+
+
+def _caller_clients(authorization):
+    """Pooled VertexClients for the caller identified by the Authorization header."""
+    global _adc
+    if authorization and authorization.lower().startswith("bearer "):
+        principal, credentials = _token_identity(authorization[7:].strip())
+        return get_clients(principal, credentials)
+    if not config.API_ALLOW_ADC:
+        raise HTTPException(status_code=401, detail="Missing bearer token")
+    with _token_lock:
+        if _adc is None:
+            _adc, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+    return get_clients("api", _adc)
+
+
+# -------------------------------
+# Engines
+# -------------------------------
+def _resolve_engines(clients, engines):
+    """Corpus resource names for engine names or corpus ids; the default engine when empty."""
+    known = load_rag_engines()
+    if not engines:
+        default = next((e for e in known if e.get("is_default")), known[0] if known else None)
+        if default is None:
+            raise HTTPException(status_code=400, detail="No engines configured")
+        engines = [default["corpus_id"]]
+    names = []
+    for engine in engines:
+        match = next((e for e in known if engine in (e["name"], e["corpus_id"])), None)
+        if match is None and "/ragCorpora/" not in engine:
+            raise HTTPException(status_code=404, detail=f"Unknown engine: {engine}")
+        names.append(engine if match is None else clients.corpus_resource_name(match["corpus_id"]))
+    return names
+
+
+# -------------------------------
+# Schemas
+# -------------------------------
+class Turn(BaseModel):
+    role: Literal["user", "model"]
+    text: str
+
+
+class ChatRequest(BaseModel):
+    message: str
+    engines: Optional[List[str]] = None
+    model: Optional[str] = None
+    instruction: Optional[str] = None
+    history: List[Turn] = []
+    hybrid: Optional[bool] = None
+    rerank: Optional[bool] = None
+    stream: bool = True
+
+
+class RetrieveRequest(BaseModel):
+    query: str
+    engines: Optional[List[str]] = None
+    hybrid: bool = False
+    rerank: bool = False
+
+
+def _sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def _response_payload(response):
+    return {"text": response.text, "sources": response.sources, "model": response.model}
+
+
+# -------------------------------
+# Endpoints
+# -------------------------------
+@app.get("/healthz")
+def healthz():
+    return {"ok": True}
+
+
+@app.get("/engines")
+def engines(remote: bool = False, authorization: Optional[str] = Header(None)):
+    """Configured engines; with `remote=true`, the corpora that exist in Vertex."""
+    with telemetry.span("api.engines", remote=remote):
+        clients = _caller_clients(authorization)
+        if not remote:
+            return {"engines": load_rag_engines()}
+        return {
+            "engines": [
+                {"name": c.display_name, "corpus_id": c.name.split("/")[-1]}
+                for c in list_corpora(clients) or []
+            ]
+        }
+
+
+@app.post("/retrieve")
+def retrieve(request: RetrieveRequest, authorization: Optional[str] = Header(None)):
+    with telemetry.span("api.retrieve"):
+        clients = _caller_clients(authorization)
+        corpus_names = _resolve_engines(clients, request.engines)
+        engines_config = load_rag_engines()
+        params = {name: get_retrieval_params(name, engines_config) for name in corpus_names}
+        try:
+            with clients.in_use():
+                chunks, elapsed = multi_corpus_retrieve(
+                    clients, corpus_names, request.query, params=params, hybrid=request.hybrid
+                )
+        except RetrievalError as e:
+            raise HTTPException(status_code=403 if e.access_denied else 502, detail=str(e))
+        if request.rerank:
+            chunks = rerank(request.query, chunks)
+        return {"chunks": chunks, "elapsed": elapsed}
+
+
+def _session(request, clients):
+    corpus_names = _resolve_engines(clients, request.engines)
+    session = get_adk_session(
+        request.model or config.DEFAULT_MODEL_ID,
+        corpus_names,
+        request.instruction or load_system_instruction(),
+        clients,
+        hybrid=request.hybrid,
+        rerank=request.rerank,
+    )
+    session.history = [{"role": turn.role, "parts": [turn.text]} for turn in request.history]
+    return session
+
+
+@app.post("/chat")
+async def chat(request: ChatRequest, authorization: Optional[str] = Header(None)):
+    """Answers one message. Streams `delta` events then one `done` event over SSE,
+    or returns the whole answer as JSON with `"stream": false`."""
+    clients = await run_in_threadpool(_caller_clients, authorization)
+    session = await run_in_threadpool(_session, request, clients)
+
+    if not request.stream:
+        with clients.in_use():
+            response = await run_in_threadpool(session.send_message, request.message)
+        return _response_payload(response)
+
+    async def events():
+        # Held until the stream ends or the client goes away
+        with clients.in_use():
+            async for item in iterate_in_threadpool(session.stream_message(request.message)):
+                if isinstance(item, str):
+                    yield _sse("delta", {"text": item})
+                else:
+                    yield _sse("done", _response_payload(item))
+
+    # Disable proxy buffering so deltas reach the client as they are generated
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"X-Accel-Buffering": "no"})
+
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(telemetry.render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    telemetry.configure_tracing()
+    uvicorn.run("api:app", host="0.0.0.0", port=config.API_PORT, workers=config.API_WORKERS)
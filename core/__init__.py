@@ -1,5 +1,97 @@
+import importlib
+
 from .config import *
-from .auth import *
-from .storage import *
-from .rag import *
-from .adk_agent import *
+
+# Submodules are imported on first attribute access so that pages which never
+# touch Vertex AI (e.g. Comments) do not pay for the vertexai / ADK imports.
+_LAZY_EXPORTS = {
+    # auth
+    "REDIRECT_URI": "auth",
+    "get_redirect_uri": "auth",
+    "load_credentials": "auth",
+    "save_credentials": "auth",
+    "logout": "auth",
+    "get_flow_from_secrets": "auth",
+    "perform_auth": "auth",
+    "login_page": "auth",
+    "show_sidebar_auth": "auth",
+    # storage
+    "load_todos": "storage",
+    "save_todos": "storage",
+    "load_rag_engines": "storage",
+    "save_rag_engines": "storage",
+    "get_retrieval_params": "storage",
+    "save_retrieval_params": "storage",
+    "load_system_instruction": "storage",
+    "save_system_instruction": "storage",
+    "load_instructions_library": "storage",
+    "save_instructions_library": "storage",
+    # clients
+    "VertexClients": "clients",
+    "VertexClientPool": "clients",
+    "get_client_pool": "clients",
+    "get_clients": "clients",
+    # scheduler
+    "QuotaScheduler": "scheduler",
+    "QueueTimeout": "scheduler",
+    "get_scheduler": "scheduler",
+    # resilience
+    "DeadlineExceeded": "resilience",
+    "CircuitOpen": "resilience",
+    "get_hedged_executor": "resilience",
+    # singleflight
+    "get_singleflight": "singleflight",
+    # context_cache
+    "get_context_cache": "context_cache",
+    # usage
+    "get_usage_store": "usage",
+    # answer_cache
+    "get_answer_store": "answer_cache",
+    # jobs
+    "get_job_queue": "jobs",
+    # followups
+    "suggest_followups": "followups",
+    "PrefetchCache": "followups",
+    # shared_state
+    "get_shared_state": "shared_state",
+    "load_conversation": "shared_state",
+    "save_conversation": "shared_state",
+    "clear_conversation": "shared_state",
+    # telemetry
+    "span": "telemetry",
+    "traced": "telemetry",
+    # retrieval
+    "retrieve_contexts": "retrieval",
+    "multi_corpus_retrieve": "retrieval",
+    "reciprocal_rank_fusion": "retrieval",
+    # lexical_index
+    "get_lexical_index": "lexical_index",
+    # rag
+    "get_rag_tool": "rag",
+    "list_corpora": "rag",
+    # adk_agent
+    "RAG_SYSTEM_INSTRUCTION": "adk_agent",
+    "ADKResponse": "adk_agent",
+    "ADKChatSession": "adk_agent",
+    "create_adk_agent": "adk_agent",
+    "get_adk_agent": "adk_agent",
+    "get_adk_session": "adk_agent",
+}
+
+_SUBMODULES = {"config", "auth", "credential_cache", "clients", "scheduler", "resilience", "singleflight", "retrieval", "lexical_index", "rerank", "citations", "context_cache", "usage", "telemetry", "query_log", "answer_cache", "jobs", "bulk_import", "shared_state", "followups", "storage", "rag", "adk_agent", "warmup"}
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    module_name = _LAZY_EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module_name}", __name__), name)
+    # Cache on the package so later lookups skip __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_EXPORTS) | _SUBMODULES)
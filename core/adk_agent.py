@@ -1,10 +1,25 @@
+import time
 import streamlit as st
-import vertexai
 from vertexai.preview import rag
 from google.adk.agents import Agent
 from google.adk.tools.retrieval.vertex_ai_rag_retrieval import VertexAiRagRetrieval
+from google.genai import errors as genai_errors
+from google.genai import types
 from . import config
-import vertexai.preview.generative_models as gen_models
+from .rag import get_rag_tool
+from .scheduler import estimate_tokens, get_scheduler
+from .resilience import fallback_model_for, get_hedged_executor
+from .singleflight import fingerprint, get_singleflight, normalize_prompt
+from .retrieval import build_grounded_prompt, is_access_denied, is_small_talk, multi_corpus_retrieve
+from . import lexical_index
+from .rerank import rerank as rerank_chunks
+from .storage import get_retrieval_params, load_rag_engines
+from .context_cache import get_context_cache
+from .usage import get_usage_store
+from .query_log import get_query_log
+from .answer_cache import answer_key, get_answer_store
+from .telemetry import span, traced
+from .citations import format_references, references_from_chunks, references_from_grounding, strip_citation_instructions
 
 # Reuse the instruction from the original project
 RAG_SYSTEM_INSTRUCTION = """
@@ -46,78 +61,405 @@ enough information.
 
 class ADKResponse:
     """Mock response object to match what app.py expects (text + sources)"""
-    def __init__(self, text, sources=None):
+    def __init__(self, text, sources=None, model=None):
         self.text = text
         self.sources = sources or []
+        # Model that actually answered (may be the hedging fallback)
+        self.model = model
 
 class ADKChatSession:
     """Wrapper to mimic GenerativeModel ChatSession but using ADK Agent"""
-    def __init__(self, agent, corpus_name=None):
+    def __init__(self, agent, corpus_names=None, clients=None, hybrid=None, rerank=None, retrieval_params=None,
+                 code_citations=None):
+        if isinstance(corpus_names, str):
+            corpus_names = [corpus_names]
         self.agent = agent
-        self.corpus_name = corpus_name
+        self.corpus_names = list(corpus_names or [])
+        # Pooled VertexClients for the user who owns this session
+        self.clients = clients
+        # Fuse local BM25 hits with Vertex results (only for corpora that have an index)
+        self.hybrid = config.HYBRID_RETRIEVAL if hybrid is None else hybrid
+        # Rerank retrieved chunks locally and send only the best few to the model
+        self.rerank = config.RERANK_ENABLED if rerank is None else rerank
+        # Per-corpus similarity_top_k / vector_distance_threshold (tuned values from rag_engines.json)
+        self.retrieval_params = retrieval_params or {}
+        # Append the reference list from grounding metadata instead of having the model write it
+        self.code_citations = config.CODE_CITATIONS if code_citations is None else code_citations
+        self.instruction = (
+            strip_citation_instructions(agent.instruction) if self.code_citations else agent.instruction
+        )
         self.history = []
 
-    def send_message(self, prompt):
+    @property
+    def corpus_name(self):
+        return self.corpus_names[0] if self.corpus_names else None
+
+    @property
+    def uses_client_retrieval(self):
+        # The Vertex retrieval tool takes a single corpus, cannot mix in lexical hits
+        # and hands every chunk to the model; in those cases chunks are retrieved
+        # here, fused and reranked before generation.
+        if not self.corpus_names:
+            return False
+        if len(self.corpus_names) > 1 or self.rerank:
+            return True
+        return bool(self.hybrid and self.corpus_names and lexical_index.has_index(self.corpus_name))
+
+    def _build_contents(self, prompt):
+        contents = [
+            types.Content(role=turn["role"], parts=[types.Part(text=part) for part in turn["parts"]])
+            for turn in self.history
+        ]
+        contents.append(types.Content(role="user", parts=[types.Part(text=prompt)]))
+        return contents
+
+    def _generate_config(self, model, tools, inline=False):
+        # Bound each attempt so abandoned hedges do not linger
+        http_options = types.HttpOptions(timeout=int(config.GENERATION_DEADLINE * 1000))
+        cached = None
+        if not inline:
+            with span("chat.context_cache", model=model):
+                cached = get_context_cache().lookup(self.clients, model, self.instruction, tools)
+        if cached:
+            # The instruction and tools live in the cached prefix and must not be repeated
+            return types.GenerateContentConfig(cached_content=cached, http_options=http_options)
+        return types.GenerateContentConfig(system_instruction=self.instruction, tools=tools, http_options=http_options)
+
+    def _generate(self, model, contents, tools, estimated):
+        generate_config = self._generate_config(model, tools)
         try:
-            # We append the history to the prompt context manually for now
-            # as basic Agents might be stateless.
-            # However, when delegating to GenerativeModel.start_chat, we can pass history there.
-            
-            # Re-instantiate a GenerativeModel using the ADK-defined configuration
-            # This ensures we are "Using the ADK Agent" definition.
-            
-            gm_tool = None
-            if self.corpus_name:
-                 # Reconstruct the Vertex Tool directly from known config
-                 # This avoids accessing internal _rag_resources of the ADK wrapper which caused AttributeError
-                 gm_tool = rag.Retrieval(
-                    source=rag.VertexRagStore(
-                        rag_resources=[rag.RagResource(rag_corpus=self.corpus_name)],
-                        similarity_top_k=10, 
-                        vector_distance_threshold=0.5
-                    )
-                 )
-                 gm_tool = gen_models.Tool.from_retrieval(gm_tool)
-            
-            # Accessing properties from the ADK Agent
-            # Assuming 'model' and 'instruction' are accessible attributes
-            model = gen_models.GenerativeModel(
-                model_name=self.agent.model, 
-                tools=[gm_tool] if gm_tool else [],
-                system_instruction=[self.agent.instruction]
+            response = self._call_model(model, contents, generate_config, estimated)
+        except genai_errors.ClientError as e:
+            if not generate_config.cached_content or e.code not in (400, 403, 404):
+                raise
+            # Cache deleted or expired behind our back: recreate next turn, answer inline now
+            get_context_cache().invalidate(generate_config.cached_content)
+            response = self._call_model(model, contents, self._generate_config(model, tools, inline=True), estimated)
+        return response
+
+    def _call_model(self, model, contents, generate_config, estimated):
+        with span("chat.generation", model=model, cached=bool(generate_config.cached_content)):
+            response = self._schedule_model(model, contents, generate_config, estimated)
+        if response.usage_metadata:
+            get_scheduler().settle(model, estimated, response.usage_metadata.total_token_count)
+        return response
+
+    def _schedule_model(self, model, contents, generate_config, estimated):
+        return self.clients.schedule(
+            lambda: self.clients.genai.models.generate_content(
+                model=model,
+                contents=contents,
+                config=generate_config,
+            ),
+            model=model,
+            tokens=estimated,
+        )
+
+    def retrieve(self, prompt):
+        """Client-side retrieval for `prompt` as the next turn: fan-out, fusion and reranking."""
+        # Follow-ups ("and the second one?") retrieve better with the previous question
+        previous = [t["parts"][0] for t in self.history if t["role"] == "user"][-1:]
+        query = "\n".join(previous + [prompt])
+        with span("chat.retrieval", corpora=len(self.corpus_names), hybrid=bool(self.hybrid)):
+            chunks, _ = multi_corpus_retrieve(
+                self.clients, self.corpus_names, query, params=self.retrieval_params, hybrid=self.hybrid
             )
-            
-            # Start a chat session (or use existing history)
-            chat = model.start_chat(history=self.history)
-            response = chat.send_message(prompt)
-            
-            # Update history
-            self.history.append({"role": "user", "parts": [prompt]})
-            self.history.append({"role": "model", "parts": [response.text]})
-            
-            # Extract sources
-            sources = []
-            if response.candidates and response.candidates[0].grounding_metadata:
-                metadata = response.candidates[0].grounding_metadata
-                if hasattr(metadata, 'grounding_chunks'):
-                    for chunk in metadata.grounding_chunks:
-                        if hasattr(chunk, 'retrieved_context'):
-                            sources.append({
-                                "uri": chunk.retrieved_context.uri,
-                                "text": chunk.retrieved_context.text
-                            })
-
-            return ADKResponse(response.text, sources)
+        if self.rerank:
+            with span("chat.rerank"):
+                chunks = rerank_chunks(query, chunks)
+        return chunks
+
+    def _prepare(self, prompt, chunks=None):
+        """Retrieval (when done client-side) and request contents for one turn.
+
+        `chunks` are excerpts retrieved ahead of time (a prefetched follow-up);
+        they are used as is, even by sessions that normally leave retrieval to
+        the model's tool. Small talk is not retrieved for, just as the tool is
+        left unused for it. Returns `(chunks, tools, contents, estimated_tokens,
+        retrieval_seconds)`; `chunks` is None when the model uses the retrieval
+        tool itself or nothing was retrieved.
+        """
+        tools = None
+        retrieval_s = 0.0
+        if chunks is None and self.uses_client_retrieval:
+            if not is_small_talk(prompt):
+                started = time.monotonic()
+                chunks = self.retrieve(prompt)
+                retrieval_s = time.monotonic() - started
+        elif chunks is None and self.corpus_name:
+            tools = [get_rag_tool(self.corpus_name, **self.retrieval_params.get(self.corpus_name, {}))]
+
+        # The ADK Agent holds the model and instruction; generation goes through
+        # the session owner's pooled client rather than global vertexai state.
+        user_text = build_grounded_prompt(prompt, chunks) if chunks is not None else prompt
+        contents = self._build_contents(user_text)
+        estimated = estimate_tokens(self.instruction, user_text, *(p for t in self.history for p in t["parts"]))
+        return chunks, tools, contents, estimated, retrieval_s
+
+    def _record_usage(self, model, usage_metadata, retrieval_s, generation_s):
+        # With the retrieval tool, retrieval time is part of generation time
+        get_usage_store().record(
+            self.clients.principal if self.clients else None,
+            self.corpus_names,
+            model,
+            usage_metadata,
+            retrieval_s,
+            generation_s,
+        )
+
+    def _answer(self, prompt, chunks=None):
+        """Retrieval and generation for one turn. Returns `(model, response, chunks, timings)`."""
+        chunks, tools, contents, estimated, retrieval_s = self._prepare(prompt, chunks)
+
+        # Race a fallback model if the primary is slow, skipping models whose breaker is open
+        fallback = fallback_model_for(self.agent.model) if config.HEDGING_ENABLED else None
+        started = time.monotonic()
+        model, response = get_hedged_executor().call(
+            lambda m: self._generate(m, contents, tools, estimated),
+            primary=self.agent.model,
+            fallback=fallback,
+        )
+        generation_s = time.monotonic() - started
+        # Recorded here, by the single-flight leader, so shared answers are counted once
+        self._record_usage(model, response.usage_metadata, retrieval_s, generation_s)
+        return model, response, chunks, {"retrieval_s": retrieval_s, "generation_s": generation_s}
+
+    def _log_turn(self, prompt, model, started, timings=None, usage_metadata=None, chunks=None, **extra):
+        """Queues one entry for the query log (written off the request path)."""
+        entry = {
+            "user": self.clients.principal if self.clients else None,
+            "engines": [name.split("/")[-1] for name in self.corpus_names],
+            "model": model or self.agent.model,
+            "query": prompt,
+            "normalized": normalize_prompt(prompt),
+            # Same conversation + question + configuration => the answer could have been cached
+            "history_turns": len(self.history) // 2,
+            "stages": dict(timings or {}, total_s=time.monotonic() - started),
+            "chunks": len(chunks) if chunks is not None else None,
+            "hybrid": bool(self.hybrid),
+            "rerank": bool(self.rerank),
+        }
+        if usage_metadata is not None:
+            entry["tokens"] = {
+                "prompt": usage_metadata.prompt_token_count,
+                "cached": usage_metadata.cached_content_token_count,
+                "output": usage_metadata.candidates_token_count,
+                "total": usage_metadata.total_token_count,
+            }
+        entry.update(extra)
+        get_query_log().log(entry)
+
+    @staticmethod
+    def _sources_and_references(chunks, grounding_metadata):
+        """Sources shown under the answer and the per-file references built from them."""
+        sources = []
+        references = []
+        if chunks is not None:
+            sources = [{"uri": c["uri"], "text": c["text"]} for c in chunks]
+            references = references_from_chunks(chunks)
+        elif grounding_metadata:
+            for chunk in grounding_metadata.grounding_chunks or []:
+                if chunk.retrieved_context:
+                    sources.append({
+                        "uri": chunk.retrieved_context.uri,
+                        "text": chunk.retrieved_context.text
+                    })
+            references = references_from_grounding(grounding_metadata)
+        return sources, references
+
+    def _complete_turn(self, prompt, text, model, sources, references):
+        """Updates history and assembles the ADKResponse."""
+        # Update history (the original prompt, not the excerpt-augmented one)
+        self.history.append({"role": "user", "parts": [prompt]})
+        self.history.append({"role": "model", "parts": [text]})
+
+        # History keeps the bare answer, so references are not re-sent on later turns
+        if self.code_citations:
+            text += format_references(references)
+
+        return ADKResponse(text, sources, model)
+
+    def _answer_cache_key(self, prompt):
+        """Key in the answer store, or None when this turn's answer is not cacheable."""
+        # Only opening questions: later turns depend on the conversation so far
+        if self.history or not self.corpus_names:
+            return None
+        params = {name: self.retrieval_params.get(name) or get_retrieval_params(name) for name in self.corpus_names}
+        return answer_key(self.corpus_names, self.agent.model, self.instruction, self.hybrid, self.rerank, params, prompt)
+
+    def _cached_answer(self, key):
+        """Stored answer for `key`, if this session's user may read the documents it was built from."""
+        if not key:
+            return None
+        cached = get_answer_store().get(key)
+        # The answer was generated under another identity; never skip the IAM check
+        if cached and not (self.clients and self.clients.can_read(self.corpus_names)):
+            return None
+        return cached
+
+    def _store_answer(self, key, prompt, text, model, sources, references):
+        if key and text:
+            get_answer_store().put(key, self.corpus_names, prompt, {
+                "text": text, "model": model, "sources": sources, "references": references,
+            })
+
+    def _coalesced_answer(self, prompt):
+        """`_answer` shared with identical questions in flight. Returns `(answer, shared)`.
+
+        Concurrent calls with the same corpora, retrieval settings, model,
+        instruction, conversation and (normalized) question share one upstream
+        call, whichever users ask. A follower only takes the leader's answer
+        after the same IAM check as stored answers, and retries itself when the
+        leader was refused access.
+        """
+        flight_key = (
+            tuple(self.corpus_names),
+            fingerprint(self.retrieval_params),
+            self.hybrid,
+            self.rerank,
+            self.agent.model,
+            fingerprint(self.instruction),
+            normalize_prompt(prompt),
+            fingerprint(self.history),
+        )
+
+        def lead():
+            # Failures are handed to followers as values, so they can tell the leader's from their own
+            try:
+                return self._answer(prompt), None
+            except Exception as e:
+                return None, e
+
+        (answer, error), shared = get_singleflight().do(flight_key, lead)
+        if shared:
+            denied = error is not None and is_access_denied(error)
+            if denied or (error is None and not (self.clients and self.clients.can_read(self.corpus_names))):
+                # The leader ran under another identity; its outcome does not apply to this user
+                return self._answer(prompt), False
+        if error is not None:
+            raise error
+        return answer, shared
+
+    @traced("chat.turn")
+    def send_message(self, prompt, refresh_cache=False, chunks=None):
+        """Answers one message. `refresh_cache` skips the answer store lookup but still
+        stores the new answer (used by the warming job); `chunks` skips retrieval
+        with excerpts fetched in advance."""
+        started = time.monotonic()
+        prefetched = chunks is not None
+        try:
+            cache_key = self._answer_cache_key(prompt)
+            cached = self._cached_answer(cache_key) if not refresh_cache else None
+            if cached:
+                self._log_turn(prompt, cached["model"], started, cache_hit=True)
+                return self._complete_turn(
+                    prompt, cached["text"], cached["model"], cached["sources"], cached["references"]
+                )
+
+            if prefetched:
+                # Excerpts fetched ahead for this session; not comparable with a fresh retrieval
+                (model, response, chunks, timings), shared = self._answer(prompt, chunks), False
+            else:
+                (model, response, chunks, timings), shared = self._coalesced_answer(prompt)
+            self._log_turn(prompt, model, started, timings, response.usage_metadata, chunks, shared=shared,
+                           prefetched=prefetched)
+            metadata = response.candidates[0].grounding_metadata if response.candidates else None
+            sources, references = self._sources_and_references(chunks, metadata)
+            text = response.text or ""
+            if not shared:
+                self._store_answer(cache_key, prompt, text, model, sources, references)
+            return self._complete_turn(prompt, text, model, sources, references)
 
         except Exception as e:
+            self._log_turn(prompt, None, started, error=str(e))
             return ADKResponse(f"Error executing ADK Agent: {str(e)}")
 
-def create_adk_agent(model_name, corpus_name, instruction=None):
+    def _open_stream(self, model, contents, tools, estimated, inline=False):
+        """Starts a streamed generation through the scheduler. Returns `(first_chunk, stream)`.
+
+        The request is only sent when the stream is first read, so the first
+        chunk is pulled inside the scheduled call; quota errors then get the
+        scheduler's retries like any other request.
+        """
+        generate_config = self._generate_config(model, tools, inline)
+
+        def start():
+            stream = self.clients.genai.models.generate_content_stream(
+                model=model, contents=contents, config=generate_config
+            )
+            return next(stream, None), stream
+
+        try:
+            return self.clients.schedule(start, model=model, tokens=estimated)
+        except genai_errors.ClientError as e:
+            if inline or not generate_config.cached_content or e.code not in (400, 403, 404):
+                raise
+            get_context_cache().invalidate(generate_config.cached_content)
+            return self._open_stream(model, contents, tools, estimated, inline=True)
+
+    @traced("chat.turn_stream")
+    def stream_message(self, prompt, chunks=None):
+        """Like send_message, but yields the answer text as it is generated.
+
+        Yields `str` deltas and finally one ADKResponse holding the full text and
+        sources. Streams are neither hedged nor coalesced: racing two streams
+        would duplicate output, and a shared stream has a single reader.
+        """
+        turn_started = time.monotonic()
+        try:
+            cache_key = self._answer_cache_key(prompt)
+            cached = self._cached_answer(cache_key)
+            if cached:
+                self._log_turn(prompt, cached["model"], turn_started, cache_hit=True, streamed=True)
+                yield cached["text"]
+                yield self._complete_turn(
+                    prompt, cached["text"], cached["model"], cached["sources"], cached["references"]
+                )
+                return
+
+            prefetched = chunks is not None
+            chunks, tools, contents, estimated, retrieval_s = self._prepare(prompt, chunks)
+            model = self.agent.model
+            started = time.monotonic()
+            with span("chat.generation", model=model, streamed=True):
+                first, stream = self._open_stream(model, contents, tools, estimated)
+                parts = []
+                usage_metadata = None
+                grounding_metadata = None
+                response_chunk = first
+                while response_chunk is not None:
+                    if response_chunk.text:
+                        parts.append(response_chunk.text)
+                        yield response_chunk.text
+                    if response_chunk.usage_metadata:
+                        usage_metadata = response_chunk.usage_metadata
+                    if response_chunk.candidates and response_chunk.candidates[0].grounding_metadata:
+                        grounding_metadata = response_chunk.candidates[0].grounding_metadata
+                    response_chunk = next(stream, None)
+            if usage_metadata:
+                get_scheduler().settle(model, estimated, usage_metadata.total_token_count)
+            generation_s = time.monotonic() - started
+            self._record_usage(model, usage_metadata, retrieval_s, generation_s)
+            timings = {"retrieval_s": retrieval_s, "generation_s": generation_s}
+            self._log_turn(prompt, model, turn_started, timings, usage_metadata, chunks, streamed=True,
+                           prefetched=prefetched)
+            text = "".join(parts)
+            sources, references = self._sources_and_references(chunks, grounding_metadata)
+            self._store_answer(cache_key, prompt, text, model, sources, references)
+            yield self._complete_turn(prompt, text, model, sources, references)
+
+        except Exception as e:
+            self._log_turn(prompt, None, turn_started, error=str(e), streamed=True)
+            yield ADKResponse(f"Error executing ADK Agent: {str(e)}")
+
+def create_adk_agent(model_name, corpus_names, instruction=None, similarity_top_k=None, vector_distance_threshold=None):
     """Creates an ADK Agent instance configured with the given parameters."""
-    
+    if isinstance(corpus_names, str):
+        corpus_names = [corpus_names]
+
     # Define Tools
     tools = []
-    if corpus_name:
+    if corpus_names:
         # Create ADK Retrieval Tool
         rag_retrieval_tool = VertexAiRagRetrieval(
             name='retrieve_rag_documentation',
@@ -126,9 +468,11 @@ def create_adk_agent(model_name, corpus_name, instruction=None):
                 rag.RagResource(
                     rag_corpus=corpus_name
                 )
+                for corpus_name in corpus_names
             ],
-            similarity_top_k=10,
-            vector_distance_threshold=0.5,
+            similarity_top_k=similarity_top_k or config.SIMILARITY_TOP_K,
+            vector_distance_threshold=(vector_distance_threshold if vector_distance_threshold is not None
+                                       else config.VECTOR_DISTANCE_THRESHOLD),
         )
         tools.append(rag_retrieval_tool)
 
@@ -146,8 +490,24 @@ def create_adk_agent(model_name, corpus_name, instruction=None):
     return agent
 
 @st.cache_resource
-def get_adk_session(model_name, corpus_name, instruction=None):
-    """Factory to create and cache the session/agent wrapper."""
-    agent = create_adk_agent(model_name, corpus_name, instruction)
-    # Pass corpus_name explicitly to avoid reading from ADK wrapper internals
-    return ADKChatSession(agent, corpus_name)
+def get_adk_agent(model_name, corpus_names, instruction=None, similarity_top_k=None, vector_distance_threshold=None):
+    """Creates and caches the (stateless) agent definition."""
+    return create_adk_agent(model_name, corpus_names, instruction, similarity_top_k, vector_distance_threshold)
+
+@traced("chat.session_create")
+def get_adk_session(model_name, corpus_names, instruction=None, clients=None, hybrid=None, rerank=None,
+                    code_citations=None):
+    """Creates a chat session for one user over one or more corpora.
+
+    Sessions hold conversation history and the user's clients, so only the agent
+    definition is cached and shared.
+    """
+    if isinstance(corpus_names, str):
+        corpus_names = [corpus_names]
+    corpus_names = tuple(corpus_names or ())
+    engines = load_rag_engines()
+    retrieval_params = {name: get_retrieval_params(name, engines) for name in corpus_names}
+    primary_params = retrieval_params.get(corpus_names[0], {}) if corpus_names else {}
+    agent = get_adk_agent(model_name, corpus_names, instruction, **primary_params)
+    # Pass corpus names explicitly to avoid reading from ADK wrapper internals
+    return ADKChatSession(agent, corpus_names, clients, hybrid, rerank, retrieval_params, code_citations)
@@ -0,0 +1,176 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import streamlit as st
+from . import config
+from .shared_state import bump_corpus_generation, corpus_generations, get_shared_state
+from .singleflight import fingerprint, normalize_prompt
+
+
+def answer_key(corpus_names, model, instruction, hybrid, rerank, retrieval_params, prompt):
+    """Everything that determines a first-turn answer: engines, model, instruction, retrieval mode and
+    settings, question.
+
+    `retrieval_params` maps corpus names to their resolved `similarity_top_k` /
+    `vector_distance_threshold` (`storage.get_retrieval_params`), so retuning an
+    engine stops serving answers built from the old excerpts.
+    """
+    names = sorted(corpus_names)
+    params = [retrieval_params.get(name) or {} for name in names]
+    return fingerprint([names, model, fingerprint(instruction), bool(hybrid), bool(rerank), fingerprint(params),
+                        normalize_prompt(prompt)])
+
+
+class AnswerStore:
+    """Precomputed and previously generated answers to first-turn questions, in SQLite.
+
+    Sessions read through it: a hit is returned without retrieval or
+    generation, and a miss is answered normally and then stored. Entries are
+    dropped after `ttl` seconds or as soon as one of their corpora changes.
+    The store also remembers a fingerprint of each corpus' file list, so the
+    warming job can tell which engines changed since they were last warmed.
+    """
+
+    def __init__(self, path=None, ttl=None):
+        self.path = path or config.ANSWER_CACHE_DB
+        self.ttl = ttl or config.ANSWER_CACHE_TTL
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY,
+                corpora TEXT NOT NULL,
+                prompt TEXT,
+                expires REAL NOT NULL,
+                payload TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS corpus_state (
+                corpus TEXT PRIMARY KEY,
+                fingerprint TEXT,
+                warmed_at REAL
+            );
+        """)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM answers WHERE key = ? AND expires > ?", (key, time.time())
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, corpus_names, prompt, payload):
+        # Corpora stored as ",id1,id2," so a corpus can be matched with LIKE
+        corpora = "," + ",".join(name.split("/")[-1] for name in corpus_names) + ","
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)",
+                (key, corpora, prompt, time.time() + self.ttl, json.dumps(payload, ensure_ascii=False)),
+            )
+
+    def invalidate_corpus(self, corpus_name):
+        """Drops every answer that drew on this corpus (after an upload or delete)."""
+        corpus_id = corpus_name.split("/")[-1]
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM answers WHERE corpora LIKE ?", (f"%,{corpus_id},%",))
+            self._conn.execute("UPDATE corpus_state SET fingerprint = NULL WHERE corpus = ?", (corpus_id,))
+        # Cached retrieval results for the corpus go stale too
+        bump_corpus_generation(corpus_name)
+
+    def corpus_state(self, corpus_name):
+        """`(fingerprint, warmed_at)` recorded by the last warming of this corpus, or `(None, None)`."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint, warmed_at FROM corpus_state WHERE corpus = ?", (corpus_name.split("/")[-1],)
+            ).fetchone()
+        return tuple(row) if row else (None, None)
+
+    def mark_warmed(self, corpus_name, corpus_fingerprint):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO corpus_state VALUES (?, ?, ?)",
+                (corpus_name.split("/")[-1], corpus_fingerprint, time.time()),
+            )
+
+    def stats(self):
+        with self._lock:
+            live = self._conn.execute("SELECT COUNT(*) FROM answers WHERE expires > ?", (time.time(),)).fetchone()[0]
+            return {"answers": live, "hits": self.hits, "misses": self.misses}
+
+
+class SharedAnswerStore:
+    """The answer store kept in the shared state, so every replica reads and warms the same answers.
+
+    Each answer records the generations of its corpora. Invalidating a corpus
+    bumps its generation, which makes all of its answers misses at once.
+    """
+
+    def __init__(self, backend, ttl=None):
+        self.backend = backend
+        self.ttl = ttl or config.ANSWER_CACHE_TTL
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.backend.get(f"answer:{key}")
+        if entry is not None and entry["generations"] != corpus_generations(entry["generations"]):
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["payload"]
+
+    def put(self, key, corpus_names, prompt, payload):
+        self.backend.set(
+            f"answer:{key}",
+            {"generations": corpus_generations(corpus_names), "prompt": prompt, "payload": payload},
+            ttl=self.ttl,
+        )
+
+    def invalidate_corpus(self, corpus_name):
+        bump_corpus_generation(corpus_name)
+        self.backend.delete(f"corpus_state:{corpus_name.split('/')[-1]}")
+
+    def corpus_state(self, corpus_name):
+        state = self.backend.get(f"corpus_state:{corpus_name.split('/')[-1]}")
+        return (state["fingerprint"], state["warmed_at"]) if state else (None, None)
+
+    def mark_warmed(self, corpus_name, corpus_fingerprint):
+        self.backend.set(
+            f"corpus_state:{corpus_name.split('/')[-1]}",
+            {"fingerprint": corpus_fingerprint, "warmed_at": time.time()},
+        )
+
+    def stats(self):
+        return {"backend": "shared", "hits": self.hits, "misses": self.misses}
+
+
+class _DisabledStore:
+    def get(self, key):
+        return None
+
+    def put(self, key, corpus_names, prompt, payload):
+        pass
+
+    def invalidate_corpus(self, corpus_name):
+        bump_corpus_generation(corpus_name)
+
+    def stats(self):
+        return {"enabled": False}
+
+
+@st.cache_resource
+def get_answer_store():
+    if not config.ANSWER_CACHE_ENABLED:
+        return _DisabledStore()
+    backend = get_shared_state()
+    return SharedAnswerStore(backend) if backend.shared else AnswerStore()
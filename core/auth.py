@@ -1,10 +1,19 @@
 import streamlit as st
-import google.oauth2.credentials
+import streamlit.components.v1 as components
 import google_auth_oauthlib.flow
-from google.auth.transport.requests import Request
+import base64
+import hashlib
+import hmac
 import os
-import json
+import secrets
+import time
 from . import config
+from . import credential_cache
+from .telemetry import span, traced
+
+# Google may return the granted scopes in a different form (e.g. "email" for
+# userinfo.email); don't treat that as an error.
+os.environ.setdefault("OAUTHLIB_RELAX_TOKEN_SCOPE", "1")
 
 def get_redirect_uri():
     try:
@@ -26,29 +35,81 @@ def get_redirect_uri():
 
 REDIRECT_URI = get_redirect_uri()
 
-def load_credentials():
-    if os.path.exists(config.TOKEN_FILE):
-        try:
-            with open(config.TOKEN_FILE, "r") as f:
-                data = json.load(f)
-                return google.oauth2.credentials.Credentials.from_authorized_user_info(data)
-        except Exception as e:
-            st.error(f"Error loading credentials: {e}")
-            return None
-    return None
+def load_credentials(user_id):
+    return credential_cache.get_credential_cache().get(user_id)
+
+def save_credentials(creds, user_id):
+    credential_cache.get_credential_cache().put(user_id, creds)
 
-def save_credentials(creds):
+# -------------------------------
+# Session cookie
+# -------------------------------
+# Streamlit session state ends with the browser tab (or the process), while the
+# credentials persist in the credential cache. A signed cookie holding the user
+# id links a new browser session back to them. Logging out deletes the stored
+# credentials, which invalidates every cookie issued for that user.
+_secret = None
+
+def _session_secret():
+    global _secret
+    if _secret is None:
+        if config.SESSION_SECRET:
+            _secret = config.SESSION_SECRET.encode("utf-8")
+        elif os.path.exists(config.SESSION_SECRET_FILE):
+            with open(config.SESSION_SECRET_FILE, "rb") as f:
+                _secret = f.read()
+        else:
+            os.makedirs(os.path.dirname(config.SESSION_SECRET_FILE), exist_ok=True)
+            fd = os.open(config.SESSION_SECRET_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                _secret = secrets.token_bytes(32)
+                f.write(_secret)
+    return _secret
+
+def sign_session(user_id, now=None):
+    """Cookie value `<user id>.<expiry>.<signature>` for `user_id`."""
+    payload = "{}.{}".format(
+        base64.urlsafe_b64encode(user_id.encode("utf-8")).decode("ascii").rstrip("="),
+        int((now or time.time()) + config.SESSION_TTL),
+    )
+    signature = hmac.new(_session_secret(), payload.encode("ascii"), hashlib.sha256).hexdigest()
+    return f"{payload}.{signature}"
+
+def verify_session(value, now=None):
+    """The user id in a valid, unexpired session cookie, else None."""
     try:
-        with open(config.TOKEN_FILE, "w") as f:
-            f.write(creds.to_json())
-    except Exception as e:
-        st.error(f"Error saving credentials: {e}")
+        encoded, expires, signature = value.split(".")
+        expected = hmac.new(_session_secret(), f"{encoded}.{expires}".encode("ascii"), hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(signature, expected) or int(expires) < (now or time.time()):
+            return None
+        return base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4)).decode("utf-8")
+    except (ValueError, AttributeError, UnicodeError):
+        return None
+
+def _write_session_cookie(value, max_age):
+    # Streamlit cannot set cookies from Python; a zero-height component writes it on the app's origin
+    secure = "; Secure" if REDIRECT_URI.startswith("https") else ""
+    components.html(
+        f"<script>window.parent.document.cookie = "
+        f"'{config.SESSION_COOKIE}={value}; path=/; max-age={max_age}; SameSite=Lax{secure}';</script>",
+        height=0,
+    )
+
+def _restore_session():
+    """Sets `user_id` from the session cookie when its credentials are still stored."""
+    value = st.context.cookies.get(config.SESSION_COOKIE)
+    user_id = verify_session(value) if value else None
+    if user_id and credential_cache.get_credential_cache().get(user_id) is not None:
+        st.session_state.user_id = user_id
 
 def logout():
-    if os.path.exists(config.TOKEN_FILE):
-        os.remove(config.TOKEN_FILE)
+    user_id = st.session_state.get("user_id")
+    if user_id:
+        credential_cache.get_credential_cache().remove(user_id)
+        del st.session_state.user_id
     if "credentials" in st.session_state:
         del st.session_state.credentials
+    st.session_state.clear_session_cookie = True
 
 def get_flow_from_secrets():
     """Creates an OAuth Flow object from Streamlit secrets or Env Vars."""
@@ -93,35 +154,45 @@ def get_flow_from_secrets():
     )
     return flow
 
+@traced("auth.perform_auth")
 def perform_auth():
     """Handles the OAuth flow."""
-    # 1. Check if already authenticated in session or token file
-    if "credentials" not in st.session_state:
-        loaded_creds = load_credentials()
-        if loaded_creds:
-            st.session_state.credentials = loaded_creds
-
-    if "credentials" in st.session_state:
-        creds = st.session_state.credentials
-        if creds.valid:
-            return True
-        if creds.expired and creds.refresh_token:
-            try:
-                creds.refresh(Request())
-                save_credentials(creds)
+    # 1. Check if already authenticated in this session, or in an earlier one
+    # (session cookie). The credential cache refreshes tokens in the background,
+    # so this path normally never waits on an OAuth round trip.
+    if not st.session_state.get("user_id") and not st.session_state.get("clear_session_cookie"):
+        _restore_session()
+    user_id = st.session_state.get("user_id")
+    if user_id:
+        cache = credential_cache.get_credential_cache()
+        creds = cache.get(user_id)
+        if creds is not None:
+            st.session_state.credentials = creds
+            if st.session_state.pop("set_session_cookie", False):
+                _write_session_cookie(sign_session(user_id), config.SESSION_TTL)
+            # Fall back to a synchronous refresh only if the refresher fell behind
+            if creds.valid:
                 return True
-            except:
-                st.session_state.credentials = None
-    
+            with span("auth.sync_refresh"):
+                if cache.refresh(user_id, force=True):
+                    return True
+        st.session_state.credentials = None
+
     # 2. Check for auth code in URL (Redirect back from Google)
     if "code" in st.query_params:
         code = st.query_params["code"]
         try:
             flow = get_flow_from_secrets()
-            flow.fetch_token(code=code)
+            with span("auth.fetch_token"):
+                flow.fetch_token(code=code)
             creds = flow.credentials
+            user_id = credential_cache.user_id_from_credentials(creds)
+            st.session_state.user_id = user_id
             st.session_state.credentials = creds
-            save_credentials(creds)
+            save_credentials(creds, user_id)
+            # Written on the next run; this one ends with the rerun below
+            st.session_state.set_session_cookie = True
+            st.session_state.pop("clear_session_cookie", None)
             # Clear query params to clean URL
             st.query_params.clear()
             st.rerun()
@@ -135,6 +206,8 @@ def login_page():
     """Displays the login button."""
     st.header("Authentication Required")
     st.write("Please log in with your Google Account to access the RAG Engine.")
+    if st.session_state.pop("clear_session_cookie", False):
+        _write_session_cookie("", 0)
     
     flow = get_flow_from_secrets()
     auth_url, _ = flow.authorization_url(prompt='consent')
@@ -159,7 +232,8 @@ def show_sidebar_auth():
     st.sidebar.divider()
 
     if "credentials" in st.session_state and st.session_state.credentials:
-         st.sidebar.success(f"Logged in")
+         user_id = st.session_state.get("user_id")
+         st.sidebar.success(f"Logged in as {user_id}" if user_id else "Logged in")
          if st.sidebar.button("Logout"):
             logout()
             st.rerun()
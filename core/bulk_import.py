@@ -0,0 +1,153 @@
+import concurrent.futures
+import json
+import os
+import time
+import uuid
+from . import config
+from . import lexical_index
+from .answer_cache import get_answer_store
+
+
+def _unique_names(paths, display_names=None):
+    """Object names for a batch: the file name, with a counter where two files share one."""
+    seen = {}
+    names = []
+    for i, path in enumerate(paths):
+        name = (display_names[i] if display_names else None) or os.path.basename(path)
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        if count:
+            stem, extension = os.path.splitext(name)
+            name = f"{stem} ({count + 1}){extension}"
+        names.append(name)
+    return names
+
+
+def stage_files(clients, bucket_name, prefix, paths, names, progress=None):
+    """Uploads local files to `gs://bucket/prefix/<name>` in parallel. Returns the GCS URIs."""
+    bucket = clients.storage.bucket(bucket_name)
+    done = 0
+
+    def upload(path, name):
+        blob = bucket.blob(f"{prefix}/{name}")
+        blob.upload_from_filename(path)
+        return f"gs://{bucket_name}/{blob.name}"
+
+    uris = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=config.STAGING_UPLOAD_WORKERS) as executor:
+        for uri in executor.map(upload, paths, names):
+            uris.append(uri)
+            done += 1
+            if progress:
+                progress(done / len(paths), f"Staged {done}/{len(paths)} files")
+    return uris
+
+
+def read_partial_failures(clients, bucket_name, prefix):
+    """Per-file failure records Vertex wrote under the partial-failure sink (JSON lines)."""
+    failures = []
+    for blob in clients.storage.list_blobs(bucket_name, prefix=prefix):
+        for line in blob.download_as_text().splitlines():
+            if not line.strip():
+                continue
+            try:
+                failures.append(json.loads(line))
+            except ValueError:
+                failures.append({"error": line})
+    return failures
+
+
+def delete_staged(clients, bucket_name, prefix):
+    for blob in clients.storage.list_blobs(bucket_name, prefix=prefix):
+        blob.delete()
+
+
+def bulk_import(clients, corpus_name, paths, display_names=None, bucket=None, chunk_size=None, chunk_overlap=None,
+                max_embedding_requests_per_min=None, hybrid=False, keep_staged=False, progress=None,
+                run_prefix=None, operation_name=None, checkpoint=None):
+    """Stages files in a GCS bucket and imports them into a corpus with one server-side import.
+
+    `progress(fraction, message)` is called while staging and while the import
+    operation runs. `checkpoint(**state)` is given the staging prefix and then
+    the import operation name as soon as they exist; passing them back in
+    (`run_prefix`, `operation_name`) resumes that run instead of staging and
+    importing the files a second time. Returns a report with counts, timings,
+    throughput and the per-file failures Vertex recorded.
+    """
+    bucket = bucket or config.STAGING_BUCKET
+    if not bucket:
+        raise ValueError("No staging bucket configured (set STAGING_BUCKET)")
+    progress = progress or (lambda fraction, message=None: None)
+    checkpoint = checkpoint or (lambda **state: None)
+    if run_prefix is None:
+        corpus_id = corpus_name.split("/")[-1]
+        run_prefix = f"{config.STAGING_PREFIX}/{corpus_id}/{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        checkpoint(run_prefix=run_prefix)
+    names = _unique_names(paths, display_names)
+    total_bytes = sum(os.path.getsize(p) for p in paths)
+
+    started = time.monotonic()
+    if operation_name is None:
+        # Object names are fixed by the run prefix, so staging again after a failed attempt overwrites rather than adds
+        uris = stage_files(
+            clients, bucket, f"{run_prefix}/files", paths, names,
+            progress=lambda fraction, message: progress(0.3 * fraction, message),
+        )
+        staged_s = time.monotonic() - started
+
+        progress(0.3, "Importing into the corpus...")
+        operation = clients.import_files(
+            corpus_name,
+            uris,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            max_embedding_requests_per_min=max_embedding_requests_per_min,
+            partial_failure_prefix=f"gs://{bucket}/{run_prefix}/failures/",
+        )
+        checkpoint(operation_name=operation.operation.name)
+    else:
+        staged_s = 0.0
+        uris = [f"gs://{bucket}/{run_prefix}/files/{name}" for name in names]
+        progress(0.3, "Resuming the import...")
+        operation = clients.get_import_operation(operation_name)
+    import_started = time.monotonic()
+    while not operation.done():
+        metadata = operation.metadata
+        percent = getattr(metadata, "progress_percentage", 0) or 0
+        progress(0.3 + 0.65 * percent / 100, f"Importing: {percent}%")
+        time.sleep(config.IMPORT_POLL_INTERVAL)
+    response = operation.result()
+    import_s = time.monotonic() - import_started
+
+    failures = read_partial_failures(clients, bucket, f"{run_prefix}/failures/")
+
+    # Index locally for hybrid (keyword + vector) retrieval, keyed by the RagFile name like single uploads.
+    # Vertex reports imported files by their GCS URI, which lets keyword and vector hits for a file fuse.
+    if hybrid:
+        progress(0.95, "Updating local keyword index...")
+        rag_files = {f.display_name: f.name for f in clients.list_files(corpus_name)}
+        for path, name, uri in zip(paths, names, uris):
+            try:
+                lexical_index.index_file(corpus_name, rag_files.get(name, name), name, path, uri)
+            except Exception as e:
+                print(f"Keyword indexing failed for {name}: {e}")
+
+    # Cached answers no longer reflect the corpus
+    get_answer_store().invalidate_corpus(corpus_name)
+    if not keep_staged:
+        delete_staged(clients, bucket, f"{run_prefix}/files/")
+
+    total_s = time.monotonic() - started
+    return {
+        "files": len(paths),
+        "bytes": total_bytes,
+        "imported": response.imported_rag_files_count,
+        "failed": response.failed_rag_files_count,
+        "skipped": response.skipped_rag_files_count,
+        "staging_s": round(staged_s, 1),
+        "import_s": round(import_s, 1),
+        "files_per_min": round(len(paths) / total_s * 60, 1) if total_s else None,
+        "mb_per_min": round(total_bytes / 1e6 / total_s * 60, 2) if total_s else None,
+        "failures": failures,
+        "failures_uri": f"gs://{bucket}/{run_prefix}/failures/" if failures else None,
+    }
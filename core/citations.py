@@ -0,0 +1,67 @@
+import os
+import re
+
+# The model is told to leave references out; they are appended from grounding metadata
+NO_CITATIONS_NOTE = "Do not write citations or a reference list; the sources are listed automatically."
+
+# "**Citation Format Instructions ...**" up to the next paragraph that is not about citing
+_CITATION_SECTION_RE = re.compile(
+    r"\*\*Citation Format Instructions.*?(?=\n(?:Do not reveal|\*\*(?!How to cite))|\Z)",
+    re.DOTALL,
+)
+_CITATION_TAIL_RE = re.compile(r",? and then list the\s+relevant citation\(s\) at the end", re.IGNORECASE)
+
+
+def strip_citation_instructions(instruction):
+    """System instruction without the citation-formatting section, plus a one-line note."""
+    text = _CITATION_SECTION_RE.sub("", instruction or "")
+    text = _CITATION_TAIL_RE.sub("", text)
+    text = re.sub(r"\n{3,}", "\n\n", text).strip()
+    return f"{text}\n\n{NO_CITATIONS_NOTE}\n" if text else NO_CITATIONS_NOTE
+
+
+def _label(title, uri):
+    label = title or os.path.basename((uri or "").rstrip("/")) or uri
+    # Web resources keep their full URL
+    if uri and uri.startswith(("http://", "https://")) and uri != label:
+        return f"{label} ({uri})"
+    return label
+
+
+def references_from_chunks(chunks):
+    """One `{"title", "uri"}` reference per file, in order of first appearance."""
+    references = {}
+    for chunk in chunks or []:
+        uri = chunk.get("uri")
+        title = chunk.get("title")
+        key = uri or title
+        if key and key not in references:
+            references[key] = {"title": title, "uri": uri}
+    return list(references.values())
+
+
+def references_from_grounding(metadata):
+    """References for the grounding chunks the answer actually relies on.
+
+    When the response carries grounding supports, only chunks cited by a
+    supported segment are kept; otherwise every retrieved chunk counts.
+    """
+    grounding_chunks = [c.retrieved_context for c in metadata.grounding_chunks or []]
+    used = None
+    if metadata.grounding_supports:
+        used = {i for support in metadata.grounding_supports for i in support.grounding_chunk_indices or []}
+    chunks = [
+        {"uri": context.uri, "title": context.title}
+        for i, context in enumerate(grounding_chunks)
+        if context is not None and (used is None or i in used)
+    ]
+    return references_from_chunks(chunks)
+
+
+def format_references(references):
+    """Markdown reference list appended to an answer, or "" when there is nothing to cite."""
+    if not references:
+        return ""
+    lines = ["", "", "**References:**"]
+    lines += [f"{i}) {_label(ref['title'], ref['uri'])}" for i, ref in enumerate(references, start=1)]
+    return "\n".join(lines)
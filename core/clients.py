@@ -0,0 +1,347 @@
+import contextlib
+import json
+import threading
+import time
+import streamlit as st
+from google import genai
+from google.api_core import operation as api_operation
+from google.api_core.client_options import ClientOptions
+from google.auth.transport.requests import AuthorizedSession
+from google.cloud import aiplatform_v1
+from . import config
+from .scheduler import get_scheduler
+
+
+class _HTTPStatusError(Exception):
+    def __init__(self, response):
+        super().__init__(f"HTTP {response.status_code}: {response.text[:200]}")
+        self.code = response.status_code
+        self.response = response
+
+
+# (principal, corpus_name) -> (allowed, monotonic expiry), shared by all clients of a process
+_corpus_access = {}
+_corpus_access_lock = threading.Lock()
+
+
+class VertexClients:
+    """Vertex AI clients bound to a single set of credentials.
+
+    Unlike `vertexai.init`, nothing here touches process-wide SDK state, so
+    several users can hold clients side by side. Each underlying client is
+    created on first use and keeps its gRPC/HTTP channel open for reuse.
+    Work that spans several calls (a job, a streamed answer) holds the clients
+    with `in_use()`; once the pool retires them they are closed when the last
+    holder is done, and then refuse further use rather than reopen channels the
+    pool no longer tracks.
+    """
+
+    def __init__(self, credentials, principal=None, project=None, location=None):
+        self.credentials = credentials
+        # Fair-queuing key for the request scheduler
+        self.principal = principal or "anonymous"
+        self.project = project or config.PROJECT_ID
+        self.location = location or config.LOCATION
+        self.last_used = time.time()
+        self._lock = threading.Lock()
+        self._genai = None
+        self._rag_data = None
+        self._rag = None
+        self._storage = None
+        self._holders = 0
+        self._retired = False
+        self._closed = False
+
+    @property
+    def parent(self):
+        return f"projects/{self.project}/locations/{self.location}"
+
+    def corpus_resource_name(self, corpus_id):
+        return f"{self.parent}/ragCorpora/{corpus_id}"
+
+    def _client_options(self):
+        return ClientOptions(api_endpoint=f"{self.location}-aiplatform.googleapis.com")
+
+    def _check_open(self):
+        if self._closed:
+            raise RuntimeError(f"Vertex clients for {self.principal} were closed; get new ones from get_clients()")
+
+    @property
+    def genai(self):
+        """google-genai client used for generation."""
+        with self._lock:
+            self._check_open()
+            if self._genai is None:
+                self._genai = genai.Client(
+                    vertexai=True,
+                    project=self.project,
+                    location=self.location,
+                    credentials=self.credentials,
+                )
+            return self._genai
+
+    @property
+    def rag_data(self):
+        """RAG data service client (corpora and files)."""
+        with self._lock:
+            self._check_open()
+            if self._rag_data is None:
+                self._rag_data = aiplatform_v1.VertexRagDataServiceClient(
+                    credentials=self.credentials,
+                    client_options=self._client_options(),
+                )
+            return self._rag_data
+
+    @property
+    def rag(self):
+        """RAG retrieval service client."""
+        with self._lock:
+            self._check_open()
+            if self._rag is None:
+                self._rag = aiplatform_v1.VertexRagServiceClient(
+                    credentials=self.credentials,
+                    client_options=self._client_options(),
+                )
+            return self._rag
+
+    @property
+    def storage(self):
+        """Cloud Storage client for the bulk-import staging bucket.
+
+        Honors STORAGE_EMULATOR_HOST, so staging can be tested against a local emulator.
+        """
+        with self._lock:
+            self._check_open()
+            if self._storage is None:
+                from google.cloud import storage
+
+                self._storage = storage.Client(project=self.project, credentials=self.credentials)
+            return self._storage
+
+    def schedule(self, func, model=None, tokens=0):
+        """Runs `func` through the shared quota scheduler under this principal."""
+        with self.in_use():
+            return get_scheduler().submit(self.principal, func, model=model, tokens=tokens)
+
+    # -------------------------------
+    # Lifetime
+    # -------------------------------
+    @contextlib.contextmanager
+    def in_use(self):
+        """Keeps the clients open for the duration of the block, even if the pool retires them meanwhile."""
+        with self._lock:
+            self._check_open()
+            self._holders += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._holders -= 1
+                self.last_used = time.time()
+                close = self._retired and not self._holders
+            if close:
+                self.close()
+
+    @property
+    def busy(self):
+        return self._holders > 0
+
+    def retire(self):
+        """Closes the clients as soon as nobody holds them (the pool no longer hands them out)."""
+        with self._lock:
+            self._retired = True
+            close = not self._holders
+        if close:
+            self.close()
+
+    # -------------------------------
+    # Corpus Management
+    # -------------------------------
+    def list_corpora(self):
+        return self.schedule(lambda: list(self.rag_data.list_rag_corpora(parent=self.parent)))
+
+    def create_corpus(self, display_name):
+        operation = self.schedule(lambda: self.rag_data.create_rag_corpus(
+            parent=self.parent,
+            rag_corpus=aiplatform_v1.RagCorpus(display_name=display_name),
+        ))
+        return operation.result()
+
+    def delete_corpus(self, name):
+        self.schedule(lambda: self.rag_data.delete_rag_corpus(name=name)).result()
+
+    def can_read(self, corpus_names):
+        """Whether this principal may read every one of the corpora, as verified by Vertex.
+
+        Cached answers and retrieval results were produced under whichever
+        identity first asked, so they are only served to a caller that passes
+        this check. The result of a metadata read per corpus is remembered for
+        ACCESS_CHECK_TTL seconds.
+        """
+        now = time.monotonic()
+        for name in corpus_names:
+            with _corpus_access_lock:
+                cached = _corpus_access.get((self.principal, name))
+            if cached and cached[1] > now:
+                allowed = cached[0]
+            else:
+                try:
+                    self.schedule(lambda: self.rag_data.get_rag_corpus(name=name))
+                    allowed = True
+                except Exception as e:
+                    if getattr(e, "code", None) not in (401, 403, 404):
+                        # Unknown outcome: refuse for now without remembering it
+                        print(f"Could not verify access to {name}: {e}")
+                        return False
+                    allowed = False
+                with _corpus_access_lock:
+                    _corpus_access[(self.principal, name)] = (allowed, now + config.ACCESS_CHECK_TTL)
+            if not allowed:
+                return False
+        return True
+
+    def list_files(self, corpus_name):
+        return self.schedule(lambda: list(self.rag_data.list_rag_files(parent=corpus_name)))
+
+    def delete_file(self, name):
+        self.schedule(lambda: self.rag_data.delete_rag_file(name=name)).result()
+
+    def upload_file(self, corpus_name, path, display_name, description=None):
+        """Uploads one local file to a corpus. Returns the created RagFile as a dict.
+
+        The upload endpoint is multipart HTTP only (there is no gRPC method for it),
+        so this goes through an AuthorizedSession with the same credentials.
+        """
+        url = f"https://{self.location}-aiplatform.googleapis.com/upload/v1/{corpus_name}/ragFiles:upload"
+        metadata = {"rag_file": {"display_name": display_name, "description": description or ""}}
+
+        def post():
+            with open(path, "rb") as f:
+                response = AuthorizedSession(self.credentials).post(
+                    url,
+                    files={"metadata": (None, json.dumps(metadata)), "file": f},
+                    headers={"X-Goog-Upload-Protocol": "multipart"},
+                )
+            if response.status_code in (429, 503):
+                # Let the scheduler see the status code and Retry-After header
+                raise _HTTPStatusError(response)
+            response.raise_for_status()
+            return response
+
+        body = self.schedule(post).json()
+        if "error" in body:
+            raise RuntimeError(f"Upload failed: {body['error']}")
+        return body.get("ragFile", body)
+
+    def import_files(self, corpus_name, gcs_uris, chunk_size=None, chunk_overlap=None,
+                     max_embedding_requests_per_min=None, partial_failure_prefix=None):
+        """Starts a server-side bulk import of GCS objects. Returns the long-running operation.
+
+        Embedding calls are throttled by `max_embedding_requests_per_min`; when
+        `partial_failure_prefix` is given, Vertex writes per-file failures there.
+        """
+        import_config = aiplatform_v1.ImportRagFilesConfig(
+            gcs_source=aiplatform_v1.GcsSource(uris=list(gcs_uris)),
+            rag_file_transformation_config=aiplatform_v1.RagFileTransformationConfig(
+                rag_file_chunking_config=aiplatform_v1.RagFileChunkingConfig(
+                    fixed_length_chunking=aiplatform_v1.RagFileChunkingConfig.FixedLengthChunking(
+                        chunk_size=chunk_size or config.IMPORT_CHUNK_SIZE,
+                        chunk_overlap=chunk_overlap if chunk_overlap is not None else config.IMPORT_CHUNK_OVERLAP,
+                    ),
+                ),
+            ),
+            max_embedding_requests_per_min=max_embedding_requests_per_min or config.IMPORT_MAX_EMBEDDING_RPM,
+        )
+        if partial_failure_prefix:
+            import_config.partial_failure_gcs_sink = aiplatform_v1.GcsDestination(
+                output_uri_prefix=partial_failure_prefix
+            )
+        return self.schedule(lambda: self.rag_data.import_rag_files(
+            parent=corpus_name,
+            import_rag_files_config=import_config,
+        ))
+
+    def get_import_operation(self, name):
+        """Resumes an import started earlier (by `import_files`) from its operation name."""
+        operations = self.rag_data.transport.operations_client
+        return api_operation.from_gapic(
+            self.schedule(lambda: operations.get_operation(name)),
+            operations,
+            aiplatform_v1.ImportRagFilesResponse,
+            metadata_type=aiplatform_v1.ImportRagFilesOperationMetadata,
+        )
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            opened = (self._genai, self._rag_data, self._rag, self._storage)
+            self._genai = self._rag_data = self._rag = self._storage = None
+        genai_client, rag_data, rag, storage_client = opened
+        for client in (rag_data, rag):
+            if client is not None:
+                client.transport.close()
+        if genai_client is not None and hasattr(genai_client, "close"):
+            genai_client.close()
+        if storage_client is not None:
+            storage_client.close()
+
+
+class VertexClientPool:
+    """Keeps one `VertexClients` per principal and closes the ones left idle.
+
+    At most `max_size` principals keep open connections; beyond that, or after
+    `idle_ttl` seconds without use, the least recently used idle entry is
+    retired. Entries in use are never evicted, and a retired entry is only
+    closed once its last holder is done.
+    """
+
+    def __init__(self, max_size=None, idle_ttl=None):
+        self.max_size = max_size or config.CLIENT_POOL_MAX_SIZE
+        self.idle_ttl = idle_ttl or config.CLIENT_POOL_IDLE_TTL
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, principal, credentials):
+        with self._lock:
+            clients = self._clients.get(principal)
+            # A fresh login (or a new API token) produces a new credentials object;
+            # rebuild so new channels use it, and let current holders finish with the old ones.
+            replaced = None
+            if clients is not None and clients.credentials is not credentials:
+                replaced = self._clients.pop(principal)
+                clients = None
+            if clients is None:
+                clients = VertexClients(credentials, principal)
+                self._clients[principal] = clients
+            clients.last_used = time.time()
+            stale = self._collect_stale(keep=principal)
+        for old in stale + ([replaced] if replaced else []):
+            old.retire()
+        return clients
+
+    def _collect_stale(self, keep=None):
+        now = time.time()
+        idle = [p for p, c in self._clients.items() if p != keep and not c.busy]
+        stale = [p for p in idle if now - self._clients[p].last_used > self.idle_ttl]
+        overflow = len(self._clients) - len(stale) - self.max_size
+        for principal in sorted(idle, key=lambda p: self._clients[p].last_used):
+            if overflow <= 0:
+                break
+            if principal not in stale:
+                stale.append(principal)
+                overflow -= 1
+        return [self._clients.pop(p) for p in stale]
+
+    def size(self):
+        with self._lock:
+            return len(self._clients)
+
+
+@st.cache_resource
+def get_client_pool():
+    return VertexClientPool()
+
+
+def get_clients(principal, credentials):
+    """Returns the pooled Vertex clients for `principal`."""
+    return get_client_pool().get(principal, credentials)
@@ -5,10 +5,187 @@ LOCATION = "us-east1"
 # RAG_CORPUS_ID might be overwritten by session state
 DEFAULT_RAG_CORPUS_ID = "6917529027641081856" 
 
-GOOGLE_AUTH_SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+GOOGLE_AUTH_SCOPES = [
+    'openid',
+    'https://www.googleapis.com/auth/userinfo.email',
+    'https://www.googleapis.com/auth/cloud-platform',
+]
 
 DATA_DIR = "data"
 TODO_FILE = os.path.join(DATA_DIR, "todo_lists.json")
 RAG_ENGINES_FILE = os.path.join(DATA_DIR, "rag_engines.json")
-TOKEN_FILE = os.path.join(DATA_DIR, "token.json")
+# One credentials file per user (see core/credential_cache.py)
+TOKENS_DIR = os.path.join(DATA_DIR, "tokens")
 SYSTEM_INSTRUCTIONS_DB = os.path.join(DATA_DIR, "system_instructions.json")
+
+DEFAULT_MODEL_ID = "gemini-2.5-flash"
+
+# Container warm-up (see scripts/serve.py)
+# Port for the /ready and /live endpoints; 0 disables them
+HEALTH_PORT = int(os.environ.get("HEALTH_PORT", "0"))
+# Optional model to send a one-token canary request to during warm-up
+WARMUP_CANARY_MODEL = os.environ.get("WARMUP_CANARY_MODEL", "")
+WARMUP_TIMEOUT = float(os.environ.get("WARMUP_TIMEOUT", "120"))
+
+# Background token refresh
+CREDENTIAL_REFRESH_MARGIN = 600  # seconds before expiry to refresh
+CREDENTIAL_REFRESH_INTERVAL = 60
+CREDENTIAL_IDLE_TTL = 8 * 3600  # drop from memory (not disk) after this long unused
+
+# Signed session cookie that maps a browser back to its stored credentials (see core/auth.py)
+SESSION_COOKIE = "mi_rag_session"
+SESSION_TTL = 30 * 24 * 3600  # seconds
+# HMAC key for the cookie; set the same value on every replica. Unset: a key generated into SESSION_SECRET_FILE.
+SESSION_SECRET = os.environ.get("SESSION_SECRET", "")
+SESSION_SECRET_FILE = os.path.join(DATA_DIR, "session_secret")
+
+# Vertex client pool (see core/clients.py)
+CLIENT_POOL_MAX_SIZE = 32  # principals with open connections
+CLIENT_POOL_IDLE_TTL = 1800  # seconds
+
+# Request scheduler (see core/scheduler.py). Per-minute limits, set a little
+# below the project's actual Vertex AI quota.
+MODEL_QUOTAS = {
+    "default": {"requests_per_minute": 60, "tokens_per_minute": 1_000_000},
+    "gemini-2.5-pro": {"requests_per_minute": 30, "tokens_per_minute": 500_000},
+    "gemini-3-pro-preview": {"requests_per_minute": 20, "tokens_per_minute": 500_000},
+}
+PROJECT_QUOTA = {"requests_per_minute": 300, "tokens_per_minute": 4_000_000}
+SCHEDULER_MAX_WAIT = 120  # seconds a request may queue before giving up
+SCHEDULER_MAX_ATTEMPTS = 5
+
+# Hedged generation and circuit breaking (see core/resilience.py)
+HEDGING_ENABLED = True
+# Fallback model raced against a slow primary; "default" applies to unlisted models
+FALLBACK_MODELS = {
+    "default": "gemini-2.5-flash",
+    "gemini-2.5-flash": "gemini-2.5-flash-lite",
+    "gemini-2.5-flash-lite": None,
+}
+HEDGE_PERCENTILE = 0.95  # hedge once the primary is slower than its recent p95
+HEDGE_MIN_DELAY = 2.0
+HEDGE_MAX_DELAY = 20.0
+GENERATION_DEADLINE = 90.0  # seconds for the whole turn, all attempts included
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_COOLDOWN = 30.0
+
+# Retrieval
+SIMILARITY_TOP_K = 10
+VECTOR_DISTANCE_THRESHOLD = 0.5
+RRF_K = 60  # reciprocal-rank fusion constant for multi-corpus retrieval
+# Excerpts of one file sharing this share of their word trigrams are fused as one passage
+RRF_DUPLICATE_OVERLAP = 0.5
+
+# Local lexical (BM25) index over uploaded documents, fused with Vertex results
+HYBRID_RETRIEVAL = False  # default for new sessions; toggled in Settings
+LEXICAL_INDEX_DIR = os.path.join(DATA_DIR, "lexical_index")
+LEXICAL_CHUNK_WORDS = 200
+LEXICAL_CHUNK_OVERLAP = 40
+
+# Local reranking between retrieval and generation (see core/rerank.py)
+RERANK_ENABLED = False  # default for new sessions; toggled in Settings
+RERANK_TOP_K = 4  # chunks kept after reranking
+RERANK_TOKEN_BUDGET = 2000  # estimated tokens of excerpts sent to the model
+RERANK_RELEVANCE_WEIGHT = 0.7  # vs. the retriever's own ranking
+# Optional sentence-transformers cross-encoder, e.g. "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_MODEL = os.environ.get("RERANK_MODEL", "")
+
+# Citations
+# Build the reference list in code from grounding metadata instead of asking the model for it
+CODE_CITATIONS = True  # default for new sessions; toggled in Settings
+
+# Context caching of the system instruction (and retrieval tool) per model
+CONTEXT_CACHING = os.environ.get("CONTEXT_CACHING", "1") != "0"
+CONTEXT_CACHE_MIN_TOKENS = 2048  # Vertex rejects smaller caches; shorter instructions go inline
+CONTEXT_CACHE_TTL = 3600  # seconds
+CONTEXT_CACHE_REFRESH_MARGIN = 300  # extend the TTL when a cache in use is this close to expiring
+CONTEXT_CACHE_RETRY_AFTER = 600  # after a failed create, send inline for this long
+
+# Per-turn token usage and latency (see core/usage.py)
+USAGE_DB = os.path.join(DATA_DIR, "usage.db")
+USAGE_RETENTION_DAYS = 90
+# Users (as signed in, e.g. emails) who may see every user's usage in Settings; others only see their own
+USAGE_ADMINS = [u for u in os.environ.get("USAGE_ADMINS", "").split(",") if u]
+# USD per 1M tokens (list prices; adjust to the billing account). Thinking tokens bill as output.
+MODEL_PRICES = {
+    "gemini-2.5-flash": {"input": 0.30, "cached_input": 0.075, "output": 2.50},
+    "gemini-2.5-flash-lite": {"input": 0.10, "cached_input": 0.025, "output": 0.40},
+    "gemini-2.5-pro": {"input": 1.25, "cached_input": 0.31, "output": 10.00},
+    "default": {"input": 0.30, "cached_input": 0.075, "output": 2.50},
+}
+
+# Tracing and metrics (see core/telemetry.py)
+# Prometheus text metrics are served at /metrics on the health server (HEALTH_PORT)
+# Spans are exported over OTLP/HTTP when OTEL_EXPORTER_OTLP_ENDPOINT is set; otherwise tracing is a no-op
+OTEL_EXPORTER_OTLP_ENDPOINT = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT", "")
+OTEL_SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "mi-rag")
+# Upper bounds (seconds) of the stage latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Headless chat API (see api.py)
+API_PORT = int(os.environ.get("API_PORT", "8000"))
+API_WORKERS = int(os.environ.get("API_WORKERS", "4"))
+# Serve callers without a bearer token using the service's Application Default Credentials
+API_ALLOW_ADC = os.environ.get("API_ALLOW_ADC", "0") == "1"
+# Bearer tokens must be issued to one of these OAuth clients (token aud/azp); defaults to the app's own client.
+# Add 32555940559.apps.googleusercontent.com to accept `gcloud auth print-access-token`.
+API_ALLOWED_AUDIENCES = [a for a in os.environ.get("API_ALLOWED_AUDIENCES", os.environ.get("GOOGLE_CLIENT_ID", "")).split(",") if a]
+# ...and belong to a verified account in one of these domains, or be listed explicitly.
+# With neither set, every bearer token is refused.
+API_ALLOWED_DOMAINS = [d for d in os.environ.get("API_ALLOWED_DOMAINS", "").split(",") if d]
+API_ALLOWED_PRINCIPALS = [p for p in os.environ.get("API_ALLOWED_PRINCIPALS", "").split(",") if p]
+
+# Resident rag_query daemon (scripts/rag_query.py --serve, scripts/rag_ask.py)
+RAG_QUERY_SOCKET = os.environ.get("RAG_QUERY_SOCKET", f"/tmp/mi-rag-query-{os.getuid()}.sock")
+
+# Structured query log (see core/query_log.py and scripts/query_log_report.py)
+QUERY_LOG_ENABLED = os.environ.get("QUERY_LOG_ENABLED", "1") != "0"
+QUERY_LOG_DIR = os.path.join(DATA_DIR, "query_log")
+QUERY_LOG_MAX_BYTES = 10 * 1024 * 1024  # rotate (and gzip) the active file past this size
+QUERY_LOG_BACKUPS = 50  # rotated files kept across all processes
+QUERY_LOG_QUEUE_SIZE = 10000  # entries buffered for the writer; beyond that they are dropped
+
+# Read-through answer store for first-turn questions (see core/answer_cache.py, scripts/warm_answers.py)
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "1") != "0"
+ANSWER_CACHE_DB = os.path.join(DATA_DIR, "answer_cache.db")
+ANSWER_CACHE_TTL = 24 * 3600  # seconds
+WARM_TOP_QUESTIONS = 20  # per engine, when warming from the query log
+# Cached answers are served to other users only after Vertex confirms they can read the corpora;
+# that check is remembered this many seconds per user and corpus
+ACCESS_CHECK_TTL = 300
+
+# Durable background jobs for corpus operations (see core/jobs.py)
+JOBS_DB = os.path.join(DATA_DIR, "jobs.db")
+# Uploaded files wait here until their upload job has finished
+JOB_FILES_DIR = os.path.join(DATA_DIR, "job_files")
+JOB_WORKERS = 2  # worker threads per process
+JOB_MAX_ATTEMPTS = 4
+JOB_RETRY_BACKOFF = 10  # seconds, doubled after every failed attempt
+JOB_LEASE = 300  # a running job whose worker stops renewing this lease is picked up again
+JOB_POLL_INTERVAL = 1.0
+
+# Bulk import through a GCS staging bucket (see core/bulk_import.py)
+# Bucket name (no gs://). Set STORAGE_EMULATOR_HOST to stage into a local emulator instead.
+STAGING_BUCKET = os.environ.get("STAGING_BUCKET", "")
+STAGING_PREFIX = "rag-staging"
+IMPORT_MAX_EMBEDDING_RPM = int(os.environ.get("IMPORT_MAX_EMBEDDING_RPM", "1000"))
+IMPORT_CHUNK_SIZE = 512  # tokens
+IMPORT_CHUNK_OVERLAP = 100
+IMPORT_POLL_INTERVAL = 10.0  # seconds between checks of the import operation
+STAGING_UPLOAD_WORKERS = 8
+
+# State shared by all replicas (see core/shared_state.py)
+# Redis URL, e.g. redis://10.0.0.3:6379/0 (needs the redis package). Unset: each process keeps its own state.
+SHARED_STATE_URL = os.environ.get("SHARED_STATE_URL", "")
+SHARED_STATE_PREFIX = os.environ.get("SHARED_STATE_PREFIX", "mi-rag:")
+SHARED_STATE_TIMEOUT = 0.5  # seconds; a slow server counts as a cache miss
+RETRIEVAL_CACHE_TTL = int(os.environ.get("RETRIEVAL_CACHE_TTL", "600"))  # seconds, 0 disables
+CONVERSATION_TTL = 24 * 3600  # an idle conversation is forgotten after this many seconds
+
+# Speculative follow-up suggestions in the chat (see core/followups.py)
+FOLLOWUP_SUGGESTIONS = False  # default for new sessions; toggled in Settings
+FOLLOWUP_MODEL = "gemini-2.5-flash-lite"  # cheap model that proposes the questions
+FOLLOWUP_COUNT = 3
+FOLLOWUP_ANSWER_CHARS = 4000  # answer text shown to the suggestion model
+FOLLOWUP_PREFETCH_TTL = 120  # seconds prefetched excerpts stay usable
+FOLLOWUP_PREFETCH_WAIT = 5.0  # seconds a click waits for a prefetch still in flight
@@ -0,0 +1,133 @@
+import hashlib
+import threading
+import time
+import streamlit as st
+from google.genai import types
+from . import config
+from .scheduler import estimate_tokens
+from .shared_state import get_shared_state
+from .singleflight import fingerprint
+
+
+class ContextCache:
+    """Vertex cached-content prefixes holding a system instruction and its tools.
+
+    One cache exists per (model, instruction, tools). Its TTL is extended while
+    it is in use, and it is recreated if it expired or was deleted. Cache names
+    are published in the shared state, so other replicas reuse a cache instead
+    of creating their own. Whenever a
+    cache cannot be used (instruction below the model minimum, create failure,
+    caching disabled), `lookup` returns None and callers send the instruction
+    inline as before.
+    """
+
+    def __init__(self, ttl=None, refresh_margin=None, min_tokens=None):
+        self.ttl = ttl or config.CONTEXT_CACHE_TTL
+        self.refresh_margin = refresh_margin or config.CONTEXT_CACHE_REFRESH_MARGIN
+        self.min_tokens = min_tokens or config.CONTEXT_CACHE_MIN_TOKENS
+        self._entries = {}  # key -> {"name", "expires"} (wall-clock expiry)
+        self._unavailable = {}  # key -> monotonic time until which caching is skipped
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.created = 0
+        self.extended = 0
+        self.fallbacks = 0
+
+    @staticmethod
+    def key(model, instruction, tools=None):
+        tool_specs = [tool.model_dump(mode="json", exclude_none=True) for tool in tools or []]
+        return (model, fingerprint(instruction), fingerprint(tool_specs))
+
+    @staticmethod
+    def _shared_key(key):
+        return "context_cache:" + hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+    def lookup(self, clients, model, instruction, tools=None):
+        """Resource name of a live cache for this prefix, or None to send it inline."""
+        if not config.CONTEXT_CACHING or not instruction or estimate_tokens(instruction) < self.min_tokens:
+            return None
+        key = self.key(model, instruction, tools)
+        with self._lock:
+            if self._unavailable.get(key, 0) > time.monotonic():
+                return None
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Concurrent first turns wait for a single create instead of racing
+        with key_lock:
+            entry = self._entries.get(key) or get_shared_state().get(self._shared_key(key))
+            try:
+                now = time.time()
+                if entry is None or entry["expires"] <= now:
+                    entry = self._create(clients, key, model, instruction, tools)
+                elif entry["expires"] - now < self.refresh_margin:
+                    entry = self._extend(clients, key, entry, model, instruction, tools)
+            except Exception as e:
+                print(f"Context caching unavailable for {model}, sending instruction inline: {e}")
+                with self._lock:
+                    self._entries.pop(key, None)
+                    self._unavailable[key] = time.monotonic() + config.CONTEXT_CACHE_RETRY_AFTER
+                    self.fallbacks += 1
+                return None
+            with self._lock:
+                self.hits += 1
+            return entry["name"]
+
+    def _store(self, key, cached):
+        expires = cached.expire_time.timestamp() if cached.expire_time else time.time() + self.ttl
+        entry = {"name": cached.name, "expires": expires}
+        with self._lock:
+            self._entries[key] = entry
+        get_shared_state().set(self._shared_key(key), entry, ttl=max(1, expires - time.time()))
+        return entry
+
+    def _create(self, clients, key, model, instruction, tools):
+        label = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:12]
+        cached = clients.schedule(lambda: clients.genai.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                display_name=f"mi-rag-{label}",
+                system_instruction=instruction,
+                tools=tools,
+                ttl=f"{self.ttl}s",
+            ),
+        ))
+        with self._lock:
+            self.created += 1
+        return self._store(key, cached)
+
+    def _extend(self, clients, key, entry, model, instruction, tools):
+        try:
+            cached = clients.schedule(lambda: clients.genai.caches.update(
+                name=entry["name"],
+                config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s"),
+            ))
+        except Exception:
+            # Deleted or already expired on the server side
+            return self._create(clients, key, model, instruction, tools)
+        with self._lock:
+            self.extended += 1
+        return self._store(key, cached)
+
+    def invalidate(self, name):
+        """Forgets a cache the API no longer accepts; the next lookup recreates it."""
+        with self._lock:
+            keys = [k for k, entry in self._entries.items() if entry["name"] == name]
+            for key in keys:
+                del self._entries[key]
+        get_shared_state().delete(*(self._shared_key(key) for key in keys))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "live_caches": sum(1 for e in self._entries.values() if e["expires"] > time.time()),
+                "hits": self.hits,
+                "created": self.created,
+                "extended": self.extended,
+                "inline_fallbacks": self.fallbacks,
+            }
+
+
+@st.cache_resource
+def get_context_cache():
+    return ContextCache()
@@ -0,0 +1,187 @@
+import base64
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+import streamlit as st
+import google.oauth2.credentials
+from google.auth.transport.requests import Request
+from . import config
+
+
+def user_id_from_credentials(creds):
+    """Derives a stable user id from the OpenID token returned with the OAuth credentials.
+
+    The id_token comes straight from Google's token endpoint over TLS, so only
+    its payload is decoded here. Falls back to a hash of the refresh token when
+    no id_token is available.
+    """
+    id_token = getattr(creds, "id_token", None)
+    if id_token:
+        try:
+            payload = id_token.split(".")[1]
+            payload += "=" * (-len(payload) % 4)
+            claims = json.loads(base64.urlsafe_b64decode(payload))
+            user_id = claims.get("email") or claims.get("sub")
+            if user_id:
+                return user_id
+        except Exception as e:
+            print(f"Could not decode id_token: {e}")
+    secret = creds.refresh_token or creds.token or ""
+    return "anon-" + hashlib.sha256(secret.encode("utf-8")).hexdigest()[:16]
+
+
+class _Entry:
+    def __init__(self, creds):
+        self.creds = creds
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+
+
+class CredentialCache:
+    """Per-user OAuth credentials kept in memory and refreshed ahead of expiry.
+
+    A background thread refreshes every cached credential whose access token
+    expires within `refresh_margin` seconds, so request handlers always find a
+    valid token. Credentials are persisted to one file per user under
+    `tokens_dir` so they survive process restarts.
+    """
+
+    def __init__(self, tokens_dir=None, refresh_margin=None, interval=None, idle_ttl=None):
+        self.tokens_dir = tokens_dir or config.TOKENS_DIR
+        self.refresh_margin = refresh_margin if refresh_margin is not None else config.CREDENTIAL_REFRESH_MARGIN
+        self.interval = interval if interval is not None else config.CREDENTIAL_REFRESH_INTERVAL
+        self.idle_ttl = idle_ttl if idle_ttl is not None else config.CREDENTIAL_IDLE_TTL
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # -------------------------------
+    # Persistence
+    # -------------------------------
+    def _path(self, user_id):
+        digest = hashlib.sha256(user_id.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.tokens_dir, f"{digest}.json")
+
+    def _save(self, user_id, creds):
+        try:
+            os.makedirs(self.tokens_dir, exist_ok=True)
+            path = self._path(user_id)
+            tmp_path = f"{path}.tmp"
+            # Refresh tokens are secrets; keep them readable by this user only
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(creds.to_json())
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Error saving credentials for {user_id}: {e}")
+
+    def _load(self, user_id):
+        path = self._path(user_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            return google.oauth2.credentials.Credentials.from_authorized_user_info(data)
+        except Exception as e:
+            print(f"Error loading credentials for {user_id}: {e}")
+            return None
+
+    # -------------------------------
+    # Public API
+    # -------------------------------
+    def put(self, user_id, creds):
+        with self._lock:
+            self._entries[user_id] = _Entry(creds)
+        self._save(user_id, creds)
+
+    def get(self, user_id):
+        """Returns the cached credentials for `user_id`, loading them from disk if needed."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+        if entry is None:
+            creds = self._load(user_id)
+            if creds is None:
+                return None
+            with self._lock:
+                entry = self._entries.setdefault(user_id, _Entry(creds))
+        entry.last_used = time.time()
+        return entry.creds
+
+    def remove(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+        path = self._path(user_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def refresh(self, user_id, force=False):
+        """Refreshes one user's token. Returns True if the credentials are valid afterwards."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+        if entry is None:
+            return False
+        with entry.lock:
+            creds = entry.creds
+            if not force and creds.valid and not self._expires_soon(creds):
+                return True
+            if not creds.refresh_token:
+                return creds.valid
+            try:
+                creds.refresh(Request())
+            except Exception as e:
+                print(f"Token refresh failed for {user_id}: {e}")
+                return creds.valid
+        self._save(user_id, creds)
+        return True
+
+    # -------------------------------
+    # Background refresh
+    # -------------------------------
+    def _expires_soon(self, creds):
+        if creds.expiry is None:
+            return False
+        # google-auth stores expiry as a naive UTC datetime
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return (creds.expiry - now).total_seconds() < self.refresh_margin
+
+    def refresh_due(self):
+        """Refreshes every credential that is close to expiry and drops long-idle entries."""
+        now = time.time()
+        with self._lock:
+            items = list(self._entries.items())
+        for user_id, entry in items:
+            if now - entry.last_used > self.idle_ttl:
+                # Still on disk, so the next get() reloads it
+                with self._lock:
+                    self._entries.pop(user_id, None)
+                continue
+            if self._expires_soon(entry.creds) or not entry.creds.valid:
+                self.refresh(user_id, force=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh_due()
+            except Exception as e:
+                print(f"Credential refresher error: {e}")
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="credential-refresher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+@st.cache_resource
+def get_credential_cache():
+    """Process-wide credential cache with its refresher thread running."""
+    return CredentialCache().start()
@@ -0,0 +1,149 @@
+import concurrent.futures
+import json
+import threading
+import time
+from google.genai import types
+from . import config
+from .scheduler import estimate_tokens, get_scheduler
+from .singleflight import normalize_prompt
+
+FOLLOWUP_PROMPT = """A user asked a question about their documents and received the answer below.
+Suggest {count} short follow-up questions the user is most likely to ask next.
+Each question must be answerable from the same documents and must stand on its own
+without the conversation. Reply with a JSON list of strings only.
+
+Question: {question}
+
+Answer:
+{answer}
+"""
+
+# Prefetches wait on retrieval calls that use the shared retrieval pool, so they get their own threads
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix="prefetch")
+
+
+def suggest_followups(clients, question, answer, count=None, model=None):
+    """Up to `count` likely next questions from a cheap model. Returns [] if it fails."""
+    count = count or config.FOLLOWUP_COUNT
+    model = model or config.FOLLOWUP_MODEL
+    prompt = FOLLOWUP_PROMPT.format(count=count, question=question, answer=answer[:config.FOLLOWUP_ANSWER_CHARS])
+    estimated = estimate_tokens(prompt) + 50 * count
+    try:
+        response = clients.schedule(
+            lambda: clients.genai.models.generate_content(
+                model=model,
+                contents=prompt,
+                config=types.GenerateContentConfig(
+                    response_mime_type="application/json",
+                    response_schema=list[str],
+                    temperature=0.3,
+                    max_output_tokens=60 * count,
+                ),
+            ),
+            model=model,
+            tokens=estimated,
+        )
+        if response.usage_metadata:
+            get_scheduler().settle(model, estimated, response.usage_metadata.total_token_count)
+        suggestions = json.loads(response.text or "[]")
+    except Exception as e:
+        print(f"Could not suggest follow-up questions: {e}")
+        return []
+    seen = {normalize_prompt(question)}
+    unique = []
+    for suggestion in suggestions if isinstance(suggestions, list) else []:
+        if isinstance(suggestion, str) and suggestion.strip() and normalize_prompt(suggestion) not in seen:
+            seen.add(normalize_prompt(suggestion))
+            unique.append(suggestion.strip())
+    return unique[:count]
+
+
+class PrefetchCache:
+    """Suggested follow-ups for one chat session, and their retrieval, run in the background.
+
+    `suggest` writes the suggestions for an answer off the request path and
+    then prefetches them; `suggestions` returns them once ready. `prefetch`
+    starts retrieving each suggestion as the next turn of the session; `take`
+    hands a clicked suggestion its excerpts, waiting briefly if the retrieval
+    is still in flight. Entries live for FOLLOWUP_PREFETCH_TTL seconds and are
+    replaced by the suggestions of the next answer.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl or config.FOLLOWUP_PREFETCH_TTL
+        self._entries = {}  # normalized prompt -> (future, monotonic expiry)
+        self._suggestions = None  # future of the latest answer's suggestions
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def suggest(self, clients, session, question, answer):
+        """Starts suggesting follow-ups to `answer` and prefetching them; see `suggestions`."""
+        def run():
+            suggestions = suggest_followups(clients, question, answer)
+            self.prefetch(session, suggestions)
+            return suggestions
+
+        with self._lock:
+            if self._suggestions is not None:
+                self._suggestions.cancel()
+            self._suggestions = _executor.submit(run)
+
+    def suggestions(self):
+        """The latest answer's suggestions, None while they are being written, or [] if there are none."""
+        with self._lock:
+            future = self._suggestions
+        if future is None or future.cancelled():
+            return []
+        if not future.done():
+            return None
+        try:
+            return future.result()
+        except Exception as e:
+            print(f"Could not suggest follow-up questions: {e}")
+            return []
+
+    def prefetch(self, session, prompts):
+        if not session.corpus_names:
+            return
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            # Suggestions for an earlier answer no longer apply
+            for future, _ in self._entries.values():
+                future.cancel()
+            self._entries = {
+                normalize_prompt(prompt): (_executor.submit(session.retrieve, prompt), expires) for prompt in prompts
+            }
+
+    def take(self, prompt):
+        """Prefetched chunks for `prompt`, or None to retrieve them as usual."""
+        with self._lock:
+            entry = self._entries.pop(normalize_prompt(prompt), None)
+        if entry is None or entry[1] <= time.monotonic():
+            self.misses += 1
+            return None
+        try:
+            chunks = entry[0].result(timeout=config.FOLLOWUP_PREFETCH_WAIT)
+        except Exception as e:
+            print(f"Prefetched retrieval unusable, retrieving again: {e!r}")
+            self.misses += 1
+            return None
+        if not chunks:
+            # Nothing relevant found ahead of time; let the turn retrieve (or use its tool) as usual
+            self.misses += 1
+            return None
+        self.hits += 1
+        return chunks
+
+    def clear(self):
+        with self._lock:
+            if self._suggestions is not None:
+                self._suggestions.cancel()
+                self._suggestions = None
+            for future, _ in self._entries.values():
+                future.cancel()
+            self._entries = {}
+
+    def stats(self):
+        with self._lock:
+            return {"prefetched": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,435 @@
+import contextlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import streamlit as st
+from . import config
+from . import lexical_index
+from .answer_cache import get_answer_store
+from .bulk_import import bulk_import, delete_staged
+from .clients import get_clients
+from .credential_cache import get_credential_cache
+from .storage import load_rag_engines, save_rag_engines
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    owner TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    worker TEXT,
+    lease_until REAL,
+    run_after REAL NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, run_after);
+"""
+
+# kind -> handler(job, **payload); see `handler` below
+_HANDLERS = {}
+# kind -> cleanup(job, **payload), run once a job has failed for good
+_CLEANUPS = {}
+
+
+def handler(kind, cleanup=None):
+    """Registers the function that runs jobs of `kind`.
+
+    Handlers receive a `Job` (for progress reports) plus the job payload as
+    keyword arguments, and return a JSON-serialisable result. Raising makes the
+    job retry with backoff until JOB_MAX_ATTEMPTS is reached. Handlers may run
+    again after a crash, so they should be safe to repeat: `job.checkpoint`
+    saves what an attempt has already done for the next one. `cleanup` is
+    called with the same arguments when the job finally fails, to release
+    staged files.
+    """
+    def decorator(func):
+        _HANDLERS[kind] = func
+        if cleanup is not None:
+            _CLEANUPS[kind] = cleanup
+        return func
+    return decorator
+
+
+class Job:
+    def __init__(self, queue, row):
+        self.queue = queue
+        self.id = row["id"]
+        self.kind = row["kind"]
+        self.owner = row["owner"]
+        self.attempts = row["attempts"]
+        self.created = row["created"]
+        self.payload = json.loads(row["payload"])
+        # Held for the whole run (e.g. the owner's clients, so the pool does not close them mid-job)
+        self.resources = contextlib.ExitStack()
+
+    def progress(self, fraction, message=None):
+        """Records progress (0..1) and renews the lease."""
+        self.queue._update(self.id, progress=fraction, message=message, lease_until=time.time() + config.JOB_LEASE)
+
+    def checkpoint(self, **state):
+        """Merges `state` into the stored payload, so a retry receives it as keyword arguments."""
+        self.payload.update(state)
+        self.queue._update(self.id, payload=json.dumps(self.payload))
+
+
+class JobQueue:
+    """SQLite-backed job queue with worker threads.
+
+    Jobs survive restarts: queued jobs wait in the database, and a job whose
+    worker died (its lease expired) is claimed again by any process that runs
+    workers. Claims are a single UPDATE, so the Streamlit app, the API workers
+    and scripts can share one database safely.
+    """
+
+    def __init__(self, path=None, workers=None):
+        self.path = path or config.JOBS_DB
+        self.workers = workers if workers is not None else config.JOB_WORKERS
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._threads = []
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self):
+        # One connection per thread; WAL lets readers (the Settings page) run alongside a writer
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    # -------------------------------
+    # Submission & Status
+    # -------------------------------
+    def submit(self, kind, payload, owner=None):
+        if kind not in _HANDLERS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        now = time.time()
+        cursor = self._conn().execute(
+            "INSERT INTO jobs (kind, owner, payload, status, run_after, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (kind, owner, json.dumps(payload), QUEUED, now, now, now),
+        )
+        return cursor.lastrowid
+
+    def get(self, job_id):
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._as_dict(row) if row else None
+
+    def list(self, owner=None, limit=20):
+        if owner is None:
+            rows = self._conn().execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,))
+        else:
+            rows = self._conn().execute("SELECT * FROM jobs WHERE owner = ? ORDER BY id DESC LIMIT ?", (owner, limit))
+        return [self._as_dict(row) for row in rows]
+
+    def pending(self, owner=None):
+        """Number of queued or running jobs."""
+        query = "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)"
+        args = [QUEUED, RUNNING]
+        if owner is not None:
+            query += " AND owner = ?"
+            args.append(owner)
+        return self._conn().execute(query, args).fetchone()[0]
+
+    def retry(self, job_id):
+        """Puts a failed job back in the queue with a fresh attempt budget."""
+        self._conn().execute(
+            "UPDATE jobs SET status = ?, attempts = 0, error = NULL, run_after = ?, updated = ? WHERE id = ? AND status = ?",
+            (QUEUED, time.time(), time.time(), job_id, FAILED),
+        )
+
+    @staticmethod
+    def _as_dict(row):
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def _update(self, job_id, **fields):
+        fields["updated"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._conn().execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    # -------------------------------
+    # Workers
+    # -------------------------------
+    def start(self):
+        for i in range(self.workers - len(self._threads)):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _claim(self):
+        now = time.time()
+        conn = self._conn()
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers cannot claim the same job
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE (status = ? AND run_after <= ?) OR (status = ? AND lease_until < ?) "
+                "ORDER BY id LIMIT 1",
+                (QUEUED, now, RUNNING, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, worker = ?, lease_until = ?, updated = ? "
+                    "WHERE id = ?",
+                    (RUNNING, self.worker_id, now + config.JOB_LEASE, now, row["id"]),
+                )
+                row = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return Job(self, row) if row is not None else None
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                print(f"Job queue error: {e}")
+                job = None
+            if job is None:
+                self._stop.wait(config.JOB_POLL_INTERVAL)
+                continue
+            try:
+                self._run(job)
+            except sqlite3.Error as e:
+                # The outcome was not recorded; the lease expires and the job runs again
+                print(f"Job queue error while finishing job {job.id}: {e}")
+
+    def _heartbeat(self, job, done):
+        # Renews the lease while a long handler (a large upload) is still running
+        while not done.wait(config.JOB_LEASE / 3):
+            try:
+                self._update(job.id, lease_until=time.time() + config.JOB_LEASE)
+            except sqlite3.Error as e:
+                print(f"Could not renew the lease of job {job.id}: {e}")
+
+    def _run(self, job):
+        func = _HANDLERS.get(job.kind)
+        done = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job, done), name=f"job-{job.id}-lease", daemon=True).start()
+        try:
+            try:
+                if func is None:
+                    raise ValueError(f"Unknown job kind: {job.kind}")
+                result = func(job, **job.payload)
+            except Exception as e:
+                self._failed(job, e)
+            else:
+                self._update(
+                    job.id, status=SUCCEEDED, progress=1.0, message="Done", error=None,
+                    result=json.dumps(result, default=str), lease_until=None,
+                )
+        finally:
+            done.set()
+            job.resources.close()
+
+    def _failed(self, job, e):
+        """Schedules a retry with backoff, or marks the job failed and runs its cleanup."""
+        if job.attempts < config.JOB_MAX_ATTEMPTS:
+            delay = config.JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1)
+            self._update(
+                job.id, status=QUEUED, error=str(e), lease_until=None, run_after=time.time() + delay,
+                message=f"Attempt {job.attempts} failed, retrying in {delay:.0f}s",
+            )
+        else:
+            self._update(job.id, status=FAILED, error=str(e), lease_until=None, message="Failed")
+            cleanup = _CLEANUPS.get(job.kind)
+            if cleanup is not None:
+                try:
+                    cleanup(job, **job.payload)
+                except Exception as cleanup_error:
+                    print(f"Cleanup of job {job.id} failed: {cleanup_error}")
+
+
+@st.cache_resource
+def get_job_queue():
+    """The process-wide queue, with its worker threads running."""
+    return JobQueue().start()
+
+
+# -------------------------------
+# Corpus Operations
+# -------------------------------
+def _owner_clients(job):
+    """Clients under the job owner's stored credentials (jobs may outlive the session that queued them).
+
+    They are held until the job's run ends.
+    """
+    cache = get_credential_cache()
+    creds = cache.get(job.owner)
+    if creds is None or not (creds.valid or cache.refresh(job.owner, force=True)):
+        raise RuntimeError(f"No valid credentials for {job.owner}; log in again and retry the job")
+    return job.resources.enter_context(get_clients(job.owner, creds).in_use())
+
+
+def stage_upload(data, filename):
+    """Copies uploaded bytes somewhere that survives restarts. Returns the path for an upload job."""
+    os.makedirs(config.JOB_FILES_DIR, exist_ok=True)
+    path = os.path.join(config.JOB_FILES_DIR, f"{time.time_ns()}_{os.path.basename(filename)}")
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def _remove_staged(*paths):
+    for path in paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+def _uploaded_by_earlier_attempt(clients, job, corpus_name, display_name):
+    """RagFile name an earlier attempt created before it could checkpoint it, if any."""
+    for rag_file in clients.list_files(corpus_name):
+        created = rag_file.create_time.timestamp() if rag_file.create_time else 0
+        if rag_file.display_name == display_name and created >= job.created:
+            return rag_file.name
+    return None
+
+
+def _cleanup_upload(job, path, **payload):
+    _remove_staged(path)
+
+
+@handler("upload_file", cleanup=_cleanup_upload)
+def upload_file_job(job, corpus_name, path, display_name, hybrid=False, rag_file=None):
+    clients = _owner_clients(job)
+    if rag_file is None and job.attempts > 1:
+        rag_file = _uploaded_by_earlier_attempt(clients, job, corpus_name, display_name)
+    if rag_file is None:
+        if not os.path.exists(path):
+            raise RuntimeError(f"The staged copy of {display_name} is gone; upload the file again")
+        job.progress(0.1, "Sending to Vertex AI...")
+        rag_file = clients.upload_file(corpus_name=corpus_name, path=path, display_name=display_name).get("name")
+    # Everything below may fail and retry; the upload itself must not be repeated
+    job.checkpoint(rag_file=rag_file)
+
+    # Index locally for hybrid (keyword + vector) retrieval
+    if hybrid and os.path.exists(path):
+        job.progress(0.8, "Updating local keyword index...")
+        try:
+            # Vertex reports directly uploaded files by their file name
+            lexical_index.index_file(corpus_name, rag_file or display_name, display_name, path, uri=display_name)
+        except Exception as e:
+            # The document is in Vertex; a missing keyword index entry is not worth a retry
+            print(f"Keyword indexing failed for {display_name}: {e}")
+
+    # Cached answers no longer reflect the corpus
+    get_answer_store().invalidate_corpus(corpus_name)
+    _remove_staged(path)
+    return {"rag_file": rag_file, "display_name": display_name}
+
+
+def _cleanup_bulk_import(job, paths, run_prefix=None, bucket=None, **payload):
+    _remove_staged(*paths)
+    if run_prefix:
+        delete_staged(_owner_clients(job), bucket or config.STAGING_BUCKET, f"{run_prefix}/files/")
+
+
+@handler("bulk_import", cleanup=_cleanup_bulk_import)
+def bulk_import_job(job, corpus_name, paths, display_names=None, hybrid=False, **options):
+    """Imports many files at once through the staging bucket (see core/bulk_import.py).
+
+    The run prefix and import operation are checkpointed, so a retry polls the
+    import already in progress instead of starting another.
+    """
+    clients = _owner_clients(job)
+    report = bulk_import(
+        clients, corpus_name, paths, display_names, hybrid=hybrid, progress=job.progress,
+        checkpoint=job.checkpoint, **options
+    )
+    _remove_staged(*paths)
+    return report
+
+
+@handler("delete_file")
+def delete_file_job(job, corpus_name, file_name, display_name=None):
+    clients = _owner_clients(job)
+    job.progress(0.2, f"Deleting {display_name or file_name}...")
+    try:
+        clients.delete_file(file_name)
+    except Exception as e:
+        # Already gone after an earlier attempt
+        if "404" not in str(e) and "not found" not in str(e).lower():
+            raise
+    lexical_index.remove_file(corpus_name, file_name)
+    get_answer_store().invalidate_corpus(corpus_name)
+    return {"deleted": file_name}
+
+
+def _created_by_earlier_attempt(clients, job, display_name):
+    """Corpus an earlier attempt created before it could checkpoint it, if any."""
+    for corpus in clients.list_corpora():
+        created = corpus.create_time.timestamp() if corpus.create_time else 0
+        if corpus.display_name == display_name and created >= job.created:
+            return corpus.name
+    return None
+
+
+@handler("create_engine")
+def create_engine_job(job, display_name, corpus_name=None):
+    # A retry after a crash must not create a second corpus
+    existing = next((e for e in load_rag_engines() if e["name"] == display_name), None)
+    if existing:
+        return {"corpus_id": existing["corpus_id"]}
+
+    clients = _owner_clients(job)
+    if corpus_name is None and job.attempts > 1:
+        corpus_name = _created_by_earlier_attempt(clients, job, display_name)
+    if corpus_name is None:
+        job.progress(0.2, "Creating new RAG Corpus...")
+        corpus_name = clients.create_corpus(display_name).name
+    job.checkpoint(corpus_name=corpus_name)
+    new_corpus_id = corpus_name.split("/")[-1]
+
+    engines = load_rag_engines()
+    engines.append({
+        "name": display_name,
+        "corpus_id": new_corpus_id,
+        "owner": "user",
+        "is_default": False
+    })
+    save_rag_engines(engines)
+    return {"corpus_id": new_corpus_id}
+
+
+@handler("delete_engine")
+def delete_engine_job(job, corpus_name, engine_name):
+    clients = _owner_clients(job)
+    job.progress(0.2, f"Deleting corpus {engine_name}...")
+    warning = None
+    try:
+        clients.delete_corpus(corpus_name)
+    except Exception as e:
+        # Same as before: the engine is still removed from the configuration
+        warning = f"Cloud resource deletion failed (might contain files): {e}"
+
+    lexical_index.delete_index(corpus_name)
+    get_answer_store().invalidate_corpus(corpus_name)
+    save_rag_engines([e for e in load_rag_engines() if e["name"] != engine_name])
+    return {"deleted": engine_name, "warning": warning}
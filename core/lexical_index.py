@@ -0,0 +1,284 @@
+import gzip
+import html.parser
+import json
+import math
+import os
+import re
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+from . import config
+
+# Any script's letters and digits; keeps identifiers such as "XR-200", "v2.5" or "ISO_9001" as single terms
+_TOKEN_RE = re.compile(r"\w(?:[\w\-\.]*\w)?")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall((text or "").casefold())
+
+
+def chunk_text(text, size=None, overlap=None):
+    """Splits text into overlapping word windows."""
+    size = size or config.LEXICAL_CHUNK_WORDS
+    overlap = overlap if overlap is not None else config.LEXICAL_CHUNK_OVERLAP
+    words = text.split()
+    if not words:
+        return []
+    step = max(1, size - overlap)
+    return [" ".join(words[i:i + size]) for i in range(0, max(1, len(words) - overlap), step)]
+
+
+# -------------------------------
+# Text Extraction
+# -------------------------------
+class _HTMLText(html.parser.HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skip += 1
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style") and self._skip:
+            self._skip -= 1
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+
+def _docx_text(path):
+    ns = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+    with zipfile.ZipFile(path) as archive:
+        root = ET.fromstring(archive.read("word/document.xml"))
+    paragraphs = []
+    for paragraph in root.iter(f"{ns}p"):
+        paragraphs.append("".join(node.text or "" for node in paragraph.iter(f"{ns}t")))
+    return "\n".join(paragraphs)
+
+
+def _pdf_text(path):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        # pypdf is optional; PDFs are then only searchable through Vertex
+        return None
+    return "\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+
+
+def extract_text(path, filename=None):
+    """Best-effort plain text of an uploaded document, or None if the format is unsupported."""
+    extension = os.path.splitext(filename or path)[1].lower()
+    if extension == ".pdf":
+        return _pdf_text(path)
+    if extension == ".docx":
+        return _docx_text(path)
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        raw = f.read()
+    if extension in (".html", ".htm"):
+        parser = _HTMLText()
+        parser.feed(raw)
+        return " ".join(parser.parts)
+    return raw
+
+
+# -------------------------------
+# Index
+# -------------------------------
+class LexicalIndex:
+    """BM25 inverted index over the documents uploaded to one corpus.
+
+    Stored as gzipped JSON: chunk texts plus postings lists flattened to
+    `[chunk_id, tf, chunk_id, tf, ...]`. Removed chunks become null slots and are
+    compacted away once they make up a quarter of the index.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        self.docs = {}  # doc_id -> {"title", "uri", "chunks": [chunk ids]}
+        self.chunks = []  # chunk_id -> [doc_id, text, length] or None
+        self.postings = {}  # term -> [chunk_id, tf, ...]
+
+    # -------------------------------
+    # Persistence
+    # -------------------------------
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+            self.docs = data["docs"]
+            self.chunks = data["chunks"]
+            self.postings = data["postings"]
+            self._mtime = os.path.getmtime(self.path)
+        except Exception as e:
+            print(f"Error loading lexical index {self.path}: {e}")
+            self._reset()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump({"docs": self.docs, "chunks": self.chunks, "postings": self.postings}, f, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+        self._mtime = os.path.getmtime(self.path)
+
+    def _refresh_if_stale(self):
+        # Another process (API worker, job runner) may have updated the file
+        if os.path.exists(self.path) and os.path.getmtime(self.path) != self._mtime:
+            self._reset()
+            self._load()
+
+    # -------------------------------
+    # Updates
+    # -------------------------------
+    def add_document(self, doc_id, title, text, uri=None):
+        """(Re)indexes a document; `uri` is its source URI as Vertex reports it, so hits fuse with vector hits."""
+        with self._lock:
+            self._refresh_if_stale()
+            self._remove(doc_id)
+            chunk_ids = []
+            for chunk in chunk_text(text):
+                terms = tokenize(chunk)
+                if not terms:
+                    continue
+                chunk_id = len(self.chunks)
+                self.chunks.append([doc_id, chunk, len(terms)])
+                chunk_ids.append(chunk_id)
+                counts = {}
+                for term in terms:
+                    counts[term] = counts.get(term, 0) + 1
+                for term, tf in counts.items():
+                    self.postings.setdefault(term, []).extend((chunk_id, tf))
+            self.docs[doc_id] = {"title": title, "uri": uri or title, "chunks": chunk_ids}
+            self._save()
+            return len(chunk_ids)
+
+    def remove_document(self, doc_id):
+        with self._lock:
+            self._refresh_if_stale()
+            if self._remove(doc_id):
+                self._save()
+
+    def _remove(self, doc_id):
+        doc = self.docs.pop(doc_id, None)
+        if doc is None:
+            return False
+        removed = set(doc["chunks"])
+        for chunk_id in removed:
+            self.chunks[chunk_id] = None
+        for term in list(self.postings):
+            flat = self.postings[term]
+            kept = [v for i in range(0, len(flat), 2) if flat[i] not in removed for v in flat[i:i + 2]]
+            if kept:
+                self.postings[term] = kept
+            else:
+                del self.postings[term]
+        if self.chunks.count(None) * 4 > len(self.chunks):
+            self._compact()
+        return True
+
+    def _compact(self):
+        remap = {}
+        chunks = []
+        for old_id, chunk in enumerate(self.chunks):
+            if chunk is not None:
+                remap[old_id] = len(chunks)
+                chunks.append(chunk)
+        self.chunks = chunks
+        for doc in self.docs.values():
+            doc["chunks"] = [remap[c] for c in doc["chunks"]]
+        for term, flat in self.postings.items():
+            self.postings[term] = [remap[v] if i % 2 == 0 else v for i, v in enumerate(flat)]
+
+    # -------------------------------
+    # Search
+    # -------------------------------
+    def __len__(self):
+        return len(self.docs)
+
+    def search(self, query, top_k=None):
+        """BM25 search. Returns ranked chunk dicts shaped like Vertex retrieval results."""
+        top_k = top_k or config.SIMILARITY_TOP_K
+        with self._lock:
+            self._refresh_if_stale()
+            live = [c for c in self.chunks if c is not None]
+            if not live:
+                return []
+            avg_len = sum(c[2] for c in live) / len(live)
+            scores = {}
+            for term in set(tokenize(query)):
+                flat = self.postings.get(term)
+                if not flat:
+                    continue
+                df = len(flat) // 2
+                idf = math.log(1 + (len(live) - df + 0.5) / (df + 0.5))
+                for i in range(0, len(flat), 2):
+                    chunk_id, tf = flat[i], flat[i + 1]
+                    length = self.chunks[chunk_id][2]
+                    norm = tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_len))
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * norm
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+            results = []
+            for chunk_id, score in ranked:
+                doc_id, text, _ = self.chunks[chunk_id]
+                doc = self.docs[doc_id]
+                results.append({
+                    "uri": doc.get("uri") or doc["title"], "title": doc["title"], "text": text, "score": score,
+                    "source": "lexical",
+                })
+            return results
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def index_path(corpus_name):
+    corpus_id = corpus_name.split("/")[-1]
+    return os.path.join(config.LEXICAL_INDEX_DIR, f"{corpus_id}.json.gz")
+
+
+def get_lexical_index(corpus_name):
+    with _indexes_lock:
+        index = _indexes.get(corpus_name)
+        if index is None:
+            index = _indexes[corpus_name] = LexicalIndex(index_path(corpus_name))
+        return index
+
+
+def index_file(corpus_name, doc_id, display_name, path, uri=None):
+    """Adds an uploaded file to the corpus' lexical index. Returns the number of chunks indexed."""
+    text = extract_text(path, display_name)
+    if not text:
+        return 0
+    return get_lexical_index(corpus_name).add_document(doc_id, display_name, text, uri)
+
+
+def remove_file(corpus_name, doc_id):
+    get_lexical_index(corpus_name).remove_document(doc_id)
+
+
+def delete_index(corpus_name):
+    with _indexes_lock:
+        _indexes.pop(corpus_name, None)
+    path = index_path(corpus_name)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def has_index(corpus_name):
+    return os.path.exists(index_path(corpus_name))
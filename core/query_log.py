@@ -0,0 +1,149 @@
+import atexit
+import glob
+import gzip
+import json
+import os
+import queue
+import shutil
+import socket
+import threading
+import time
+import streamlit as st
+from . import config
+
+
+class QueryLog:
+    """Append-only JSON-lines log of chat turns, written by a background thread.
+
+    `log()` only enqueues, so the request path never waits on disk. Each process
+    writes its own active file (`queries-<host>-<pid>.jsonl`), which keeps
+    concurrent API workers from interleaving lines or racing on rotation. Past
+    `max_bytes` the file is gzipped to `<name>-<timestamp>.jsonl.gz`, and only
+    the newest `backups` rotated files are kept. Active files left behind by
+    exited processes on this host are rotated when the writer starts.
+    """
+
+    def __init__(self, directory=None, max_bytes=None, backups=None, queue_size=None):
+        self.directory = directory or config.QUERY_LOG_DIR
+        self.max_bytes = max_bytes or config.QUERY_LOG_MAX_BYTES
+        self.backups = backups or config.QUERY_LOG_BACKUPS
+        self.path = os.path.join(self.directory, f"queries-{socket.gethostname()}-{os.getpid()}.jsonl")
+        self._queue = queue.Queue(maxsize=queue_size or config.QUERY_LOG_QUEUE_SIZE)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name="query-log", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, entry):
+        entry.setdefault("ts", time.time())
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout=5.0):
+        """Flushes queued entries; called at interpreter exit."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def _run(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._rotate_orphans()
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                return
+            # Write whatever has queued up in one go
+            batch = [entry]
+            while len(batch) < 500:
+                try:
+                    entry = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is None:
+                    self._write(batch)
+                    return
+                batch.append(entry)
+            self._write(batch)
+
+    def _write(self, batch):
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                for entry in batch:
+                    f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":"), default=str) + "\n")
+            if os.path.getsize(self.path) >= self.max_bytes:
+                self._rotate(self.path)
+        except OSError as e:
+            print(f"Error writing query log: {e}")
+
+    def _rotate_orphans(self):
+        # A restarted worker gets a new pid, so nothing else would ever rotate (or prune) its old file
+        prefix = os.path.join(self.directory, f"queries-{socket.gethostname()}-")
+        for path in glob.glob(f"{glob.escape(prefix)}*.jsonl"):
+            pid = path[len(prefix):-len(".jsonl")]
+            if path == self.path or not pid.isdigit() or _pid_alive(int(pid)):
+                continue
+            try:
+                self._rotate(path)
+            except OSError as e:
+                print(f"Error rotating query log {path}: {e}")
+
+    def _rotate(self, path):
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        base = path[:-len(".jsonl")]
+        rotated = f"{base}-{stamp}.jsonl.gz"
+        suffix = 1
+        while os.path.exists(rotated):
+            rotated = f"{base}-{stamp}.{suffix}.jsonl.gz"
+            suffix += 1
+        with open(path, "rb") as src, gzip.open(rotated, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(path)
+        old = sorted(glob.glob(os.path.join(self.directory, "*.jsonl.gz")), key=os.path.getmtime)
+        for path in old[:-self.backups]:
+            os.remove(path)
+
+
+def _pid_alive(pid):
+    if os.name != "posix":
+        # No signal-0 probe; leave the file to its owner
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_entries(directory=None, since=None):
+    """Yields logged entries from active and rotated files, optionally only those after `since` (epoch)."""
+    directory = directory or config.QUERY_LOG_DIR
+    paths = glob.glob(os.path.join(directory, "*.jsonl")) + glob.glob(os.path.join(directory, "*.jsonl.gz"))
+    for path in paths:
+        if since and os.path.getmtime(path) < since:
+            continue
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash
+                    continue
+                if not since or entry.get("ts", 0) >= since:
+                    yield entry
+
+
+class _DisabledLog:
+    dropped = 0
+
+    def log(self, entry):
+        pass
+
+
+@st.cache_resource
+def get_query_log():
+    return QueryLog() if config.QUERY_LOG_ENABLED else _DisabledLog()
@@ -1,7 +1,5 @@
 import streamlit as st
-import vertexai
-from vertexai.preview import rag
-from vertexai.preview.generative_models import GenerativeModel, Tool
+from google.genai import types
 from . import config
 
 RAG_SYSTEM_INSTRUCTION = """
@@ -42,42 +40,27 @@ enough information.
 """
 
 @st.cache_resource
-def init_vertex_ai(_credentials):
-    try:
-        vertexai.init(project=config.PROJECT_ID, location=config.LOCATION, credentials=_credentials)
-        return True
-    except Exception as e:
-        return str(e)
-
-@st.cache_resource
-def get_rag_tool(resource_name):
-    rag_tool = Tool.from_retrieval(
-        retrieval=rag.Retrieval(
-            source=rag.VertexRagStore(
+def get_rag_tool(resource_name, similarity_top_k=config.SIMILARITY_TOP_K, vector_distance_threshold=config.VECTOR_DISTANCE_THRESHOLD):
+    """Retrieval tool for generation requests. Holds no credentials, so it is shared by all users."""
+    rag_tool = types.Tool(
+        retrieval=types.Retrieval(
+            vertex_rag_store=types.VertexRagStore(
                 rag_resources=[
-                    rag.RagResource(
+                    types.VertexRagStoreRagResource(
                         rag_corpus=resource_name
                     )
                 ],
-                similarity_top_k=10,
-                vector_distance_threshold=0.5,
+                similarity_top_k=similarity_top_k,
+                vector_distance_threshold=vector_distance_threshold,
             ),
         )
     )
     return rag_tool
 
-@st.cache_resource
-def get_model(_rag_tool, model_name): 
-    return GenerativeModel(
-        model_name, 
-        tools=[_rag_tool],
-        system_instruction=[RAG_SYSTEM_INSTRUCTION]
-    )
-
-def list_corpora():
+def list_corpora(clients):
     """Lists all available RAG corpora in the project."""
     try:
-        return list(rag.list_corpora())
+        return clients.list_corpora()
     except Exception as e:
         # st.error(f"Error listing corpora: {e}")
         print(f"Error listing corpora: {e}")
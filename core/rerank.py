@@ -0,0 +1,93 @@
+import math
+import threading
+from . import config
+from .lexical_index import tokenize
+from .scheduler import estimate_tokens
+
+_cross_encoder = None
+_cross_encoder_lock = threading.Lock()
+
+
+def _get_cross_encoder():
+    """Loads the optional cross-encoder named by config.RERANK_MODEL, or returns None."""
+    global _cross_encoder
+    if not config.RERANK_MODEL:
+        return None
+    with _cross_encoder_lock:
+        if _cross_encoder is None:
+            try:
+                from sentence_transformers import CrossEncoder
+            except ImportError:
+                # sentence-transformers is optional; fall back to lexical scoring
+                return None
+            _cross_encoder = CrossEncoder(config.RERANK_MODEL, device="cpu")
+        return _cross_encoder
+
+
+def lexical_scores(query, chunks):
+    """BM25-style query/chunk overlap, with IDF computed over the candidate set."""
+    query_terms = set(tokenize(query))
+    chunk_terms = [tokenize(c.get("text")) for c in chunks]
+    if not query_terms or not chunks:
+        return [0.0] * len(chunks)
+    avg_len = sum(len(t) for t in chunk_terms) / len(chunks) or 1.0
+    doc_freq = {term: sum(1 for terms in chunk_terms if term in terms) for term in query_terms}
+    scores = []
+    for terms in chunk_terms:
+        counts = {}
+        for term in terms:
+            if term in query_terms:
+                counts[term] = counts.get(term, 0) + 1
+        score = 0.0
+        for term, tf in counts.items():
+            idf = math.log(1 + (len(chunks) - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+            score += idf * tf * 2.2 / (tf + 1.2 * (0.25 + 0.75 * len(terms) / avg_len))
+        scores.append(score)
+    return scores
+
+
+def rerank(query, chunks, top_k=None, token_budget=None):
+    """Re-orders retrieved chunks and keeps the best ones that fit a token budget.
+
+    Each chunk's relevance score is blended with its retrieval rank, so that a
+    chunk the retriever was confident about is not dropped only because it
+    paraphrases the question. When no chunk shares a term with the query
+    (paraphrases, other scripts), the retriever's own ranking decides alone.
+    """
+    if not chunks:
+        return []
+    top_k = top_k or config.RERANK_TOP_K
+    token_budget = token_budget or config.RERANK_TOKEN_BUDGET
+
+    cross_encoder = _get_cross_encoder()
+    if cross_encoder is not None:
+        relevance = [float(s) for s in cross_encoder.predict([(query, c.get("text") or "") for c in chunks])]
+        # Shift logits to be positive; the cross-encoder never discards chunks outright
+        low = min(relevance)
+        relevance = [r - low + 1e-6 for r in relevance]
+    else:
+        relevance = lexical_scores(query, chunks)
+
+    # No lexical overlap says nothing about relevance; keep the top vector-ranked chunks
+    best = max(relevance)
+    if best <= 0:
+        relevance = [0.0] * len(chunks)
+        best = 1.0
+    weight = config.RERANK_RELEVANCE_WEIGHT
+    scored = []
+    for rank, (chunk, score) in enumerate(zip(chunks, relevance)):
+        blended = weight * score / best + (1 - weight) / (1 + rank)
+        scored.append((blended, chunk))
+    scored.sort(key=lambda item: item[0], reverse=True)
+
+    selected = []
+    used = 0
+    for blended, chunk in scored:
+        cost = estimate_tokens(chunk.get("text"))
+        if selected and used + cost > token_budget:
+            continue
+        selected.append(dict(chunk, rerank_score=blended))
+        used += cost
+        if len(selected) >= top_k:
+            break
+    return selected
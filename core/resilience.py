@@ -0,0 +1,245 @@
+import collections
+import concurrent.futures
+import threading
+import time
+import streamlit as st
+from . import config
+from .scheduler import on_dispatch
+
+
+class DeadlineExceeded(TimeoutError):
+    """No attempt finished before the request deadline."""
+
+
+class CircuitOpen(Exception):
+    """Every candidate model is currently short-circuited."""
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies per key (e.g. model name)."""
+
+    def __init__(self, window=200):
+        self._samples = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds):
+        with self._lock:
+            self._samples[key].append(seconds)
+
+    def percentile(self, key, q, default=None, min_samples=20):
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < min_samples:
+            return default
+        index = min(len(samples) - 1, int(q * len(samples)))
+        return samples[index]
+
+
+class CircuitBreaker:
+    """Classic closed / open / half-open breaker keyed by model.
+
+    After `failure_threshold` consecutive failures the breaker opens and calls
+    are refused for `cooldown` seconds; then a single trial call is let through
+    and its outcome decides whether to close or re-open.
+    """
+
+    def __init__(self, failure_threshold=None, cooldown=None):
+        self.failure_threshold = failure_threshold or config.BREAKER_FAILURE_THRESHOLD
+        self.cooldown = cooldown or config.BREAKER_COOLDOWN
+        self._failures = collections.Counter()
+        self._opened_at = {}
+        self._trial_in_flight = set()
+        self._lock = threading.Lock()
+
+    def state(self, key):
+        with self._lock:
+            return self._state(key)
+
+    def _state(self, key):
+        opened_at = self._opened_at.get(key)
+        if opened_at is None:
+            return "closed"
+        if time.monotonic() - opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self, key):
+        with self._lock:
+            state = self._state(key)
+            if state == "closed":
+                return True
+            if state == "half-open" and key not in self._trial_in_flight:
+                self._trial_in_flight.add(key)
+                return True
+            return False
+
+    def record_success(self, key):
+        with self._lock:
+            self._failures[key] = 0
+            self._opened_at.pop(key, None)
+            self._trial_in_flight.discard(key)
+
+    def release(self, key):
+        """Ends a half-open trial without a verdict (the call failed for reasons unrelated to the model)."""
+        with self._lock:
+            self._trial_in_flight.discard(key)
+
+    def record_failure(self, key):
+        with self._lock:
+            self._failures[key] += 1
+            if key in self._trial_in_flight or self._failures[key] >= self.failure_threshold:
+                self._opened_at[key] = time.monotonic()
+            self._trial_in_flight.discard(key)
+
+    def snapshot(self):
+        with self._lock:
+            keys = set(self._failures) | set(self._opened_at)
+            return {k: {"state": self._state(k), "failures": self._failures[k]} for k in keys}
+
+
+def _counts_as_failure(exc):
+    """Client errors (bad request, permission denied...) say nothing about the model's health."""
+    code = getattr(exc, "code", None)
+    try:
+        code = int(code)
+    except (TypeError, ValueError):
+        return True
+    return code == 429 or code >= 500
+
+
+class HedgedExecutor:
+    """Runs a call against a primary model and hedges it with a fallback model.
+
+    If the primary has not answered after its recent p-th percentile latency, the
+    same request is also sent to the fallback and whichever succeeds first wins.
+    Open circuit breakers skip a model entirely. Losing attempts are left to
+    finish in the background (their HTTP timeout bounds them) and are ignored.
+    Latencies, the hedge delay and the deadline are measured from when the
+    quota scheduler dispatches the call, so time spent queued for quota is not
+    mistaken for a slow model.
+    """
+
+    def __init__(self, max_workers=32):
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker()
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+
+    def hedge_delay(self, model):
+        delay = self.latency.percentile(model, config.HEDGE_PERCENTILE, default=config.HEDGE_MAX_DELAY)
+        return min(max(delay, config.HEDGE_MIN_DELAY), config.HEDGE_MAX_DELAY)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _timed(self, model, func, dispatched):
+        started = [time.monotonic()]
+
+        def dispatch():
+            started[0] = time.monotonic()
+            dispatched.set()
+
+        try:
+            with on_dispatch(dispatch):
+                result = func(model)
+        except Exception as e:
+            if _counts_as_failure(e):
+                self.breaker.record_failure(model)
+            else:
+                # Not the model's fault: neither a failure nor a success, but free a half-open trial slot
+                self.breaker.release(model)
+            raise
+        finally:
+            dispatched.set()
+        self.latency.record(model, time.monotonic() - started[0])
+        self.breaker.record_success(model)
+        return model, result
+
+    def call(self, func, primary, fallback=None, deadline=None):
+        """Returns `(model, func(model))` from the first model to succeed."""
+        deadline = deadline or config.GENERATION_DEADLINE
+        expires = None
+        candidates = [m for m in (primary, fallback) if m]
+        candidates = list(dict.fromkeys(candidates))
+
+        pending = {}
+        last_error = None
+        started_any = False
+        for index, model in enumerate(candidates):
+            if not self.breaker.allow(model):
+                self._count("short_circuited")
+                continue
+            if started_any:
+                self._count("hedged")
+            dispatched = threading.Event()
+            pending[self._pool.submit(self._timed, model, func, dispatched)] = model
+            started_any = True
+            if expires is None:
+                # The deadline starts once the first attempt has quota and is sent
+                dispatched.wait()
+                expires = time.monotonic() + deadline
+
+            is_last = index == len(candidates) - 1
+            # Give this attempt its hedge delay before starting the next one
+            wait_for = (max(0.0, expires - time.monotonic()) if is_last
+                        else min(self.hedge_delay(model), max(0.0, expires - time.monotonic())))
+            result, last_error = self._wait_first_success(pending, wait_for, last_error)
+            if result is not None:
+                return self._won(result, primary)
+
+        if not started_any:
+            raise CircuitOpen(f"All models are short-circuited: {', '.join(candidates)}")
+
+        # Every candidate has been started; wait out the rest of the deadline
+        while pending:
+            remaining = expires - time.monotonic()
+            if remaining <= 0:
+                break
+            result, last_error = self._wait_first_success(pending, remaining, last_error)
+            if result is not None:
+                return self._won(result, primary)
+        if last_error is not None and not pending:
+            raise last_error
+        self._count("deadline_exceeded")
+        raise DeadlineExceeded(f"No model answered within {deadline}s")
+
+    def _won(self, result, primary):
+        self._count("won_by_primary" if result[0] == primary else "won_by_fallback")
+        return result
+
+    def _wait_first_success(self, pending, timeout, last_error):
+        """Waits up to `timeout` for any pending attempt to succeed; drops failed ones."""
+        expires = time.monotonic() + timeout
+        while pending:
+            remaining = expires - time.monotonic()
+            if remaining <= 0:
+                break
+            done, _ = concurrent.futures.wait(pending, timeout=remaining, return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                model = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Hedged attempt on {model} failed: {e}")
+                    last_error = e
+                    continue
+                return result, last_error
+        return None, last_error
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        return {"counters": counters, "breakers": self.breaker.snapshot()}
+
+
+def fallback_model_for(model):
+    return config.FALLBACK_MODELS.get(model, config.FALLBACK_MODELS["default"])
+
+
+@st.cache_resource
+def get_hedged_executor():
+    return HedgedExecutor()
@@ -0,0 +1,227 @@
+import concurrent.futures
+import hashlib
+import json
+import re
+import time
+from google.cloud import aiplatform_v1
+from . import config
+from . import lexical_index
+from .shared_state import corpus_generations, get_shared_state
+
+# Shared by every session; retrieval calls are I/O bound
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=16, thread_name_prefix="retrieval")
+
+# Greetings, thanks and acknowledgements: nothing in the documents can answer them
+_SMALL_TALK_RE = re.compile(
+    r"(hi|hello|hey|good (morning|afternoon|evening)|thanks?( you)?( very much| a lot)?|thx|ty|ok(ay)?|cool|great|"
+    r"nice|got it|bye|goodbye|see you|cheers)( there| again| all)?[\s!.?,:;)(]*",
+    re.IGNORECASE,
+)
+
+
+class RetrievalError(RuntimeError):
+    """Every corpus of a multi-corpus retrieval failed. `errors` maps corpus names to their exceptions."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f"Retrieval failed for every engine: {next(iter(errors.values()))}")
+
+    @property
+    def access_denied(self):
+        return all(is_access_denied(e) for e in self.errors.values())
+
+
+def is_small_talk(prompt):
+    """True for greetings and thanks, which are answered without retrieving excerpts."""
+    return bool(_SMALL_TALK_RE.fullmatch(prompt.strip()))
+
+
+def _retrieval_cache_key(corpus_name, query, top_k, threshold):
+    # The corpus generation is part of the key, so results go stale as soon as its files change
+    corpus_id = corpus_name.split("/")[-1]
+    generation = corpus_generations([corpus_name])[corpus_id]
+    digest = hashlib.sha1(json.dumps([" ".join(query.split()), top_k, threshold]).encode("utf-8")).hexdigest()
+    return f"retrieval:{corpus_id}:{generation}:{digest}"
+
+
+def retrieve_contexts(clients, corpus_name, query, top_k=None, vector_distance_threshold=None):
+    """Retrieves chunks from one corpus. Returns a ranked list of chunk dicts.
+
+    Results are kept in the shared state for RETRIEVAL_CACHE_TTL seconds, so a
+    query retrieved on one replica is not retrieved again on the others. A
+    cached result is only returned to callers Vertex lets read the corpus
+    (`VertexClients.can_read`).
+    """
+    top_k = top_k or config.SIMILARITY_TOP_K
+    threshold = vector_distance_threshold if vector_distance_threshold is not None else config.VECTOR_DISTANCE_THRESHOLD
+    cache_key = None
+    if config.RETRIEVAL_CACHE_TTL:
+        cache_key = _retrieval_cache_key(corpus_name, query, top_k, threshold)
+        cached = get_shared_state().get(cache_key)
+        # Results may have been retrieved by another user; serve them only after an IAM check
+        if cached is not None and clients.can_read([corpus_name]):
+            return cached
+    request = aiplatform_v1.RetrieveContextsRequest(
+        parent=clients.parent,
+        vertex_rag_store=aiplatform_v1.RetrieveContextsRequest.VertexRagStore(
+            rag_resources=[
+                aiplatform_v1.RetrieveContextsRequest.VertexRagStore.RagResource(rag_corpus=corpus_name)
+            ],
+        ),
+        query=aiplatform_v1.RagQuery(
+            text=query,
+            rag_retrieval_config=aiplatform_v1.RagRetrievalConfig(
+                top_k=top_k,
+                filter=aiplatform_v1.RagRetrievalConfig.Filter(vector_distance_threshold=threshold),
+            ),
+        ),
+    )
+    response = clients.schedule(lambda: clients.rag.retrieve_contexts(request=request))
+    chunks = [
+        {
+            "uri": context.source_uri,
+            "title": context.source_display_name,
+            "text": context.text,
+            "score": context.score,
+            "corpus": corpus_name,
+        }
+        for context in response.contexts.contexts
+    ]
+    if cache_key:
+        get_shared_state().set(cache_key, chunks, ttl=config.RETRIEVAL_CACHE_TTL)
+    return chunks
+
+
+def is_access_denied(exc):
+    """True for 401/403 errors, i.e. the caller may not read the corpus."""
+    return getattr(exc, "code", None) in (401, 403)
+
+
+def fan_out_retrieve(clients, corpus_names, query, params=None, errors=None):
+    """Queries every corpus concurrently, so wall-clock time is that of the slowest corpus.
+
+    `params` maps corpus names to their `similarity_top_k` / `vector_distance_threshold`.
+    Returns `{corpus_name: [chunks]}`; a corpus that fails is logged and left out,
+    and recorded in the `errors` dict (corpus name -> exception) when one is given.
+    """
+    params = params or {}
+    futures = {}
+    for name in corpus_names:
+        corpus_params = params.get(name, {})
+        future = _executor.submit(
+            retrieve_contexts,
+            clients,
+            name,
+            query,
+            corpus_params.get("similarity_top_k"),
+            corpus_params.get("vector_distance_threshold"),
+        )
+        futures[future] = name
+    results = {}
+    for future in concurrent.futures.as_completed(futures):
+        name = futures[future]
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            print(f"Retrieval failed for {name}: {e}")
+            if errors is not None:
+                errors[name] = e
+    return results
+
+
+def _shingles(text):
+    # Word trigrams: two excerpts share many single words, but rarely phrases, unless they cover the same passage
+    terms = lexical_index.tokenize(text)
+    return {tuple(terms[i:i + 3]) for i in range(max(1, len(terms) - 2))} if terms else set()
+
+
+def _overlap(shingles, other):
+    """Share of the shorter excerpt's trigrams the other excerpt contains."""
+    if not shingles or not other:
+        return float(shingles == other)
+    return len(shingles & other) / min(len(shingles), len(other))
+
+
+def reciprocal_rank_fusion(ranked_lists, k=None, limit=None):
+    """Merges ranked chunk lists with reciprocal-rank fusion, de-duplicating chunks.
+
+    Each chunk scores sum(1 / (k + rank)) over the lists it appears in. The
+    returned chunks carry that score as `fused_score`. Vertex and the local
+    lexical index chunk a document differently, so excerpts of the same source
+    URI whose text overlaps by RRF_DUPLICATE_OVERLAP count as one passage; it
+    keeps the text of the excerpt seen first and scores once per list.
+    """
+    k = k or config.RRF_K
+    by_source = {}  # uri -> [(shingles, entry)]
+    merged = []
+    for ranked in ranked_lists:
+        scored = set()
+        for rank, chunk in enumerate(ranked, start=1):
+            shingles = _shingles(chunk.get("text"))
+            passages = by_source.setdefault(chunk.get("uri") or chunk.get("title"), [])
+            entry = next((e for s, e in passages if _overlap(shingles, s) >= config.RRF_DUPLICATE_OVERLAP), None)
+            if entry is None:
+                entry = dict(chunk, fused_score=0.0)
+                passages.append((shingles, entry))
+                merged.append(entry)
+            if id(entry) not in scored:
+                scored.add(id(entry))
+                entry["fused_score"] += 1.0 / (k + rank)
+    merged.sort(key=lambda c: c["fused_score"], reverse=True)
+    return merged[:limit] if limit else merged
+
+
+def lexical_retrieve(corpus_names, query, top_k=None):
+    """BM25 hits from the local lexical index of each corpus that has one."""
+    ranked_lists = []
+    for name in corpus_names:
+        if not lexical_index.has_index(name):
+            continue
+        hits = lexical_index.get_lexical_index(name).search(query, top_k)
+        for hit in hits:
+            hit["corpus"] = name
+        if hits:
+            ranked_lists.append(hits)
+    return ranked_lists
+
+
+def multi_corpus_retrieve(clients, corpus_names, query, params=None, hybrid=False, limit=None):
+    """Fan-out retrieval followed by fusion. Returns `(chunks, elapsed_seconds)`.
+
+    With `hybrid`, BM25 hits from the local lexical index are fused in as extra
+    ranked lists, which rescues exact identifiers that vector search misses.
+    Raises RetrievalError when every corpus fails, rather than returning no
+    excerpts as if nothing matched.
+    """
+    started = time.monotonic()
+    # The lexical search runs while the Vertex calls are in flight
+    limit = limit or max(
+        [p.get("similarity_top_k", config.SIMILARITY_TOP_K) for p in (params or {}).values()] or [config.SIMILARITY_TOP_K]
+    )
+    lexical_future = _executor.submit(lexical_retrieve, corpus_names, query, limit) if hybrid else None
+    errors = {}
+    ranked_lists = list(fan_out_retrieve(clients, corpus_names, query, params, errors).values())
+    if corpus_names and len(errors) == len(corpus_names):
+        if lexical_future is not None:
+            lexical_future.cancel()
+        raise RetrievalError(errors)
+    if lexical_future is not None:
+        # The local index holds document text too: only serve it for corpora Vertex let the caller read,
+        # either just now or, when that retrieval failed, through an IAM check
+        unreadable = {name for name in errors if not clients.can_read([name])}
+        ranked_lists += [hits for hits in lexical_future.result() if hits[0]["corpus"] not in unreadable]
+    fused = reciprocal_rank_fusion(ranked_lists, limit=limit)
+    return fused, time.monotonic() - started
+
+
+def build_grounded_prompt(prompt, chunks):
+    """Puts retrieved excerpts in front of the user's question for client-side RAG."""
+    if not chunks:
+        return prompt
+    lines = ["Answer using the following excerpts retrieved from the document corpus.", ""]
+    for i, chunk in enumerate(chunks, start=1):
+        lines.append(f"[{i}] {chunk.get('title') or ''} ({chunk.get('uri') or ''})")
+        lines.append(chunk.get("text") or "")
+        lines.append("")
+    lines.append(f"Question: {prompt}")
+    return "\n".join(lines)
@@ -0,0 +1,321 @@
+import collections
+import contextlib
+import random
+import threading
+import time
+import streamlit as st
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+from . import config
+
+
+class QueueTimeout(Exception):
+    """Raised when a request waited longer than the scheduler's max_wait for quota."""
+
+
+# Per-thread callback run when a request leaves the queue; see `on_dispatch`
+_dispatch = threading.local()
+
+
+@contextlib.contextmanager
+def on_dispatch(callback):
+    """Calls `callback()` each time a request submitted on this thread is dispatched.
+
+    Lets callers time a call from the moment it is sent rather than from when it
+    started waiting for quota.
+    """
+    previous = getattr(_dispatch, "callback", None)
+    _dispatch.callback = callback
+    try:
+        yield
+    finally:
+        _dispatch.callback = previous
+
+
+def estimate_tokens(*texts):
+    """Rough token estimate (~4 characters per token) used until real usage is known."""
+    return sum(len(t or "") for t in texts) // 4 + 1
+
+
+class TokenBucket:
+    """Per-minute token bucket. Balance may go negative when usage is settled after the fact."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        # `now` may predate the bucket when it was created while checking a request
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def time_until(self, amount, now, after=0.0):
+        """Seconds until `amount` can be taken (0 if available now), once `after` has been taken first."""
+        self._refill(now)
+        amount = self.charge(amount) + after
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < amount:
+            wait = max(wait, (amount - self.tokens) / self.rate)
+        return wait
+
+    def charge(self, amount):
+        """What taking `amount` costs: requests larger than the bucket are capped so they can ever run."""
+        return min(amount, self.capacity)
+
+    def take(self, amount, now):
+        self._refill(now)
+        self.tokens -= self.charge(amount)
+
+    def adjust(self, delta):
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+    def block(self, seconds, now):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class _Ticket:
+    def __init__(self, user_id, demands):
+        self.user_id = user_id
+        self.demands = demands
+
+
+def _status_code(exc):
+    code = getattr(exc, "code", None)
+    try:
+        return int(code)
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_retryable(exc):
+    return _status_code(exc) in (429, 503)
+
+
+def _retry_after_seconds(exc):
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+class _RetryAfterWait:
+    """Tenacity wait that honours Retry-After (plus jitter), else jittered exponential backoff."""
+
+    def __init__(self):
+        self.fallback = wait_random_exponential(multiplier=1, max=30)
+
+    def __call__(self, retry_state):
+        retry_after = _retry_after_seconds(retry_state.outcome.exception())
+        if retry_after is not None:
+            return retry_after + random.uniform(0, 1)
+        return self.fallback(retry_state)
+
+
+class QuotaScheduler:
+    """Paces Vertex calls against per-model and per-project quotas with fair queuing.
+
+    Waiting requests are kept in one FIFO queue per user and served round-robin
+    across users, so a single heavy user cannot starve the others. The order is
+    kept per bucket: a request waiting for one model's quota only holds back
+    later requests that need that same bucket, so calls to other models (or
+    calls without a model) still go ahead. A 429 blocks the affected buckets
+    for the Retry-After period so queued requests back off together instead of
+    producing an error storm.
+    """
+
+    def __init__(self, model_quotas=None, project_quota=None, max_wait=None, max_attempts=None):
+        self.model_quotas = model_quotas or config.MODEL_QUOTAS
+        self.project_quota = project_quota or config.PROJECT_QUOTA
+        self.max_wait = max_wait or config.SCHEDULER_MAX_WAIT
+        self.max_attempts = max_attempts or config.SCHEDULER_MAX_ATTEMPTS
+        self._buckets = {}
+        self._queues = collections.OrderedDict()  # user_id -> deque of tickets, in round-robin order
+        self._cond = threading.Condition()
+        self._counters = collections.Counter()
+
+    # -------------------------------
+    # Buckets
+    # -------------------------------
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            scope, name, kind = key
+            if scope == "model":
+                quota = self.model_quotas.get(name, self.model_quotas["default"])
+            else:
+                quota = self.project_quota
+            bucket = self._buckets[key] = TokenBucket(quota[f"{kind}_per_minute"])
+        return bucket
+
+    def _demands(self, model, tokens):
+        demands = [(("project", config.PROJECT_ID, "requests"), 1)]
+        if model:
+            demands += [
+                (("model", model, "requests"), 1),
+                (("model", model, "tokens"), tokens),
+                (("project", config.PROJECT_ID, "tokens"), tokens),
+            ]
+        return demands
+
+    # -------------------------------
+    # Fair queue
+    # -------------------------------
+    def _service_order(self):
+        """Waiting tickets in the order they are served: round-robin across users, FIFO per user."""
+        queues = list(self._queues.values())
+        order = []
+        for round_index in range(max((len(q) for q in queues), default=0)):
+            order.extend(q[round_index] for q in queues if round_index < len(q))
+        return order
+
+    def _may_go(self, ticket, now):
+        """Whether `ticket` can take its quota now without jumping ahead of anyone on a bucket it needs.
+
+        Tickets ahead of it that can go now are assumed to take their share
+        first; buckets that a ticket ahead is still waiting for stay reserved
+        for that ticket.
+        """
+        reserved = {}  # bucket key -> amount the ready tickets ahead will take
+        waited_on = set()  # bucket keys a ticket ahead is still waiting for
+        for other in self._service_order():
+            short = {
+                key for key, amount in other.demands
+                if key in waited_on or self._bucket(key).time_until(amount, now, after=reserved.get(key, 0)) > 0
+            }
+            if other is ticket:
+                return not short
+            if short:
+                waited_on |= short
+            else:
+                for key, amount in other.demands:
+                    reserved[key] = reserved.get(key, 0) + self._bucket(key).charge(amount)
+        return False
+
+    def _acquire(self, ticket):
+        deadline = time.monotonic() + self.max_wait
+        with self._cond:
+            self._queues.setdefault(ticket.user_id, collections.deque()).append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self._may_go(ticket, now):
+                        for key, amount in ticket.demands:
+                            self._bucket(key).take(amount, now)
+                        return
+                    own_wait = max(self._bucket(k).time_until(a, now) for k, a in ticket.demands)
+                    if now + max(own_wait, 1e-3) > deadline:
+                        self._counters["timeouts"] += 1
+                        raise QueueTimeout(f"Waited more than {self.max_wait}s for quota")
+                    # Refills are not signalled, and tickets ahead may leave; recheck at least every second
+                    self._cond.wait(timeout=min(1.0, max(own_wait, 0.01)))
+            finally:
+                self._dequeue(ticket)
+                self._cond.notify_all()
+
+    def _dequeue(self, ticket):
+        queue = self._queues.get(ticket.user_id)
+        if queue is None or ticket not in queue:
+            return
+        served = queue[0] is ticket
+        queue.remove(ticket)
+        if not queue:
+            del self._queues[ticket.user_id]
+        elif served:
+            # Served users go to the back of the round-robin order
+            self._queues.move_to_end(ticket.user_id)
+
+    def position(self, user_id):
+        """Number of queued requests that will be served before this user's latest one, or None.
+
+        That includes the user's own earlier requests (e.g. background prefetches).
+        """
+        with self._cond:
+            if user_id not in self._queues:
+                return None
+            users = list(self._queues)
+            rank = users.index(user_id)
+            # The latest request waits for the user's own earlier ones, one per round
+            earlier = len(self._queues[user_id]) - 1
+            ahead = earlier
+            for other_rank, other in enumerate(users):
+                if other != user_id:
+                    # Round-robin: every other user gets one turn per round, plus one more if ahead in the order
+                    ahead += min(len(self._queues[other]), earlier + (1 if other_rank < rank else 0))
+            return ahead
+
+    def queue_length(self):
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+    # -------------------------------
+    # Execution
+    # -------------------------------
+    def _block(self, demands, seconds):
+        with self._cond:
+            now = time.monotonic()
+            for key, _ in demands:
+                self._bucket(key).block(seconds, now)
+            self._cond.notify_all()
+
+    def submit(self, user_id, func, model=None, tokens=0):
+        """Runs `func()` once quota is available, retrying 429/503 with backoff.
+
+        `tokens` is the estimated token cost for model calls; correct it afterwards
+        with `settle` once the real usage is known.
+        """
+        demands = self._demands(model, tokens)
+
+        def attempt():
+            self._acquire(_Ticket(user_id, demands))
+            callback = getattr(_dispatch, "callback", None)
+            if callback is not None:
+                callback()
+            try:
+                result = func()
+            except Exception as e:
+                if _status_code(e) == 429:
+                    self._count("throttled")
+                    self._block(demands, _retry_after_seconds(e) or 2.0)
+                raise
+            self._count("completed")
+            return result
+
+        retrying = Retrying(
+            retry=retry_if_exception(_is_retryable),
+            wait=_RetryAfterWait(),
+            stop=stop_after_attempt(self.max_attempts),
+            reraise=True,
+        )
+        return retrying(attempt)
+
+    def _count(self, name):
+        with self._cond:
+            self._counters[name] += 1
+
+    def settle(self, model, estimated_tokens, actual_tokens):
+        """Charges (or refunds) the difference between estimated and actual token usage."""
+        if not model or actual_tokens is None:
+            return
+        delta = actual_tokens - estimated_tokens
+        with self._cond:
+            self._bucket(("model", model, "tokens")).adjust(delta)
+            self._bucket(("project", config.PROJECT_ID, "tokens")).adjust(delta)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return dict(self._counters, queued=sum(len(q) for q in self._queues.values()))
+
+
+@st.cache_resource
+def get_scheduler():
+    """Process-wide scheduler shared by every session on this replica."""
+    return QuotaScheduler()
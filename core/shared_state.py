@@ -0,0 +1,197 @@
+import json
+import threading
+import time
+import streamlit as st
+from . import config
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class MemoryBackend:
+    """In-process stand-in for the shared backend, with the same API and semantics.
+
+    Values are stored serialized, exactly as they would be in Redis, so code that
+    works here does not depend on sharing live objects. Used when no
+    SHARED_STATE_URL is configured (single replica, local runs and tests).
+    """
+
+    shared = False
+
+    def __init__(self):
+        self._data = {}  # key -> (serialized value, monotonic expiry or None)
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        item = self._data.get(key)
+        if item is not None and item[1] is not None and item[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return item
+
+    def get(self, key):
+        with self._lock:
+            item = self._live(key)
+        return json.loads(item[0]) if item else None
+
+    def get_many(self, keys):
+        with self._lock:
+            items = [self._live(key) for key in keys]
+        return [json.loads(item[0]) if item else None for item in items]
+
+    def set(self, key, value, ttl=None):
+        data = _dumps(value)
+        with self._lock:
+            self._data[key] = (data, time.monotonic() + ttl if ttl else None)
+
+    def setdefault(self, key, value):
+        """Stores `value` unless the key exists. Returns the stored value."""
+        data = _dumps(value)
+        with self._lock:
+            item = self._live(key)
+            if item is None:
+                item = self._data[key] = (data, None)
+        return json.loads(item[0])
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            item = self._live(key)
+            value = (json.loads(item[0]) if item else 0) + 1
+            self._data[key] = (_dumps(value), item[1] if item else None)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "memory", "keys": len(self._data)}
+
+
+class RedisBackend:
+    """Shared state in Redis (or any Redis-compatible server such as Memorystore or Valkey).
+
+    Values are JSON and keys are namespaced with SHARED_STATE_PREFIX. A
+    failing server degrades to cache misses and skipped writes rather than
+    failed requests.
+    """
+
+    shared = True
+
+    def __init__(self, url, prefix=None):
+        import redis
+
+        self._errors = (redis.RedisError,)
+        self._redis = redis.Redis.from_url(url, socket_timeout=config.SHARED_STATE_TIMEOUT,
+                                           socket_connect_timeout=config.SHARED_STATE_TIMEOUT)
+        self.prefix = prefix if prefix is not None else config.SHARED_STATE_PREFIX
+        self.errors = 0
+
+    def _failed(self, operation, e):
+        self.errors += 1
+        print(f"Shared state {operation} failed: {e}")
+
+    def get(self, key):
+        try:
+            data = self._redis.get(self.prefix + key)
+        except self._errors as e:
+            self._failed("read", e)
+            return None
+        return json.loads(data) if data is not None else None
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        try:
+            values = self._redis.mget([self.prefix + key for key in keys])
+        except self._errors as e:
+            self._failed("read", e)
+            return [None] * len(keys)
+        return [json.loads(data) if data is not None else None for data in values]
+
+    def set(self, key, value, ttl=None):
+        try:
+            self._redis.set(self.prefix + key, _dumps(value), ex=int(ttl) if ttl else None)
+        except self._errors as e:
+            self._failed("write", e)
+
+    def setdefault(self, key, value):
+        """Stores `value` unless the key exists (SET NX). Returns the stored value."""
+        try:
+            self._redis.set(self.prefix + key, _dumps(value), nx=True)
+            data = self._redis.get(self.prefix + key)
+        except self._errors as e:
+            self._failed("write", e)
+            return value
+        return json.loads(data) if data is not None else value
+
+    def delete(self, *keys):
+        if not keys:
+            return
+        try:
+            self._redis.delete(*(self.prefix + key for key in keys))
+        except self._errors as e:
+            self._failed("delete", e)
+
+    def incr(self, key):
+        try:
+            return self._redis.incr(self.prefix + key)
+        except self._errors as e:
+            self._failed("write", e)
+            return None
+
+    def stats(self):
+        try:
+            keys = self._redis.dbsize()
+        except self._errors:
+            keys = None
+        return {"backend": "redis", "keys": keys, "errors": self.errors}
+
+
+@st.cache_resource
+def get_shared_state():
+    """Redis when SHARED_STATE_URL is set, so replicas share caches and state; otherwise in-process."""
+    if config.SHARED_STATE_URL:
+        try:
+            return RedisBackend(config.SHARED_STATE_URL)
+        except ImportError:
+            # redis is optional; without it every replica keeps its own state
+            print("SHARED_STATE_URL is set but the redis package is not installed; using in-process state")
+    return MemoryBackend()
+
+
+# -------------------------------
+# Corpus generations
+# -------------------------------
+# Every change to a corpus' files bumps its generation. Cached retrieval results
+# and answers record the generations they were built from, so a bump on any
+# replica invalidates them fleet-wide without having to find and delete them.
+def corpus_generations(corpus_names):
+    ids = [name.split("/")[-1] for name in corpus_names]
+    values = get_shared_state().get_many([f"corpus_gen:{cid}" for cid in ids])
+    return {cid: value or 0 for cid, value in zip(ids, values)}
+
+
+def bump_corpus_generation(corpus_name):
+    get_shared_state().incr(f"corpus_gen:{corpus_name.split('/')[-1]}")
+
+
+# -------------------------------
+# Conversations
+# -------------------------------
+# The chat transcript and model history of each user's open conversation, so a
+# browser session that reconnects to another replica (or after a restart)
+# picks up where it left off.
+def save_conversation(user_id, conversation):
+    get_shared_state().set(f"conversation:{user_id}", conversation, ttl=config.CONVERSATION_TTL)
+
+
+def load_conversation(user_id):
+    return get_shared_state().get(f"conversation:{user_id}")
+
+
+def clear_conversation(user_id):
+    get_shared_state().delete(f"conversation:{user_id}")
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import re
+import threading
+import streamlit as st
+
+
+def normalize_prompt(prompt):
+    """Case- and whitespace-insensitive form of a prompt, used for duplicate detection."""
+    return re.sub(r"\s+", " ", (prompt or "").strip()).casefold()
+
+
+def fingerprint(value):
+    """Short stable hash of any JSON-serialisable value (instructions, history...)."""
+    data = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()[:16]
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one upstream call.
+
+    The first caller for a key (the leader) runs the function; callers that
+    arrive while it is in flight block and receive the same result or exception.
+    Nothing is cached once the call completes.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, func):
+        """Returns `(result, shared)` where `shared` is True for coalesced callers."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "upstream_calls": self.leaders,
+                "calls_saved": self.coalesced,
+                "in_flight": len(self._calls),
+            }
+
+
+@st.cache_resource
+def get_singleflight():
+    return SingleFlight()
@@ -1,7 +1,10 @@
 import os
 import json
 from . import config
+from .shared_state import get_shared_state
+from .telemetry import traced
 
+@traced("storage.load_todos")
 def load_todos():
     if not os.path.exists(config.TODO_FILE):
         return {}
@@ -11,11 +14,24 @@ def load_todos():
     except:
         return {}
 
+@traced("storage.save_todos")
 def save_todos(todos):
     with open(config.TODO_FILE, "w") as f:
         json.dump(todos, f, indent=4)
 
+@traced("storage.load_rag_engines")
 def load_rag_engines():
+    # With a shared backend the engine list lives there, so every replica sees the same engines
+    shared = get_shared_state()
+    if shared.shared:
+        engines = shared.get("rag_engines")
+        if engines is None:
+            # First replica to start seeds the list from its file; never overwrite a newer one
+            engines = shared.setdefault("rag_engines", _load_rag_engines_file())
+        return engines
+    return _load_rag_engines_file()
+
+def _load_rag_engines_file():
     if not os.path.exists(config.RAG_ENGINES_FILE):
         # Return default if file missing
         return [{"name": "Default Shared Engine", "corpus_id": config.DEFAULT_RAG_CORPUS_ID, "owner": "system", "is_default": True}]
@@ -25,10 +41,40 @@ def load_rag_engines():
     except:
         return []
 
+@traced("storage.save_rag_engines")
 def save_rag_engines(engines):
+    shared = get_shared_state()
+    if shared.shared:
+        shared.set("rag_engines", engines)
     with open(config.RAG_ENGINES_FILE, "w") as f:
         json.dump(engines, f, indent=4)
 
+def get_retrieval_params(corpus_id, engines=None):
+    """Retrieval settings for an engine: its tuned values if any, else the defaults."""
+    params = {
+        "similarity_top_k": config.SIMILARITY_TOP_K,
+        "vector_distance_threshold": config.VECTOR_DISTANCE_THRESHOLD,
+    }
+    # Accept full resource names as well as bare corpus ids
+    corpus_id = corpus_id.split("/")[-1]
+    engines = engines if engines is not None else load_rag_engines()
+    engine = next((e for e in engines if e.get("corpus_id") == corpus_id), None)
+    if engine:
+        tuned = engine.get("retrieval") or {}
+        params.update({k: tuned[k] for k in params if k in tuned})
+    return params
+
+def save_retrieval_params(corpus_id, params):
+    """Stores tuned retrieval settings (plus any metrics) on the engine's entry."""
+    corpus_id = corpus_id.split("/")[-1]
+    engines = load_rag_engines()
+    for engine in engines:
+        if engine.get("corpus_id") == corpus_id:
+            engine["retrieval"] = params
+            save_rag_engines(engines)
+            return True
+    return False
+
 def load_system_instruction():
     library = load_instructions_library()
     return library.get("default")
@@ -38,6 +84,7 @@ def save_system_instruction(instruction):
     library["default"] = instruction
     save_instructions_library(library)
 
+@traced("storage.load_instructions_library")
 def load_instructions_library():
     if not os.path.exists(config.SYSTEM_INSTRUCTIONS_DB):
         initial_db = {"default": "You are a helpful assistant."}
@@ -49,6 +96,7 @@ def load_instructions_library():
     except:
         return {}
 
+@traced("storage.save_instructions_library")
 def save_instructions_library(library):
     with open(config.SYSTEM_INSTRUCTIONS_DB, "w", encoding="utf-8") as f:
         json.dump(library, f, indent=4)
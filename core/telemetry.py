@@ -0,0 +1,137 @@
+import bisect
+import contextlib
+import functools
+import sys
+import threading
+import time
+from . import config
+
+_tracer = None
+
+
+def _get_tracer():
+    """OpenTelemetry tracer, once the API has been loaded by configure_tracing() or by ADK.
+
+    Importing opentelemetry costs ~100ms, which page scripts that only touch
+    storage should not pay; without an exporter the tracer would be a no-op anyway.
+    """
+    global _tracer
+    if _tracer is None:
+        otel_trace = sys.modules.get("opentelemetry.trace")
+        if otel_trace is None:
+            return None
+        _tracer = otel_trace.get_tracer("mi_rag")
+    return _tracer
+
+
+class LatencyHistograms:
+    """Per-stage latency histograms and error counts, rendered in Prometheus text format."""
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(buckets or config.LATENCY_BUCKETS)
+        self._stages = {}  # stage -> {"counts": [...], "sum": float, "count": int, "errors": int}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, error=False):
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                entry = self._stages[stage] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0, "errors": 0}
+            index = bisect.bisect_left(self.buckets, seconds)
+            if index < len(self.buckets):
+                entry["counts"][index] += 1
+            entry["sum"] += seconds
+            entry["count"] += 1
+            if error:
+                entry["errors"] += 1
+
+    def render(self):
+        lines = [
+            "# HELP mi_rag_stage_duration_seconds Latency of instrumented stages.",
+            "# TYPE mi_rag_stage_duration_seconds histogram",
+        ]
+        errors = [
+            "# HELP mi_rag_stage_errors_total Stages that ended with an exception.",
+            "# TYPE mi_rag_stage_errors_total counter",
+        ]
+        with self._lock:
+            for stage, entry in sorted(self._stages.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, entry["counts"]):
+                    cumulative += count
+                    lines.append(f'mi_rag_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'mi_rag_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {entry["count"]}')
+                lines.append(f'mi_rag_stage_duration_seconds_sum{{stage="{stage}"}} {entry["sum"]:.6f}')
+                lines.append(f'mi_rag_stage_duration_seconds_count{{stage="{stage}"}} {entry["count"]}')
+                errors.append(f'mi_rag_stage_errors_total{{stage="{stage}"}} {entry["errors"]}')
+        return "\n".join(lines + errors) + "\n"
+
+
+# Module-level so the health server thread, the pages and core share one registry
+histograms = LatencyHistograms()
+
+
+@contextlib.contextmanager
+def span(stage, **attributes):
+    """Times a stage into the histograms and, when tracing is configured, opens an OpenTelemetry span.
+
+    Streamlit's st.stop()/st.rerun() control-flow exceptions are not counted as errors.
+    """
+    tracer = _get_tracer()
+    otel_span = tracer.start_as_current_span(stage, attributes=attributes or None) if tracer else contextlib.nullcontext()
+    started = time.perf_counter()
+    error = False
+    try:
+        with otel_span:
+            yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        histograms.observe(stage, time.perf_counter() - started, error)
+
+
+def traced(stage):
+    """Decorator form of `span`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render_metrics():
+    """Prometheus exposition of the stage histograms plus runtime gauges."""
+    lines = [histograms.render()]
+    # Only report components that are already loaded; scraping must not import the heavy stack
+    scheduler_module = sys.modules.get(f"{__package__}.scheduler")
+    if scheduler_module is not None:
+        lines.append("# TYPE mi_rag_scheduler_queue_length gauge")
+        lines.append(f"mi_rag_scheduler_queue_length {scheduler_module.get_scheduler().queue_length()}")
+    return "\n".join(lines) + "\n"
+
+
+def configure_tracing():
+    """Installs an OTLP/HTTP span exporter if OTEL_EXPORTER_OTLP_ENDPOINT is set.
+
+    Without an endpoint (or without the OpenTelemetry SDK) the API's default
+    no-op tracer stays in place. Returns True when an exporter was installed.
+    """
+    if not config.OTEL_EXPORTER_OTLP_ENDPOINT:
+        return False
+    try:
+        from opentelemetry import trace as otel_trace
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        print("OTEL_EXPORTER_OTLP_ENDPOINT is set but the OpenTelemetry SDK is not installed; tracing disabled.")
+        return False
+    provider = TracerProvider(resource=Resource.create({"service.name": config.OTEL_SERVICE_NAME}))
+    # The exporter reads OTEL_EXPORTER_OTLP_ENDPOINT itself
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    otel_trace.set_tracer_provider(provider)
+    return True
@@ -0,0 +1,118 @@
+import datetime
+import os
+import sqlite3
+import threading
+import time
+import streamlit as st
+from . import config
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    ts REAL NOT NULL,
+    day TEXT NOT NULL,
+    user_id TEXT,
+    engines TEXT,
+    model TEXT,
+    prompt_tokens INTEGER,
+    cached_tokens INTEGER,
+    candidate_tokens INTEGER,
+    thought_tokens INTEGER,
+    total_tokens INTEGER,
+    retrieval_ms INTEGER,
+    generation_ms INTEGER,
+    cost_usd REAL
+);
+CREATE INDEX IF NOT EXISTS turns_day ON turns (day);
+"""
+
+# Columns a rollup may group by, as shown in the Settings usage view
+GROUP_COLUMNS = ("user_id", "engines", "model")
+
+
+def turn_cost(model, prompt_tokens, cached_tokens, candidate_tokens, thought_tokens=0):
+    """Estimated USD cost of one call from its token counts and config.MODEL_PRICES."""
+    prices = config.MODEL_PRICES.get(model, config.MODEL_PRICES["default"])
+    uncached = max(0, (prompt_tokens or 0) - (cached_tokens or 0))
+    return (
+        uncached * prices["input"]
+        + (cached_tokens or 0) * prices["cached_input"]
+        + ((candidate_tokens or 0) + (thought_tokens or 0)) * prices["output"]
+    ) / 1_000_000
+
+
+class UsageStore:
+    """Token counts, timings and estimated cost of every answered turn, in SQLite.
+
+    One row per upstream call (coalesced duplicates are not counted twice).
+    Rows older than config.USAGE_RETENTION_DAYS are pruned once a day.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config.USAGE_DB
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        self._pruned_day = None
+
+    def record(self, user_id, corpus_names, model, usage_metadata, retrieval_s=0.0, generation_s=0.0):
+        prompt = cached = candidates = thoughts = total = 0
+        if usage_metadata is not None:
+            prompt = usage_metadata.prompt_token_count or 0
+            cached = usage_metadata.cached_content_token_count or 0
+            candidates = usage_metadata.candidates_token_count or 0
+            thoughts = usage_metadata.thoughts_token_count or 0
+            total = usage_metadata.total_token_count or 0
+        now = time.time()
+        day = datetime.date.fromtimestamp(now).isoformat()
+        engines = ",".join(name.split("/")[-1] for name in corpus_names or ())
+        row = (
+            now, day, user_id, engines, model, prompt, cached, candidates, thoughts, total,
+            int(retrieval_s * 1000), int(generation_s * 1000),
+            turn_cost(model, prompt, cached, candidates, thoughts),
+        )
+        try:
+            with self._lock, self._conn:
+                self._conn.execute("INSERT INTO turns VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+                if self._pruned_day != day:
+                    cutoff = now - config.USAGE_RETENTION_DAYS * 86400
+                    self._conn.execute("DELETE FROM turns WHERE ts < ?", (cutoff,))
+                    self._pruned_day = day
+        except sqlite3.Error as e:
+            # Accounting must never break a chat turn
+            print(f"Error recording usage: {e}")
+
+    def rollup(self, group_by=(), days=30, daily=True, user_id=None):
+        """Aggregates the last `days` days, optionally per day and per GROUP_COLUMNS, and for one user only."""
+        columns = [c for c in group_by if c in GROUP_COLUMNS]
+        if daily:
+            columns.insert(0, "day")
+        since = (datetime.date.today() - datetime.timedelta(days=days - 1)).isoformat()
+        select = ", ".join(columns + [
+            "COUNT(*) AS turns",
+            "SUM(prompt_tokens) AS prompt_tokens",
+            "SUM(cached_tokens) AS cached_tokens",
+            "SUM(candidate_tokens) AS candidate_tokens",
+            "SUM(thought_tokens) AS thought_tokens",
+            "SUM(total_tokens) AS total_tokens",
+            "ROUND(AVG(retrieval_ms)) AS avg_retrieval_ms",
+            "ROUND(AVG(generation_ms)) AS avg_generation_ms",
+            "ROUND(SUM(cost_usd), 4) AS cost_usd",
+        ])
+        query = f"SELECT {select} FROM turns WHERE day >= ?"
+        args = [since]
+        if user_id is not None:
+            query += " AND user_id = ?"
+            args.append(user_id)
+        if columns:
+            order = ["day DESC" if c == "day" else c for c in columns]
+            query += f" GROUP BY {', '.join(columns)} ORDER BY {', '.join(order)}"
+        with self._lock:
+            cursor = self._conn.execute(query, args)
+            names = [d[0] for d in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+
+@st.cache_resource
+def get_usage_store():
+    return UsageStore()
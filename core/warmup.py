@@ -0,0 +1,169 @@
+import importlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from . import config
+from . import telemetry
+
+# Modules the Chat and Settings pages need on their first run
+HEAVY_MODULES = [
+    "google.genai",
+    "google.cloud.aiplatform_v1",
+    "vertexai.preview.rag",
+    "google.adk.agents",
+    "google.adk.tools.retrieval.vertex_ai_rag_retrieval",
+    "core.auth",
+    "core.clients",
+    "core.rag",
+    "core.adk_agent",
+]
+
+_status = {
+    "ready": False,
+    "started_at": None,
+    "finished_at": None,
+    "steps": {},
+    "errors": {},
+}
+_status_lock = threading.Lock()
+
+
+def _record(step, started, error=None):
+    with _status_lock:
+        _status["steps"][step] = round(time.time() - started, 3)
+        if error:
+            _status["errors"][step] = str(error)
+
+
+def get_status():
+    with _status_lock:
+        return json.loads(json.dumps(_status))
+
+
+def is_ready():
+    with _status_lock:
+        return _status["ready"]
+
+
+def _import_modules():
+    for module_name in HEAVY_MODULES:
+        importlib.import_module(module_name)
+
+
+def _create_shared_resources():
+    from . import rag, adk_agent, storage
+
+    engines = storage.load_rag_engines()
+    default_engine = next((e for e in engines if e.get("is_default")), engines[0] if engines else None)
+    if not default_engine:
+        return
+    resource_name = f"projects/{config.PROJECT_ID}/locations/{config.LOCATION}/ragCorpora/{default_engine['corpus_id']}"
+    params = storage.get_retrieval_params(default_engine["corpus_id"], engines)
+    # Both are st.cache_resource entries; call them exactly as a chat session
+    # does so the first user session hits the same cache keys
+    rag.get_rag_tool(resource_name, **params)
+    adk_agent.get_adk_agent(config.DEFAULT_MODEL_ID, (resource_name,), storage.load_system_instruction(), **params)
+
+
+def _start_job_workers():
+    # Resume queued jobs and jobs whose worker died before this process restarted,
+    # without waiting for someone to open the Settings page
+    from .jobs import get_job_queue
+
+    get_job_queue()
+
+
+def _send_canary(model_name):
+    import google.auth
+    from google.genai import types
+    from .clients import VertexClients
+
+    # Warm-up runs before any user logs in, so use the service's own identity
+    credentials, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+    clients = VertexClients(credentials)
+    try:
+        clients.genai.models.generate_content(
+            model=model_name,
+            contents="ping",
+            config=types.GenerateContentConfig(max_output_tokens=1),
+        )
+    finally:
+        clients.close()
+
+
+def warm_up(canary_model=None):
+    """Runs every warm-up step and marks the process ready.
+
+    Individual step failures are recorded in the status but never keep the
+    replica from becoming ready; an unwarmed replica is still a working one.
+    """
+    canary_model = canary_model if canary_model is not None else config.WARMUP_CANARY_MODEL
+    with _status_lock:
+        _status["started_at"] = time.time()
+
+    steps = [
+        ("import_modules", _import_modules),
+        ("shared_resources", _create_shared_resources),
+        ("job_workers", _start_job_workers),
+    ]
+    if canary_model:
+        steps.append(("canary", lambda: _send_canary(canary_model)))
+
+    for step, func in steps:
+        started = time.time()
+        try:
+            func()
+            _record(step, started)
+        except Exception as e:
+            print(f"Warm-up step '{step}' failed: {e}")
+            _record(step, started, e)
+
+    mark_ready()
+    return get_status()
+
+
+def mark_ready():
+    with _status_lock:
+        _status["ready"] = True
+        _status["finished_at"] = time.time()
+
+
+class _HealthHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/live"):
+            self._send(200, {"live": True})
+        elif self.path.startswith("/ready"):
+            status = get_status()
+            self._send(200 if status["ready"] else 503, status)
+        elif self.path.startswith("/metrics"):
+            body = telemetry.render_metrics().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send(404, {"error": "not found"})
+
+    def _send(self, code, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Probes hit this every few seconds; keep them out of the logs
+        pass
+
+
+def start_health_server(port=None):
+    """Serves /live, /ready and /metrics on a background thread. Returns the server, or None if disabled."""
+    port = port if port is not None else config.HEALTH_PORT
+    if not port:
+        return None
+    server = ThreadingHTTPServer(("0.0.0.0", port), _HealthHandler)
+    threading.Thread(target=server.serve_forever, name="health-server", daemon=True).start()
+    return server
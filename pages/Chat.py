@@ -1,4 +1,5 @@
 import streamlit as st
+import concurrent.futures
 import sys
 import os
 
@@ -18,13 +19,8 @@ st.set_page_config(page_title="Chat", page_icon="💬", layout="wide")
 if utils.perform_auth():
     utils.show_sidebar_auth()
 
-    # Initialize Vertex AI with User Credentials
-    creds = st.session_state.credentials
-    
-    init_status = utils.init_vertex_ai(creds)
-    if init_status is not True:
-        st.error(f"Failed to initialize Vertex AI: {init_status}")
-        st.stop()
+    # Vertex AI clients bound to this user's credentials
+    clients = utils.get_clients(st.session_state.user_id, st.session_state.credentials)
     
     st.title("💬 MI RAG Chat")
 
@@ -43,41 +39,114 @@ if utils.perform_auth():
              st.stop()
 
     current_corpus_id = st.session_state.current_rag_corpus_id
-    current_rag_resource_name = f"projects/{utils.PROJECT_ID}/locations/{utils.LOCATION}/ragCorpora/{current_corpus_id}"
+
+    # Engines searched by this chat: the one selected in Settings plus any extras
+    engines = utils.load_rag_engines()
+    engine_names_by_id = {e["corpus_id"]: e["name"] for e in engines}
+    if st.session_state.get("chat_corpus_ids_base") != current_corpus_id:
+        st.session_state.chat_corpus_ids_base = current_corpus_id
+        st.session_state.chat_corpus_ids = [current_corpus_id]
+    selected_corpus_ids = st.sidebar.multiselect(
+        "Search Engines",
+        options=list(dict.fromkeys([current_corpus_id, *engine_names_by_id])),
+        default=st.session_state.chat_corpus_ids,
+        format_func=lambda cid: engine_names_by_id.get(cid, cid),
+        help="Selecting several engines retrieves from all of them in parallel and merges the results.",
+    )
+    if not selected_corpus_ids:
+        selected_corpus_ids = [current_corpus_id]
+    if selected_corpus_ids != st.session_state.chat_corpus_ids:
+        st.session_state.chat_corpus_ids = selected_corpus_ids
+        st.session_state.chat_session = None
+
+    current_rag_resource_names = [
+        f"projects/{utils.PROJECT_ID}/locations/{utils.LOCATION}/ragCorpora/{cid}"
+        for cid in selected_corpus_ids
+    ]
     
     # Ensure Model is selected
     if "current_model_id" not in st.session_state:
-        st.session_state.current_model_id = "gemini-2.5-flash"
+        st.session_state.current_model_id = utils.DEFAULT_MODEL_ID
     
     current_model_id = st.session_state.current_model_id
 
-    st.caption(f"Using **{current_model_id}** with Corpus `{current_corpus_id}`")
+    corpus_labels = ", ".join(f"`{cid}`" for cid in selected_corpus_ids)
+    st.caption(f"Using **{current_model_id}** with Corpus {corpus_labels}")
 
     # -------------------------------
     # Chat Logic
     # -------------------------------
     if "messages" not in st.session_state:
-        st.session_state.messages = []
+        # Resume the user's open conversation, which may have been held by another replica
+        saved = utils.load_conversation(st.session_state.user_id) or {}
+        st.session_state.messages = saved.get("messages", [])
+        st.session_state.restored_history = saved.get("history", [])
 
     if "chat_session" not in st.session_state or st.session_state.chat_session is None:
         # Load system instruction
         instruction = utils.load_system_instruction()
-        # Initialize ADK chat session
-        st.session_state.chat_session = utils.get_adk_session(current_model_id, current_rag_resource_name, instruction)
+        # Initialize ADK chat session (the first one in a process also imports the ADK stack)
+        with utils.span("page.chat.session_init"):
+            st.session_state.chat_session = utils.get_adk_session(
+                current_model_id,
+                current_rag_resource_names,
+                instruction,
+                clients,
+                hybrid=st.session_state.get("hybrid_retrieval"),
+                rerank=st.session_state.get("rerank_chunks"),
+                code_citations=st.session_state.get("code_citations"),
+            )
+        if st.session_state.get("restored_history"):
+            st.session_state.chat_session.history = st.session_state.pop("restored_history")
+        # Excerpts prefetched for suggested follow-ups belong to the session they were retrieved for
+        st.session_state.prefetch = utils.PrefetchCache()
+    else:
+        # The pool closes idle clients; always answer with the ones it holds now
+        st.session_state.chat_session.clients = clients
+
+    def ask_suggestion(suggestion):
+        st.session_state.pending_prompt = suggestion
+
+    def show_suggestions(message):
+        if message.get("suggestions_pending"):
+            show_pending_suggestions(message)
+        for i, suggestion in enumerate(message.get("suggestions", [])):
+            st.button(suggestion, key=f"suggestion_{i}", on_click=ask_suggestion, args=(suggestion,))
+
+    # Suggestions are written in the background; poll for them without blocking the answer
+    @st.fragment(run_every=1)
+    def show_pending_suggestions(message):
+        suggestions = st.session_state.prefetch.suggestions()
+        if suggestions is None:
+            return
+        message.pop("suggestions_pending", None)
+        message["suggestions"] = suggestions
+        utils.save_conversation(st.session_state.user_id, {
+            "messages": st.session_state.messages,
+            "history": st.session_state.chat_session.history,
+        })
+        st.rerun(scope="app")
+
+    # A clicked suggestion is asked like a typed question
+    prompt = st.chat_input("Ask a question about your documents...") or st.session_state.pop("pending_prompt", None)
 
     # Display chat messages
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
-            # Display sources if available
-            if "sources" in message:
-                with st.expander("Sources"):
-                    for source in message["sources"]:
-                        st.markdown(f"**URI:** `{source['uri']}`")
-                        st.text(source['text'])
+    with utils.span("page.chat.render_history", messages=len(st.session_state.messages)):
+        for index, message in enumerate(st.session_state.messages):
+            with st.chat_message(message["role"]):
+                st.markdown(message["content"])
+                # Display sources if available
+                if "sources" in message:
+                    with st.expander("Sources"):
+                        for source in message["sources"]:
+                            st.markdown(f"**URI:** `{source['uri']}`")
+                            st.text(source['text'])
+                # Suggestions only make sense under the latest answer
+                if index == len(st.session_state.messages) - 1 and not prompt:
+                    show_suggestions(message)
 
     # User Input
-    if prompt := st.chat_input("Ask a question about your documents..."):
+    if prompt:
         # Add user message to state
         st.session_state.messages.append({"role": "user", "content": prompt})
         # Display user message immediately
@@ -88,27 +157,59 @@ if utils.perform_auth():
         with st.chat_message("assistant"):
             with st.spinner("Thinking..."):
                 try:
-                    # Send message to ADK Agent Session
-                    response = st.session_state.chat_session.send_message(prompt)
+                    # Send message to ADK Agent Session on a worker thread so we can
+                    # show the user's place in the shared quota queue meanwhile
+                    scheduler = utils.get_scheduler()
+                    queue_status = st.empty()
+                    # Holding the clients keeps the pool from closing them while the turn runs
+                    with clients.in_use(), concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+                        # Excerpts already retrieved if this is a suggested follow-up
+                        chunks = st.session_state.prefetch.take(prompt)
+                        future = executor.submit(st.session_state.chat_session.send_message, prompt, chunks=chunks)
+                        while True:
+                            try:
+                                response = future.result(timeout=0.5)
+                                break
+                            except concurrent.futures.TimeoutError:
+                                position = scheduler.position(st.session_state.user_id)
+                                if position:
+                                    queue_status.caption(f"⏳ Waiting for quota: {position} request(s) ahead of you")
+                                else:
+                                    queue_status.empty()
+                    queue_status.empty()
                     
                     text_response = response.text
                     
                     # Extract sources (using ADK wrapper's pre-processed sources)
                     sources = getattr(response, 'sources', [])
                     
-                    st.markdown(text_response)
-                    
-                    if sources:
-                        with st.expander("Sources"):
-                            for source in sources:
-                                st.markdown(f"**URI:** `{source['uri']}`")
-                                st.text(source['text'])
+                    with utils.span("page.chat.render_answer"):
+                        st.markdown(text_response)
+                        
+                        if sources:
+                            with st.expander("Sources"):
+                                for source in sources:
+                                    st.markdown(f"**URI:** `{source['uri']}`")
+                                    st.text(source['text'])
                     
                     # Save assistant response to state
-                    st.session_state.messages.append({
-                        "role": "assistant", 
+                    message = {
+                        "role": "assistant",
                         "content": text_response,
                         "sources": sources
+                    }
+                    st.session_state.messages.append(message)
+
+                    # Offer likely next questions and start retrieving for them while the user reads
+                    if sources and st.session_state.get("followup_suggestions", utils.FOLLOWUP_SUGGESTIONS):
+                        st.session_state.prefetch.suggest(
+                            clients, st.session_state.chat_session, prompt, text_response
+                        )
+                        message["suggestions_pending"] = True
+                        show_suggestions(message)
+                    utils.save_conversation(st.session_state.user_id, {
+                        "messages": st.session_state.messages,
+                        "history": st.session_state.chat_session.history,
                     })
                     
                 except Exception as e:
@@ -118,6 +219,7 @@ if utils.perform_auth():
     if st.sidebar.button("Clear Chat", type="primary"):
         st.session_state.messages = []
         st.session_state.chat_session = None
+        utils.clear_conversation(st.session_state.user_id)
         st.rerun()
 
 else:
@@ -1,9 +1,6 @@
 import streamlit as st
-import vertexai
-from vertexai.preview import rag
 import os
 import sys
-import tempfile
 
 # Add parent directory to path to allow importing core
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -24,12 +21,10 @@ if not utils.perform_auth():
 
 utils.show_sidebar_auth()
 
-# Initialize Vertex AI
-if "credentials" in st.session_state:
-    init_status = utils.init_vertex_ai(st.session_state.credentials)
-    if init_status is not True:
-        st.error(f"Failed to initialize Vertex AI: {init_status}")
-        st.stop()
+# Vertex AI clients bound to this user's credentials
+clients = utils.get_clients(st.session_state.user_id, st.session_state.credentials)
+# Uploads and engine/file deletions run here, off the script run (see core/jobs.py)
+job_queue = utils.get_job_queue()
 
 st.title("⚙️ Settings")
 
@@ -48,7 +43,8 @@ with col_left:
 
     # Sync with remote engines
     try:
-        remote_corpora = utils.list_corpora()
+        with utils.span("page.settings.list_corpora"):
+            remote_corpora = utils.list_corpora(clients)
         if remote_corpora:
             remote_map = {c.name.split('/')[-1]: c for c in remote_corpora}
             existing_ids = {e["corpus_id"] for e in rag_engines}
@@ -122,23 +118,20 @@ with col_left:
     if not selected_engine.get("is_default", False):
         if st.button("Delete This Engine", type="primary"):
             try:
-                # Attempt to delete from Vertex AI first
-                try:
-                    rag.delete_corpus(name=current_rag_resource_name)
-                    st.toast(f"Deleted corpus resource: {selected_engine_name}")
-                except Exception as cloud_err:
-                    st.warning(f"Cloud resource deletion failed (might contain files): {cloud_err}")
-                
-                # Remove from config
-                new_engines = [e for e in rag_engines if e["name"] != selected_engine_name]
-                utils.save_rag_engines(new_engines)
+                # Runs in the background job queue (Vertex deletion, local index, config)
+                job_queue.submit(
+                    "delete_engine",
+                    {"corpus_name": current_rag_resource_name, "engine_name": selected_engine_name},
+                    owner=st.session_state.user_id,
+                )
                 
                 # Reset selection
                 st.session_state.selected_engine_index = 0
-                if new_engines:
-                    st.session_state.current_rag_corpus_id = new_engines[0]["corpus_id"]
+                remaining = [e for e in rag_engines if e["name"] != selected_engine_name]
+                if remaining:
+                    st.session_state.current_rag_corpus_id = remaining[0]["corpus_id"]
                 
-                st.success(f"Deleted engine: {selected_engine_name}")
+                st.toast(f"Deleting engine {selected_engine_name} in the background")
                 st.rerun()
             except Exception as e:
                 st.error(f"Error deleting engine: {e}")
@@ -149,22 +142,9 @@ with col_left:
         if st.button("Create Engine"):
             if new_engine_name and new_engine_name not in engine_names:
                 try:
-                    with st.spinner("Creating new RAG Corpus..."):
-                        # Create Corpus
-                        corpus = rag.create_corpus(display_name=new_engine_name)
-                        new_corpus_id = corpus.name.split("/")[-1]
-                        
-                        new_engine = {
-                            "name": new_engine_name,
-                            "corpus_id": new_corpus_id,
-                            "owner": "user", 
-                            "is_default": False
-                        }
-                        rag_engines.append(new_engine)
-                        utils.save_rag_engines(rag_engines)
-                        st.success(f"Created engine: {new_engine_name}")
-                        st.session_state.selected_engine_index = len(rag_engines) - 1
-                        st.rerun()
+                    job_queue.submit("create_engine", {"display_name": new_engine_name}, owner=st.session_state.user_id)
+                    st.toast(f"Creating engine {new_engine_name} in the background")
+                    st.rerun()
                 except Exception as e:
                     st.error(f"Failed to create corpus: {e}")
             elif new_engine_name in engine_names:
@@ -182,33 +162,53 @@ with col_left:
 
     if uploaded_file:
         if st.button("Process & Upload"):
-            with st.status("Uploading document...") as status:
+            try:
+                # Keep the file until the background upload job has finished with it
+                staged_path = utils.jobs.stage_upload(uploaded_file.getvalue(), uploaded_file.name)
+                job_queue.submit(
+                    "upload_file",
+                    {
+                        "corpus_name": current_rag_resource_name,
+                        "path": staged_path,
+                        "display_name": uploaded_file.name,
+                        "hybrid": st.session_state.get("hybrid_retrieval", utils.HYBRID_RETRIEVAL),
+                    },
+                    owner=st.session_state.user_id,
+                )
+                st.toast(f"Uploading {uploaded_file.name} in the background")
+            except Exception as e:
+                st.error(f"Error: {e}")
+
+    # Bulk import: one server-side import through the staging bucket instead of one upload per file
+    if utils.config.STAGING_BUCKET:
+        with st.expander("Bulk Import"):
+            bulk_files = st.file_uploader(
+                "Documents", type=["txt", "pdf", "docx", "html"], accept_multiple_files=True, key="bulk_files"
+            )
+            col_size, col_overlap, col_rpm = st.columns(3)
+            chunk_size = col_size.number_input("Chunk size (tokens)", 64, 4096, utils.config.IMPORT_CHUNK_SIZE, step=64)
+            chunk_overlap = col_overlap.number_input("Chunk overlap", 0, 1024, utils.config.IMPORT_CHUNK_OVERLAP, step=10)
+            rpm = col_rpm.number_input(
+                "Embedding requests/min", 1, 10000, utils.config.IMPORT_MAX_EMBEDDING_RPM,
+                help="Caps the embedding model quota this import may use.",
+            )
+            if bulk_files and st.button(f"Import {len(bulk_files)} files"):
                 try:
-                    # Save to temp file
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{uploaded_file.name.split('.')[-1]}") as tmp:
-                        tmp.write(uploaded_file.getvalue())
-                        tmp_path = tmp.name
-                    
-                    status.write("Sending to Vertex AI...")
-                    
-                    # Upload to RAG Corpus
-                    rag_file = rag.upload_file(
-                        corpus_name=current_rag_resource_name,
-                        path=tmp_path,
-                        display_name=uploaded_file.name
+                    job_queue.submit(
+                        "bulk_import",
+                        {
+                            "corpus_name": current_rag_resource_name,
+                            "paths": [utils.jobs.stage_upload(f.getvalue(), f.name) for f in bulk_files],
+                            "display_names": [f.name for f in bulk_files],
+                            "hybrid": st.session_state.get("hybrid_retrieval", utils.HYBRID_RETRIEVAL),
+                            "chunk_size": int(chunk_size),
+                            "chunk_overlap": int(chunk_overlap),
+                            "max_embedding_requests_per_min": int(rpm),
+                        },
+                        owner=st.session_state.user_id,
                     )
-                    
-                    # Clean up
-                    os.remove(tmp_path)
-                    
-                    status.update(label="Upload Complete!", state="complete", expanded=False)
-                    st.success(f"Uploaded: {uploaded_file.name}")
-                    # Refresh list
-                    st.session_state.file_list = [] 
-                    st.rerun() 
-                    
+                    st.toast(f"Importing {len(bulk_files)} files in the background")
                 except Exception as e:
-                    status.update(label="Upload Failed", state="error")
                     st.error(f"Error: {e}")
 
     # List Documents
@@ -217,7 +217,8 @@ with col_left:
 
     def refresh_file_list():
         try:
-            files = list(rag.list_files(corpus_name=current_rag_resource_name))
+            with utils.span("page.settings.list_files"):
+                files = clients.list_files(current_rag_resource_name)
             st.session_state.file_list = files
         except Exception as e:
             st.error(f"Could not list files: {e}")
@@ -239,13 +240,68 @@ with col_left:
                 c1.text(f.display_name)
                 if c2.button("🗑️", key=f.name, help=f"Delete {f.display_name}"):
                     try:
-                        rag.delete_file(name=f.name)
-                        st.toast(f"Deleted {f.display_name}")
-                        refresh_file_list()
-                        st.rerun()
+                        job_queue.submit(
+                            "delete_file",
+                            {"corpus_name": current_rag_resource_name, "file_name": f.name, "display_name": f.display_name},
+                            owner=st.session_state.user_id,
+                        )
+                        st.toast(f"Deleting {f.display_name} in the background")
                     except Exception as e:
                         st.error(f"Failed to delete: {e}")
 
+    # -------------------------------
+    # Background Jobs
+    # -------------------------------
+    JOB_LABELS = {
+        "upload_file": "Upload",
+        "bulk_import": "Bulk import",
+        "delete_file": "Delete file",
+        "create_engine": "Create engine",
+        "delete_engine": "Delete engine",
+    }
+    JOB_ICONS = {"queued": "⏳", "running": "🔄", "succeeded": "✅", "failed": "❌"}
+
+    # Poll only while something is pending; submitting a job reruns the page anyway
+    @st.fragment(run_every=2 if job_queue.pending(st.session_state.user_id) else None)
+    def show_jobs():
+        user_jobs = job_queue.list(owner=st.session_state.user_id, limit=10)
+        if not user_jobs:
+            return
+        st.subheader("Background Jobs")
+        for job in user_jobs:
+            payload = job["payload"]
+            target = payload.get("display_name") or payload.get("engine_name") or payload.get("file_name", "")
+            if "paths" in payload:
+                target = f"{len(payload['paths'])} files"
+            st.write(f"{JOB_ICONS.get(job['status'], '')} **{JOB_LABELS.get(job['kind'], job['kind'])}** {target}")
+            if job["status"] in ("queued", "running"):
+                st.progress(job["progress"], text=job["message"] or job["status"].capitalize())
+            elif job["status"] == "failed":
+                st.caption(f"Failed after {job['attempts']} attempt(s): {job['error']}")
+                if st.button("Retry", key=f"retry_job_{job['id']}"):
+                    job_queue.retry(job["id"])
+                    st.rerun(scope="app")
+            elif job["result"] and job["result"].get("warning"):
+                st.caption(job["result"]["warning"])
+            elif job["kind"] == "bulk_import" and job["result"]:
+                report = job["result"]
+                st.caption(
+                    f"{report['imported']} imported, {report['skipped']} skipped, {report['failed']} failed "
+                    f"({report['files_per_min']} files/min, {report['mb_per_min']} MB/min)"
+                )
+                for failure in report["failures"][:5]:
+                    st.caption(f"⚠️ {failure}")
+
+        # Reload engines and files on the whole page once a job finishes
+        finished = {job["id"] for job in user_jobs if job["status"] in ("succeeded", "failed")}
+        seen = st.session_state.get("finished_job_ids")
+        st.session_state.finished_job_ids = finished
+        if seen is not None and finished - seen:
+            st.session_state.file_list = []
+            st.rerun(scope="app")
+
+    show_jobs()
+
 with col_right:
     # -------------------------------
     # Model Selection (Moved from Left)
@@ -260,7 +316,7 @@ with col_right:
     }
     
     # Determine index for default
-    current_model = st.session_state.get("current_model_id", "gemini-2.5-flash")
+    current_model = st.session_state.get("current_model_id", utils.DEFAULT_MODEL_ID)
     # Reverse lookup for UI
     reverse_map = {v: k for k, v in available_models_map.items()}
     default_label = reverse_map.get(current_model, "Custom")
@@ -283,6 +339,47 @@ with col_right:
     
     st.info(f"Current Model: `{st.session_state.current_model_id}`")
 
+    # Retrieval options
+    hybrid = st.checkbox(
+        "Hybrid retrieval (local keyword index + Vertex)",
+        value=st.session_state.get("hybrid_retrieval", utils.HYBRID_RETRIEVAL),
+        help="Indexes uploaded documents locally and fuses exact keyword matches "
+             "(identifiers, part numbers, acronyms) with vector search results.",
+    )
+    if hybrid != st.session_state.get("hybrid_retrieval", utils.HYBRID_RETRIEVAL):
+        st.session_state.hybrid_retrieval = hybrid
+        st.session_state.chat_session = None
+
+    rerank = st.checkbox(
+        "Rerank retrieved chunks",
+        value=st.session_state.get("rerank_chunks", utils.RERANK_ENABLED),
+        help=f"Scores the retrieved chunks locally and sends only the best {utils.RERANK_TOP_K} "
+             f"(up to ~{utils.RERANK_TOKEN_BUDGET} tokens) to the model.",
+    )
+    if rerank != st.session_state.get("rerank_chunks", utils.RERANK_ENABLED):
+        st.session_state.rerank_chunks = rerank
+        st.session_state.chat_session = None
+
+    code_citations = st.checkbox(
+        "Build citations from grounding metadata",
+        value=st.session_state.get("code_citations", utils.CODE_CITATIONS),
+        help="Drops the citation-formatting rules from the system instruction and appends "
+             "a per-file reference list to grounded answers, saving input and output tokens.",
+    )
+    if code_citations != st.session_state.get("code_citations", utils.CODE_CITATIONS):
+        st.session_state.code_citations = code_citations
+        st.session_state.chat_session = None
+    st.session_state.followup_suggestions = st.checkbox(
+        "Suggest follow-up questions",
+        value=st.session_state.get("followup_suggestions", utils.FOLLOWUP_SUGGESTIONS),
+        help=f"Offers likely next questions under grounded answers (written by {utils.FOLLOWUP_MODEL}) "
+             "and retrieves their excerpts in the background, so a clicked suggestion is answered sooner.",
+    )
+    if hybrid:
+        indexed_docs = len(utils.get_lexical_index(current_rag_resource_name))
+        st.caption(f"Local keyword index: {indexed_docs} document(s) in this engine. "
+                   "Only documents uploaded with hybrid retrieval on are indexed.")
+
     st.divider()
 
     # -------------------------------
@@ -370,3 +467,66 @@ with col_right:
                     st.rerun()
             else:
                 st.error("Name and content required")
+
+# -------------------------------
+# Runtime Metrics
+# -------------------------------
+with st.expander("Runtime Metrics"):
+    flights = utils.get_singleflight().stats()
+    m1, m2, m3 = st.columns(3)
+    m1.metric("Upstream chat calls", flights["upstream_calls"])
+    m2.metric("Calls saved by coalescing", flights["calls_saved"])
+    m3.metric("In flight", flights["in_flight"])
+    st.caption("Quota scheduler")
+    st.json(utils.get_scheduler().stats())
+    st.caption("Hedging & circuit breakers")
+    st.json(utils.get_hedged_executor().stats())
+    st.caption("Context caching")
+    st.json(utils.get_context_cache().stats())
+    st.caption("Answer store")
+    st.json(utils.get_answer_store().stats())
+    st.caption("Shared state")
+    st.json(utils.get_shared_state().stats())
+    if st.session_state.get("prefetch"):
+        st.caption("Follow-up prefetch (this session)")
+        st.json(st.session_state.prefetch.stats())
+
+# -------------------------------
+# Usage
+# -------------------------------
+with st.expander("Usage"):
+    # Everyone sees their own usage; only the admins listed in USAGE_ADMINS may see other users'
+    usage_all_users = st.session_state.user_id in utils.USAGE_ADMINS and st.checkbox("All users", value=False)
+    usage_user = None if usage_all_users else st.session_state.user_id
+    u1, u2, u3 = st.columns([2, 1, 1])
+    group_labels = {"user_id": "User", "engines": "Engine", "model": "Model"}
+    if not usage_all_users:
+        del group_labels["user_id"]
+    usage_group_by = u1.multiselect(
+        "Group by",
+        options=list(group_labels),
+        default=["user_id"] if usage_all_users else ["engines"],
+        format_func=group_labels.get,
+    )
+    usage_days = u2.number_input("Days", min_value=1, max_value=utils.USAGE_RETENTION_DAYS, value=7)
+    usage_daily = u3.checkbox("Daily rollup", value=True)
+
+    usage_store = utils.get_usage_store()
+    totals = usage_store.rollup(days=usage_days, daily=False, user_id=usage_user)[0]
+    t1, t2, t3, t4 = st.columns(4)
+    t1.metric("Turns", totals["turns"])
+    t2.metric("Total tokens", f"{totals['total_tokens'] or 0:,}")
+    t3.metric("Cached tokens", f"{totals['cached_tokens'] or 0:,}")
+    t4.metric("Estimated cost", f"${totals['cost_usd'] or 0:.2f}")
+
+    usage_rows = usage_store.rollup(group_by=usage_group_by, days=usage_days, daily=usage_daily, user_id=usage_user)
+    # Show engine names rather than corpus ids
+    engine_names = {e["corpus_id"]: e["name"] for e in utils.load_rag_engines()}
+    for row in usage_rows:
+        if "engines" in row:
+            row["engines"] = ", ".join(engine_names.get(cid, cid) for cid in (row["engines"] or "").split(",") if cid)
+    if usage_rows:
+        st.dataframe(usage_rows, use_container_width=True, hide_index=True)
+    else:
+        st.info("No usage recorded in this period.")
+    st.caption("Costs are estimates from list prices in config.MODEL_PRICES.")
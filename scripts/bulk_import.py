@@ -0,0 +1,119 @@
+"""Imports a batch of local documents into one RAG engine through a GCS staging bucket.
+
+Files are uploaded to the staging bucket in parallel, then imported with a
+single import operation (instead of one upload call per file), which lets
+Vertex embed them in bulk within the --rpm embedding quota. Prints the
+import counts, throughput and any per-file failures Vertex reports.
+
+Usage:
+    python scripts/bulk_import.py --engine "Default Shared Engine" --bucket my-staging-bucket docs/ extra.pdf
+
+--stage-only uploads to the bucket and stops, which also works against a
+local GCS emulator (STORAGE_EMULATOR_HOST); the import itself needs real GCS.
+Authenticates with Application Default Credentials (gcloud auth application-default login).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+
+# Add parent directory to path to allow importing core
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import google.auth
+import core.config as config
+import core.storage as storage
+from core.bulk_import import _unique_names, bulk_import, stage_files
+from core.clients import VertexClients
+
+EXTENSIONS = (".txt", ".pdf", ".docx", ".html", ".htm", ".md")
+
+
+def find_engine(name_or_id):
+    for engine in storage.load_rag_engines():
+        if name_or_id in (engine["name"], engine["corpus_id"]):
+            return engine
+    return None
+
+
+def collect_paths(inputs):
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                paths += [os.path.join(root, f) for f in sorted(files) if f.lower().endswith(EXTENSIONS)]
+        else:
+            paths.append(item)
+    return paths
+
+
+def show_progress(fraction, message=None):
+    print(f"\r[{fraction:6.1%}] {message or ''}".ljust(60), end="", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="Files or directories to import")
+    parser.add_argument("--engine", required=True, help="Engine name or corpus id from rag_engines.json")
+    parser.add_argument("--bucket", default=config.STAGING_BUCKET, help="Staging bucket (default: STAGING_BUCKET)")
+    parser.add_argument("--chunk-size", type=int, default=config.IMPORT_CHUNK_SIZE)
+    parser.add_argument("--chunk-overlap", type=int, default=config.IMPORT_CHUNK_OVERLAP)
+    parser.add_argument("--rpm", type=int, default=config.IMPORT_MAX_EMBEDDING_RPM, help="Max embedding requests per minute")
+    parser.add_argument("--hybrid", action="store_true", help="Also add the files to the local keyword index")
+    parser.add_argument("--keep-staged", action="store_true", help="Leave the staged copies in the bucket")
+    parser.add_argument("--stage-only", action="store_true", help="Upload to the bucket without importing")
+    parser.add_argument("--report", help="Write the import report to this JSON file")
+    args = parser.parse_args()
+
+    if not args.bucket:
+        sys.exit("No staging bucket: pass --bucket or set STAGING_BUCKET")
+    engine = find_engine(args.engine)
+    if engine is None:
+        sys.exit(f"Unknown engine: {args.engine}")
+    paths = collect_paths(args.paths)
+    if not paths:
+        sys.exit("No documents found")
+
+    credentials, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+    clients = VertexClients(credentials, principal="bulk_import")
+    corpus_name = clients.corpus_resource_name(engine["corpus_id"])
+    print(f"{len(paths)} files ({sum(os.path.getsize(p) for p in paths) / 1e6:.1f} MB) -> '{engine['name']}'")
+
+    if args.stage_only:
+        prefix = f"{config.STAGING_PREFIX}/{engine['corpus_id']}/{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}/files"
+        started = time.monotonic()
+        uris = stage_files(clients, args.bucket, prefix, paths, _unique_names(paths), progress=show_progress)
+        print(f"\nStaged {len(uris)} files in {time.monotonic() - started:.1f}s under gs://{args.bucket}/{prefix}/")
+        clients.close()
+        return
+
+    report = bulk_import(
+        clients,
+        corpus_name,
+        paths,
+        bucket=args.bucket,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        max_embedding_requests_per_min=args.rpm,
+        hybrid=args.hybrid,
+        keep_staged=args.keep_staged,
+        progress=show_progress,
+    )
+    clients.close()
+
+    print(f"\nImported {report['imported']}, skipped {report['skipped']}, failed {report['failed']}")
+    print(f"Staging {report['staging_s']}s, import {report['import_s']}s: "
+          f"{report['files_per_min']} files/min, {report['mb_per_min']} MB/min")
+    for failure in report["failures"]:
+        print(f"  FAILED: {json.dumps(failure)}")
+    if report["failures_uri"]:
+        print(f"Failure details: {report['failures_uri']}")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Reports the import cost of the core package using `python -X importtime`.
+
+Usage:
+    python scripts/import_time.py                    # default targets
+    python scripts/import_time.py core core.rag --top 20
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# What each page pulls in at load time
+DEFAULT_TARGETS = [
+    "core",
+    "core.auth",
+    "core.storage",
+    "core.rag",
+    "core.adk_agent",
+]
+
+
+def measure(target):
+    """Imports `target` in a fresh interpreter and returns parsed importtime rows."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        try:
+            self_us = int(parts[0].strip())
+            cumulative_us = int(parts[1].strip())
+        except ValueError:
+            # Header row
+            continue
+        name = parts[2].rstrip()
+        # Top-level imports are indented by one space, each nesting level adds two
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), self_us, cumulative_us, depth))
+    return result.returncode, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("targets", nargs="*", default=DEFAULT_TARGETS, help="Modules to import")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to list per target")
+    args = parser.parse_args()
+
+    print(f"{'target':<24} {'total (ms)':>12} {'modules':>8}")
+    print("-" * 46)
+    reports = []
+    for target in args.targets:
+        returncode, rows = measure(target)
+        if returncode != 0 or not rows:
+            print(f"{target:<24} {'failed':>12}")
+            continue
+        # Top-level rows cover everything, including interpreter startup
+        total_ms = sum(r[2] for r in rows if r[3] == 0) / 1000
+        print(f"{target:<24} {total_ms:>12.1f} {len(rows):>8}")
+        reports.append((target, rows))
+
+    for target, rows in reports:
+        print(f"\nSlowest imports for {target} (cumulative):")
+        # Only the two outermost levels; deeper rows are already included in their parents
+        outer = [r for r in rows if r[3] <= 1 and r[0] != target]
+        outer.sort(key=lambda r: r[2], reverse=True)
+        for name, _, cumulative_us, _ in outer[:args.top]:
+            print(f"  {cumulative_us / 1000:>10.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""Summarizes the structured query log (data/query_log) for capacity and caching decisions.
+
+Reports top questions, latency percentiles per stage, repeats that a
+read-through answer cache could have served, and load per engine and model.
+
+Usage:
+    python scripts/query_log_report.py [--days 7] [--top 20] [--window 24] [--json]
+"""
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+
+# Add parent directory to path to allow importing core
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import core.config as config
+from core.query_log import read_entries
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def cache_key(entry):
+    """Turns with the same key get the same answer: a fresh conversation, same question and setup."""
+    return (tuple(entry.get("engines") or ()), entry.get("model"), entry.get("normalized"))
+
+
+def analyze(entries, top=20, window_hours=24):
+    entries = sorted(entries, key=lambda e: e.get("ts", 0))
+    answered = [e for e in entries if not e.get("error")]
+
+    # Top questions
+    questions = collections.Counter(e.get("normalized") for e in answered)
+
+    # Latency percentiles by stage
+    stage_values = collections.defaultdict(list)
+    for entry in answered:
+        for stage, seconds in (entry.get("stages") or {}).items():
+            if seconds:
+                stage_values[stage].append(seconds)
+    latency = {
+        stage: {
+            "count": len(values),
+            "p50": percentile(values, 0.5),
+            "p90": percentile(values, 0.9),
+            "p99": percentile(values, 0.99),
+        }
+        for stage, values in sorted(stage_values.items())
+    }
+
+    # Cache-eligible repeats: first-turn questions already answered for the same
+    # engines and model within the window (coalesced duplicates already shared a call)
+    last_seen = {}
+    repeats = collections.Counter()
+    eligible = 0
+    first_turns = 0
+    for entry in answered:
+        if entry.get("history_turns"):
+            continue
+        first_turns += 1
+        key = cache_key(entry)
+        previous = last_seen.get(key)
+        if previous is not None and entry["ts"] - previous <= window_hours * 3600 and not entry.get("shared"):
+            eligible += 1
+            repeats[key] += 1
+        last_seen[key] = entry["ts"]
+
+    # Load per engine and model
+    def load_by(key_func):
+        groups = collections.defaultdict(list)
+        for entry in entries:
+            for key in key_func(entry):
+                groups[key].append(entry)
+        report = {}
+        for key, group in sorted(groups.items(), key=lambda item: -len(item[1])):
+            hours = collections.Counter(int(e["ts"] // 3600) for e in group)
+            totals = [(e.get("stages") or {}).get("total_s") for e in group]
+            report[key] = {
+                "turns": len(group),
+                "errors": sum(1 for e in group if e.get("error")),
+                "users": len({e.get("user") for e in group}),
+                "peak_per_hour": max(hours.values()),
+                "tokens": sum(((e.get("tokens") or {}).get("total") or 0) for e in group),
+                "p90_total_s": percentile([t for t in totals if t], 0.9),
+            }
+        return report
+
+    return {
+        "turns": len(entries),
+        "errors": len(entries) - len(answered),
+        "coalesced": sum(1 for e in answered if e.get("shared")),
+        "top_queries": questions.most_common(top),
+        "latency": latency,
+        "cache": {
+            "hits": sum(1 for e in answered if e.get("cache_hit")),
+            "first_turns": first_turns,
+            "eligible_repeats": eligible,
+            "eligible_share": eligible / first_turns if first_turns else 0.0,
+            "top_repeated": [
+                {"engines": list(k[0]), "model": k[1], "query": k[2], "repeats": n}
+                for k, n in repeats.most_common(top)
+            ],
+        },
+        "engines": load_by(lambda e: e.get("engines") or ["(none)"]),
+        "models": load_by(lambda e: [e.get("model") or "(unknown)"]),
+    }
+
+
+def _fmt(seconds):
+    return f"{seconds:.2f}s" if seconds is not None else "-"
+
+
+def print_report(report, days):
+    print(f"Query log, last {days} day(s): {report['turns']} turns, "
+          f"{report['errors']} errors, {report['coalesced']} coalesced")
+
+    print("\nTop queries")
+    for query, count in report["top_queries"]:
+        print(f"  {count:>6}  {query[:100]}")
+
+    print("\nLatency by stage")
+    print(f"  {'stage':<16} {'count':>7} {'p50':>8} {'p90':>8} {'p99':>8}")
+    for stage, row in report["latency"].items():
+        print(f"  {stage:<16} {row['count']:>7} {_fmt(row['p50']):>8} {_fmt(row['p90']):>8} {_fmt(row['p99']):>8}")
+
+    cache = report["cache"]
+    print(f"\nCache-eligible repeats: {cache['eligible_repeats']} of {cache['first_turns']} "
+          f"first-turn questions ({cache['eligible_share']:.1%}); {cache['hits']} served from the answer store")
+    for row in cache["top_repeated"]:
+        print(f"  {row['repeats']:>6}  [{','.join(row['engines'])} / {row['model']}] {row['query'][:80]}")
+
+    for title, section in (("Load per engine", report["engines"]), ("Load per model", report["models"])):
+        print(f"\n{title}")
+        print(f"  {'name':<24} {'turns':>7} {'errors':>7} {'users':>6} {'peak/h':>7} {'tokens':>10} {'p90 total':>10}")
+        for name, row in section.items():
+            print(f"  {name:<24} {row['turns']:>7} {row['errors']:>7} {row['users']:>6} "
+                  f"{row['peak_per_hour']:>7} {row['tokens']:>10} {_fmt(row['p90_total_s']):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=float, default=7, help="Only consider the last N days")
+    parser.add_argument("--top", type=int, default=20, help="Rows in the top-N lists")
+    parser.add_argument("--window", type=float, default=24, help="Hours within which a repeat counts as cacheable")
+    parser.add_argument("--dir", default=config.QUERY_LOG_DIR, help="Query log directory")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    since = time.time() - args.days * 86400
+    report = analyze(read_entries(args.dir, since), args.top, args.window)
+    if args.json:
+        report["engines"] = dict(report["engines"])
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print_report(report, args.days)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Thin client for the resident rag_query daemon: sends one question, streams the answer.
+
+Start the daemon once with `python scripts/rag_query.py --serve`, then:
+    python scripts/rag_ask.py "What are the main topics covered in the documents?"
+    cat questions.txt | while read -r q; do python scripts/rag_ask.py "$q"; done
+
+Only the standard library is imported here, so each call costs little more
+than the model round trip.
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+
+# Keep in sync with config.RAG_QUERY_SOCKET (importing core is avoided on purpose)
+DEFAULT_SOCKET = os.environ.get("RAG_QUERY_SOCKET", f"/tmp/mi-rag-query-{os.getuid()}.sock")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ask the resident rag_query daemon a question.")
+    parser.add_argument("question", nargs="?", help="Question (read from stdin if omitted)")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET)
+    parser.add_argument("--sources", action="store_true", help="Print grounding metadata after the answer")
+    args = parser.parse_args()
+    question = args.question or sys.stdin.read().strip()
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(args.socket)
+    except OSError:
+        sys.exit(f"No daemon on {args.socket}; start one with: python scripts/rag_query.py --serve")
+
+    with client, client.makefile("rwb") as stream:
+        stream.write((json.dumps({"question": question, "sources": args.sources}) + "\n").encode("utf-8"))
+        stream.flush()
+        for line in stream:
+            message = json.loads(line)
+            if "delta" in message:
+                sys.stdout.write(message["delta"])
+                sys.stdout.flush()
+            elif "error" in message:
+                sys.exit(f"\nError: {message['error']}")
+            elif message.get("done"):
+                print()
+                if message.get("sources"):
+                    print(f"\n{message['sources']}")
+                break
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,24 @@
-import sys
+"""Asks the default RAG engine one question from the command line.
+
+Usage:
+    python scripts/rag_query.py ["question"]        # one-shot
+    python scripts/rag_query.py --serve [--socket PATH]
+
+With --serve the Vertex AI SDK, the retrieval tool and the model are set up
+once and kept warm; questions arrive on a Unix socket (config.RAG_QUERY_SOCKET)
+and answers are streamed back. Use scripts/rag_ask.py as the client.
+"""
+import argparse
+import json
 import os
+import socketserver
+import sys
 
 # Add parent directory to path to allow importing core
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 import core.config as config
-import vertexai
-from vertexai.preview import rag
-from vertexai.preview.generative_models import GenerativeModel, Tool
+import core.storage as storage
 
 # -------------------------------
 # Your RAG engine identifiers
@@ -16,76 +27,175 @@ PROJECT_ID = config.PROJECT_ID
 LOCATION = config.LOCATION
 RAG_CORPUS_ID = config.DEFAULT_RAG_CORPUS_ID
 RAG_RESOURCE_NAME = f"projects/{PROJECT_ID}/locations/{LOCATION}/ragCorpora/{RAG_CORPUS_ID}"
+# Same (possibly tuned) settings the chat UI uses for this engine
+RETRIEVAL_PARAMS = storage.get_retrieval_params(RAG_CORPUS_ID)
 
-# -------------------------------
-# Initialize Vertex AI
-# -------------------------------
-print(f"Initializing Vertex AI for project {PROJECT_ID}...")
-vertexai.init(project=PROJECT_ID, location=LOCATION)
+DEFAULT_QUERY = "What are the main topics covered in the documents?"
 
-# -------------------------------
-# Define your question
-# -------------------------------
-user_query = "What are the main topics covered in the documents?"
 
-# -------------------------------
-# Create RAG Tool
-# -------------------------------
-print("Configuring RAG tool...")
-retrieval_tool = Tool.from_retrieval(
-    retrieval=rag.Retrieval(
-        source=rag.VertexRagStore(
-            rag_resources=[
-                rag.RagResource(
-                    rag_corpus=RAG_RESOURCE_NAME
-                )
-            ],
-            similarity_top_k=5,
-        ),
+def build_model():
+    """Initializes Vertex AI and returns `(model, retrieval_tool)`."""
+    import vertexai
+    from vertexai.preview import rag
+    from vertexai.preview.generative_models import GenerativeModel, Tool
+
+    # -------------------------------
+    # Initialize Vertex AI
+    # -------------------------------
+    print(f"Initializing Vertex AI for project {PROJECT_ID}...")
+    vertexai.init(project=PROJECT_ID, location=LOCATION)
+
+    # -------------------------------
+    # Create RAG Tool
+    # -------------------------------
+    print("Configuring RAG tool...")
+    retrieval_tool = Tool.from_retrieval(
+        retrieval=rag.Retrieval(
+            source=rag.VertexRagStore(
+                rag_resources=[
+                    rag.RagResource(
+                        rag_corpus=RAG_RESOURCE_NAME
+                    )
+                ],
+                similarity_top_k=RETRIEVAL_PARAMS["similarity_top_k"],
+                vector_distance_threshold=RETRIEVAL_PARAMS["vector_distance_threshold"],
+            ),
+        )
     )
-)
 
-# -------------------------------
-# Load Model
-# -------------------------------
-# Using Gemini 2.5 Flash
-model = GenerativeModel("gemini-2.5-flash")
+    # -------------------------------
+    # Load Model
+    # -------------------------------
+    # Using Gemini 2.5 Flash
+    model = GenerativeModel("gemini-2.5-flash")
+    return model, retrieval_tool
 
-# -------------------------------
-# Generate Answer
-# -------------------------------
-print(f"\nQuestion: {user_query}")
-print("Querying RAG engine and generating answer (this may take a moment)...")
 
-try:
-    response = model.generate_content(
-        user_query,
-        tools=[retrieval_tool],
-    )
+def ask(model, retrieval_tool, user_query):
+    """Streams the answer to one question. Yields text deltas, then the grounding metadata (or None)."""
+    grounding = None
+    for response in model.generate_content(user_query, tools=[retrieval_tool], stream=True):
+        if response.candidates and response.candidates[0].grounding_metadata:
+            grounding = response.candidates[0].grounding_metadata
+        try:
+            text = response.text
+        except ValueError:
+            # Chunks carrying only metadata have no text part
+            text = ""
+        if text:
+            yield text
+    yield grounding
+
+
+def run_once(user_query):
+    model, retrieval_tool = build_model()
 
     # -------------------------------
-    # Display the results
+    # Generate Answer
     # -------------------------------
-    print("\n============================")
-    print("🧠 LLM Answer:")
-    print("============================\n")
-    print(response.text)
-
-    print("\n============================")
-    print("📄 Retrieved Contexts (Metadata):")
-    print("============================\n")
-    # Attempt to show grounding metadata if available
+    print(f"\nQuestion: {user_query}")
+    print("Querying RAG engine and generating answer (this may take a moment)...")
+
     try:
-        if response.candidates and response.candidates[0].grounding_metadata:
-             print(response.candidates[0].grounding_metadata)
+        # -------------------------------
+        # Display the results
+        # -------------------------------
+        print("\n============================")
+        print("🧠 LLM Answer:")
+        print("============================\n")
+        grounding = None
+        for item in ask(model, retrieval_tool, user_query):
+            if isinstance(item, str):
+                print(item, end="", flush=True)
+            else:
+                grounding = item
+        print()
+
+        print("\n============================")
+        print("📄 Retrieved Contexts (Metadata):")
+        print("============================\n")
+        # Attempt to show grounding metadata if available
+        if grounding:
+            print(grounding)
         else:
-             print("No grounding metadata returned.")
+            print("No grounding metadata returned.")
+
     except Exception as e:
-        print(f"Could not parse grounding metadata: {e}")
-
-except Exception as e:
-    print(f"\nError during generation: {e}")
-    print("\nPlease ensure you have authenticated with:")
-    print("  gcloud auth login")
-    print(f"  gcloud config set project {PROJECT_ID}")
-    print("  gcloud auth application-default login")
+        print(f"\nError during generation: {e}")
+        print("\nPlease ensure you have authenticated with:")
+        print("  gcloud auth login")
+        print(f"  gcloud config set project {PROJECT_ID}")
+        print("  gcloud auth application-default login")
+
+
+# -------------------------------
+# Daemon mode
+# -------------------------------
+class _QueryHandler(socketserver.StreamRequestHandler):
+    """One JSON request line in (`{"question": ..., "sources": bool}`), JSON lines out:
+    `{"delta": text}` while generating, then `{"done": true}` (with `"sources"` if asked)
+    or `{"error": message}`."""
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline() or b"{}")
+            question = request.get("question")
+            if not question:
+                self._send({"error": "missing question"})
+                return
+            for item in ask(self.server.model, self.server.retrieval_tool, question):
+                if isinstance(item, str):
+                    self._send({"delta": item})
+                else:
+                    done = {"done": True}
+                    if request.get("sources"):
+                        done["sources"] = str(item) if item else None
+                    self._send(done)
+        except BrokenPipeError:
+            # Client went away (e.g. `| head`); nothing left to do
+            pass
+        except Exception as e:
+            self._send({"error": str(e)})
+
+    def _send(self, payload):
+        self.wfile.write((json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+
+class _QueryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(socket_path):
+    model, retrieval_tool = build_model()
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = _QueryServer(socket_path, _QueryHandler)
+    # Only the owner may send questions under the daemon's credentials
+    os.chmod(socket_path, 0o600)
+    server.model = model
+    server.retrieval_tool = retrieval_tool
+    print(f"Listening on {socket_path} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("question", nargs="?", default=DEFAULT_QUERY)
+    parser.add_argument("--serve", action="store_true", help="Stay resident and answer questions on a Unix socket")
+    parser.add_argument("--socket", default=config.RAG_QUERY_SOCKET, help="Socket path for --serve")
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.socket)
+    else:
+        run_once(args.question)
+
+
+if __name__ == "__main__":
+    main()
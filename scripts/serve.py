@@ -0,0 +1,46 @@
+"""Container entry point: warms the process up, then starts Streamlit.
+
+Streamlit runs page scripts inside this same interpreter, so modules imported
+and st.cache_resource entries created here are reused by the first session.
+The Streamlit port only opens once warm-up has finished, which keeps TCP
+startup probes (Cloud Run's default) from routing traffic to a cold replica.
+Set HEALTH_PORT to also expose /ready and /live for HTTP probes and
+/metrics for Prometheus.
+
+Usage:
+    python scripts/serve.py [extra streamlit args]
+"""
+import os
+import sys
+import threading
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(REPO_ROOT)
+
+import core.config as config
+from core import telemetry, warmup
+
+
+def main():
+    # Relative data/... paths (engines, instructions, tokens) must resolve as they do for the pages
+    os.chdir(REPO_ROOT)
+    telemetry.configure_tracing()
+    warmup.start_health_server()
+
+    # Bound warm-up so a hung canary cannot keep the replica out of service forever
+    worker = threading.Thread(target=warmup.warm_up, name="warm-up", daemon=True)
+    worker.start()
+    worker.join(timeout=config.WARMUP_TIMEOUT)
+    if worker.is_alive():
+        print(f"Warm-up did not finish within {config.WARMUP_TIMEOUT}s, starting anyway")
+        warmup.mark_ready()
+    print(f"Warm-up status: {warmup.get_status()}")
+
+    from streamlit.web import cli as stcli
+
+    sys.argv = ["streamlit", "run", "app.py", *sys.argv[1:]]
+    sys.exit(stcli.main())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""Sweeps retrieval parameters for one RAG engine over a labeled question set.
+
+For every (similarity_top_k, vector_distance_threshold) combination this
+records source recall, retrieval latency and context size; with --generate it
+also answers each question and records groundedness, token usage and
+generation latency. The best setting can be written to the engine's entry in
+rag_engines.json (--apply), where the chat UI, the API and rag_query.py pick
+it up.
+
+Question file format (JSON list):
+    [{"question": "...", "expected_sources": ["file name or URI fragment", ...]}]
+
+Usage:
+    python scripts/tune_retrieval.py --engine "Default Shared Engine" \\
+        --questions data/retrieval_eval.example.json --top-k 3,5,10 --thresholds 0.3,0.5,0.7 --generate --apply
+
+Authenticates with Application Default Credentials (gcloud auth application-default login).
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+# Add parent directory to path to allow importing core
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import google.auth
+from google.genai import types
+import core.config as config
+import core.storage as storage
+from core.clients import VertexClients
+from core.lexical_index import tokenize
+from core.rag import RAG_SYSTEM_INSTRUCTION
+from core.retrieval import build_grounded_prompt, retrieve_contexts
+from core.scheduler import estimate_tokens
+
+# A sentence counts as grounded when this share of its content words appears in the context
+GROUNDED_OVERLAP = 0.6
+# Settings within this much recall of the best are compared on the remaining metrics
+RECALL_TOLERANCE = 0.02
+
+
+def find_engine(name_or_id):
+    for engine in storage.load_rag_engines():
+        if name_or_id in (engine["name"], engine["corpus_id"]):
+            return engine
+    return None
+
+
+def source_recall(chunks, expected_sources):
+    """Share of expected sources that appear in any retrieved chunk's URI or title."""
+    if not expected_sources:
+        return None
+    haystack = [f"{c.get('uri') or ''} {c.get('title') or ''}".lower() for c in chunks]
+    found = sum(1 for s in expected_sources if any(s.lower() in h for h in haystack))
+    return found / len(expected_sources)
+
+
+def groundedness(answer, chunks):
+    """Share of answer sentences whose content words mostly occur in the retrieved text."""
+    context_terms = set(tokenize(" ".join(c.get("text") or "" for c in chunks)))
+    sentences = [s for s in re.split(r"(?<=[.!?])\s+|\n+", answer or "") if s.strip()]
+    scored = []
+    for sentence in sentences:
+        terms = [t for t in tokenize(sentence) if len(t) > 3]
+        if terms:
+            scored.append(sum(t in context_terms for t in terms) / len(terms) >= GROUNDED_OVERLAP)
+    return sum(scored) / len(scored) if scored else None
+
+
+def _mean(values):
+    values = [v for v in values if v is not None]
+    return statistics.mean(values) if values else None
+
+
+def evaluate(clients, corpus_name, questions, top_k, threshold, model=None):
+    rows = []
+    for item in questions:
+        started = time.monotonic()
+        chunks = retrieve_contexts(clients, corpus_name, item["question"], top_k, threshold)
+        row = {
+            "recall": source_recall(chunks, item.get("expected_sources")),
+            "retrieval_s": time.monotonic() - started,
+            "context_tokens": sum(estimate_tokens(c["text"]) for c in chunks),
+        }
+        if model:
+            started = time.monotonic()
+            response = clients.genai.models.generate_content(
+                model=model,
+                contents=build_grounded_prompt(item["question"], chunks),
+                config=types.GenerateContentConfig(system_instruction=RAG_SYSTEM_INSTRUCTION),
+            )
+            usage = response.usage_metadata
+            row.update({
+                "generation_s": time.monotonic() - started,
+                "groundedness": groundedness(response.text, chunks),
+                "prompt_tokens": usage.prompt_token_count if usage else None,
+                "output_tokens": usage.candidates_token_count if usage else None,
+            })
+        rows.append(row)
+
+    latencies = sorted(r["retrieval_s"] for r in rows)
+    summary = {
+        "similarity_top_k": top_k,
+        "vector_distance_threshold": threshold,
+        "recall": _mean(r["recall"] for r in rows),
+        "retrieval_p50_s": latencies[len(latencies) // 2],
+        "retrieval_p95_s": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+        "context_tokens": _mean(r["context_tokens"] for r in rows),
+    }
+    if model:
+        summary.update({
+            "groundedness": _mean(r["groundedness"] for r in rows),
+            "prompt_tokens": _mean(r["prompt_tokens"] for r in rows),
+            "output_tokens": _mean(r["output_tokens"] for r in rows),
+            "generation_mean_s": _mean(r["generation_s"] for r in rows),
+        })
+    return summary
+
+
+def pick_best(results):
+    """Highest recall; near-ties broken by groundedness, then fewer tokens, then latency."""
+    best_recall = max((r["recall"] or 0) for r in results)
+    contenders = [r for r in results if (r["recall"] or 0) >= best_recall - RECALL_TOLERANCE]
+    return min(
+        contenders,
+        key=lambda r: (
+            -(r.get("groundedness") or 0),
+            r.get("prompt_tokens") or r["context_tokens"],
+            r["retrieval_p50_s"],
+        ),
+    )
+
+
+def _fmt(value, spec):
+    return format(value, spec) if value is not None else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engine", required=True, help="Engine name or corpus id from rag_engines.json")
+    parser.add_argument("--questions", required=True, help="Labeled question set (JSON)")
+    parser.add_argument("--top-k", default="3,5,10", help="Comma-separated similarity_top_k values")
+    parser.add_argument("--thresholds", default="0.3,0.5,0.7", help="Comma-separated vector_distance_threshold values")
+    parser.add_argument("--generate", action="store_true", help="Also generate answers (groundedness, tokens)")
+    parser.add_argument("--model", default=config.DEFAULT_MODEL_ID, help="Model used with --generate")
+    parser.add_argument("--apply", action="store_true", help="Save the best setting to rag_engines.json")
+    parser.add_argument("--report", help="Write all results to this JSON file")
+    args = parser.parse_args()
+
+    engine = find_engine(args.engine)
+    if engine is None:
+        sys.exit(f"Unknown engine: {args.engine}")
+    with open(args.questions, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+
+    # Measure Vertex retrieval itself, not the shared retrieval cache
+    config.RETRIEVAL_CACHE_TTL = 0
+    credentials, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+    clients = VertexClients(credentials, principal="tune_retrieval")
+    corpus_name = clients.corpus_resource_name(engine["corpus_id"])
+
+    grid = list(itertools.product(
+        [int(v) for v in args.top_k.split(",")],
+        [float(v) for v in args.thresholds.split(",")],
+    ))
+    print(f"Evaluating {len(grid)} settings on {len(questions)} questions for '{engine['name']}'\n")
+    print(f"{'top_k':>5} {'thresh':>6} {'recall':>7} {'ground':>7} {'ctx_tok':>8} {'prompt_tok':>10} {'ret_p50':>8} {'gen_s':>6}")
+
+    results = []
+    for top_k, threshold in grid:
+        summary = evaluate(clients, corpus_name, questions, top_k, threshold, args.model if args.generate else None)
+        results.append(summary)
+        print(
+            f"{top_k:>5} {threshold:>6.2f} {_fmt(summary['recall'], '.3f'):>7} "
+            f"{_fmt(summary.get('groundedness'), '.3f'):>7} {_fmt(summary['context_tokens'], '.0f'):>8} "
+            f"{_fmt(summary.get('prompt_tokens'), '.0f'):>10} {summary['retrieval_p50_s']:>8.3f} "
+            f"{_fmt(summary.get('generation_mean_s'), '.2f'):>6}"
+        )
+    clients.close()
+
+    best = pick_best(results)
+    print(f"\nBest: similarity_top_k={best['similarity_top_k']}, vector_distance_threshold={best['vector_distance_threshold']}")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"engine": engine["name"], "results": results, "best": best}, f, indent=4)
+
+    if args.apply:
+        params = {
+            "similarity_top_k": best["similarity_top_k"],
+            "vector_distance_threshold": best["vector_distance_threshold"],
+            "tuned_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "metrics": {k: v for k, v in best.items() if k not in ("similarity_top_k", "vector_distance_threshold")},
+        }
+        storage.save_retrieval_params(engine["corpus_id"], params)
+        print(f"Saved to {config.RAG_ENGINES_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Precomputes answers to frequent questions so the first asker gets them instantly.
+
+Questions come from a curated file and/or the most frequent opening questions
+per engine in the query log. Each one is answered through the same
+ADKChatSession setup the chat page uses for a new session (default model,
+active system instruction, default retrieval options), and the answer is
+stored in the read-through answer store.
+
+An engine is re-warmed when its file list changed since it was last warmed
+(its cached answers are dropped first), or when its answers are about to
+expire. Run it from cron, or keep it running with --watch.
+
+Questions file format (JSON): {"<engine name or corpus id>": ["question", ...], "*": [...for every engine]}
+
+Usage:
+    python scripts/warm_answers.py --questions data/warm_questions.json --from-log
+    python scripts/warm_answers.py --from-log --watch 600
+    python scripts/warm_answers.py --engine "Default Shared Engine" --force
+
+Authenticates with Application Default Credentials (gcloud auth application-default login).
+"""
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+
+# Add parent directory to path to allow importing core
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import google.auth
+import core.config as config
+import core.storage as storage
+from core.adk_agent import get_adk_session
+from core.answer_cache import get_answer_store
+from core.clients import VertexClients
+from core.query_log import read_entries
+from core.singleflight import fingerprint, normalize_prompt
+
+
+def curated_questions(path, engine):
+    if not path:
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data.get(engine["name"], []) + data.get(engine["corpus_id"], []) + data.get("*", [])
+
+
+def frequent_questions(engine, top, days):
+    """Most frequent opening questions asked against this engine alone, most recent wording kept."""
+    counts = collections.Counter()
+    wording = {}
+    for entry in read_entries(since=time.time() - days * 86400):
+        if entry.get("error") or entry.get("history_turns") or entry.get("engines") != [engine["corpus_id"]]:
+            continue
+        counts[entry["normalized"]] += 1
+        wording[entry["normalized"]] = entry["query"]
+    return [wording[q] for q, _ in counts.most_common(top)]
+
+
+def corpus_fingerprint(clients, corpus_name):
+    """Changes whenever a file is added, removed or re-imported."""
+    files = clients.list_files(corpus_name)
+    return fingerprint(sorted((f.name, str(f.update_time)) for f in files))
+
+
+def warm_engine(clients, engine, questions, model, force=False):
+    store = get_answer_store()
+    corpus_name = clients.corpus_resource_name(engine["corpus_id"])
+    current = corpus_fingerprint(clients, corpus_name)
+    previous, warmed_at = store.corpus_state(corpus_name)
+    expiring = warmed_at is None or time.time() - warmed_at > 0.9 * config.ANSWER_CACHE_TTL
+    if not force and current == previous and not expiring:
+        print(f"{engine['name']}: unchanged, skipping")
+        return 0
+    # Answers computed against the old corpus must not be served meanwhile
+    store.invalidate_corpus(corpus_name)
+
+    session = get_adk_session(model, [corpus_name], storage.load_system_instruction(), clients)
+    warmed = 0
+    for question in dict.fromkeys(questions, None):
+        session.history = []
+        started = time.monotonic()
+        response = session.send_message(question, refresh_cache=True)
+        failed = response.text.startswith("Error executing ADK Agent")
+        print(f"  {'FAIL' if failed else 'ok':>4} {time.monotonic() - started:6.1f}s  {question[:80]}")
+        warmed += 0 if failed else 1
+    store.mark_warmed(corpus_name, current)
+    print(f"{engine['name']}: warmed {warmed}/{len(questions)} answers")
+    return warmed
+
+
+def run(args, clients):
+    engines = storage.load_rag_engines()
+    if args.engine:
+        engines = [e for e in engines if e["name"] in args.engine or e["corpus_id"] in args.engine]
+    for engine in engines:
+        questions = curated_questions(args.questions, engine)
+        if args.from_log:
+            questions += frequent_questions(engine, args.top, args.days)
+        # The same question in different casing or spacing shares one answer
+        questions = list({normalize_prompt(q): q for q in questions}.values())
+        if not questions:
+            continue
+        try:
+            warm_engine(clients, engine, questions, args.model, args.force)
+        except Exception as e:
+            print(f"{engine['name']}: warming failed: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", help="Curated questions file (JSON)")
+    parser.add_argument("--from-log", action="store_true", help="Add the most frequent questions from the query log")
+    parser.add_argument("--top", type=int, default=config.WARM_TOP_QUESTIONS, help="Questions per engine from the log")
+    parser.add_argument("--days", type=float, default=7, help="Query log window in days")
+    parser.add_argument("--engine", action="append", help="Only warm this engine (name or corpus id); repeatable")
+    parser.add_argument("--model", default=config.DEFAULT_MODEL_ID)
+    parser.add_argument("--force", action="store_true", help="Re-warm even if the corpus has not changed")
+    parser.add_argument("--watch", type=float, metavar="SECONDS", help="Keep running, checking for changes this often")
+    args = parser.parse_args()
+    if not args.questions and not args.from_log:
+        parser.error("give --questions and/or --from-log")
+
+    credentials, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+    clients = VertexClients(credentials, principal="warm_answers")
+    try:
+        while True:
+            run(args, clients)
+            if not args.watch:
+                break
+            time.sleep(args.watch)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        clients.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import threading
+import time
+import types
+import pytest
+
+adk_agent = pytest.importorskip("core.adk_agent")
+
+
+class _Clients:
+    def __init__(self, principal, readable=True):
+        self.principal = principal
+        self.readable = readable
+
+    def can_read(self, corpus_names):
+        return self.readable
+
+
+def make_session(clients):
+    agent = types.SimpleNamespace(model="gemini-test", instruction="Answer from the documents.")
+    return adk_agent.ADKChatSession(agent, ["corpora/1"], clients, hybrid=False, rerank=False, code_citations=False)
+
+
+def run_concurrently(leader, follower, monkeypatch):
+    """Runs the leader's turn, then the follower's while the leader is still in flight."""
+    release = threading.Event()
+    started = threading.Event()
+    answered_by = []
+
+    def answer(self, prompt, chunks=None):
+        answered_by.append(self.clients.principal)
+        if self is leader:
+            started.set()
+            release.wait(5)
+        return self.clients.principal
+
+    monkeypatch.setattr(adk_agent.ADKChatSession, "_answer", answer)
+    flights = adk_agent.get_singleflight()
+    coalesced = flights.coalesced
+    results = {}
+    thread = threading.Thread(target=lambda: results.setdefault("leader", leader._coalesced_answer("What is X?")))
+    thread.start()
+    started.wait(5)
+    follower_thread = threading.Thread(
+        target=lambda: results.setdefault("follower", follower._coalesced_answer("what is  x?"))
+    )
+    follower_thread.start()
+    # Let the leader finish only once the follower has joined its flight
+    deadline = time.monotonic() + 5
+    while flights.coalesced == coalesced and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    thread.join(5)
+    follower_thread.join(5)
+    return results, answered_by
+
+
+def test_different_users_share_one_call(monkeypatch):
+    leader, follower = make_session(_Clients("alice")), make_session(_Clients("bob"))
+    results, answered_by = run_concurrently(leader, follower, monkeypatch)
+    assert results == {"leader": ("alice", False), "follower": ("alice", True)}
+    assert answered_by == ["alice"]
+
+
+def test_follower_without_access_answers_for_itself(monkeypatch):
+    leader, follower = make_session(_Clients("alice")), make_session(_Clients("mallory", readable=False))
+    results, answered_by = run_concurrently(leader, follower, monkeypatch)
+    assert results["follower"] == ("mallory", False)
+    assert answered_by == ["alice", "mallory"]
+
+
+def test_prefetched_turns_are_not_coalesced(monkeypatch):
+    session = make_session(_Clients("alice"))
+    calls = []
+
+    def answer(self, prompt, chunks=None):
+        calls.append(chunks)
+        return "model", types.SimpleNamespace(usage_metadata=None, candidates=[], text="answer"), chunks, {}
+
+    monkeypatch.setattr(adk_agent.ADKChatSession, "_answer", answer)
+    monkeypatch.setattr(adk_agent.ADKChatSession, "_coalesced_answer", lambda self, prompt: pytest.fail("coalesced"))
+    monkeypatch.setattr(adk_agent.ADKChatSession, "_log_turn", lambda *args, **kwargs: None)
+    # Keep the answer store out of it
+    monkeypatch.setattr(adk_agent.ADKChatSession, "_answer_cache_key", lambda self, prompt: None)
+    prefetched = [{"uri": "a", "title": "a", "text": "excerpt"}]
+    response = session.send_message("Hello there, what is X?", chunks=prefetched)
+    assert response.text == "answer"
+    assert calls == [prefetched]
@@ -0,0 +1,22 @@
+from core.answer_cache import answer_key
+
+PARAMS = {"corpora/1": {"similarity_top_k": 10, "vector_distance_threshold": 0.5}}
+
+
+def key(params=PARAMS, prompt="What is XR-200?", **options):
+    options = dict({"hybrid": False, "rerank": False}, **options)
+    return answer_key(list(params), "gemini-2.5-flash", "Be brief.", options["hybrid"], options["rerank"], params, prompt)
+
+
+def test_same_question_and_settings_share_a_key():
+    assert key(prompt="what is  XR-200?") == key()
+
+
+def test_retuned_retrieval_changes_the_key():
+    assert key({"corpora/1": {"similarity_top_k": 20, "vector_distance_threshold": 0.5}}) != key()
+    assert key({"corpora/1": {"similarity_top_k": 10, "vector_distance_threshold": 0.3}}) != key()
+
+
+def test_retrieval_mode_changes_the_key():
+    assert key(hybrid=True) != key()
+    assert key(rerank=True) != key()
@@ -0,0 +1,69 @@
+import pytest
+from core.citations import NO_CITATIONS_NOTE, references_from_chunks, strip_citation_instructions
+
+INSTRUCTION = """You answer questions about the documents.
+
+**Citation Format Instructions (ONLY when RAG is used):**
+
+Add citations at the end of your answer.
+
+**How to cite:**
+- Use the retrieved chunk's `title`.
+
+Do not reveal your internal chain-of-thought.
+Simply provide concise and factual answers, and then list the
+relevant citation(s) at the end.
+"""
+
+
+def test_strip_removes_the_citation_section():
+    stripped = strip_citation_instructions(INSTRUCTION)
+    assert "Citation Format" not in stripped
+    assert "How to cite" not in stripped
+    assert "title" not in stripped
+    assert stripped.startswith("You answer questions about the documents.")
+    assert "Do not reveal your internal chain-of-thought." in stripped
+
+
+def test_strip_rewrites_the_closing_citation_request():
+    stripped = strip_citation_instructions(INSTRUCTION)
+    assert "citation(s)" not in stripped
+    assert "Simply provide concise and factual answers." in stripped
+
+
+def test_strip_appends_the_note_once():
+    stripped = strip_citation_instructions(INSTRUCTION)
+    assert stripped.endswith(f"\n\n{NO_CITATIONS_NOTE}\n")
+    assert stripped.count(NO_CITATIONS_NOTE) == 1
+    assert "\n\n\n" not in stripped
+
+
+def test_strip_leaves_other_instructions_alone():
+    assert strip_citation_instructions("Answer in French.") == f"Answer in French.\n\n{NO_CITATIONS_NOTE}\n"
+
+
+def test_strip_empty_instruction():
+    assert strip_citation_instructions("") == NO_CITATIONS_NOTE
+    assert strip_citation_instructions(None) == NO_CITATIONS_NOTE
+
+
+def test_strip_default_instruction():
+    pytest.importorskip("google.adk")
+    from core.adk_agent import RAG_SYSTEM_INSTRUCTION
+
+    stripped = strip_citation_instructions(RAG_SYSTEM_INSTRUCTION)
+    assert "Citation Format Instructions" not in stripped
+    assert "**CRITICAL RULES:**" in stripped
+    assert "Do not reveal your internal chain-of-thought" in stripped
+
+
+def test_references_from_chunks_one_per_file():
+    chunks = [
+        {"uri": "gs://b/a.pdf", "title": "a.pdf", "text": "1"},
+        {"uri": "gs://b/b.pdf", "title": "b.pdf", "text": "2"},
+        {"uri": "gs://b/a.pdf", "title": "a.pdf", "text": "3"},
+    ]
+    assert references_from_chunks(chunks) == [
+        {"title": "a.pdf", "uri": "gs://b/a.pdf"},
+        {"title": "b.pdf", "uri": "gs://b/b.pdf"},
+    ]
@@ -0,0 +1,75 @@
+import pytest
+from core.clients import VertexClientPool
+
+
+class _Credentials:
+    pass
+
+
+@pytest.fixture
+def closed(monkeypatch):
+    """Principals whose clients were closed, without opening any real channels."""
+    closed = []
+
+    def close(self):
+        self._closed = True
+        closed.append(self.principal)
+
+    monkeypatch.setattr("core.clients.VertexClients.close", close)
+    return closed
+
+
+def test_overflow_evicts_the_least_recently_used_idle_entry(closed):
+    pool = VertexClientPool(max_size=2, idle_ttl=3600)
+    credentials = _Credentials()
+    pool.get("a", credentials)
+    pool.get("b", credentials)
+    pool.get("c", credentials)
+    assert closed == ["a"]
+    assert pool.size() == 2
+
+
+def test_clients_in_use_are_not_evicted(closed):
+    pool = VertexClientPool(max_size=1, idle_ttl=3600)
+    credentials = _Credentials()
+    busy = pool.get("a", credentials)
+    with busy.in_use():
+        pool.get("b", credentials)
+        assert closed == []
+    # Evicted once idle, on the next pool access
+    pool.get("c", credentials)
+    assert "a" in closed
+
+
+def test_idle_ttl_skips_clients_in_use(closed):
+    pool = VertexClientPool(max_size=10, idle_ttl=60)
+    credentials = _Credentials()
+    busy = pool.get("a", credentials)
+    with busy.in_use():
+        busy.last_used -= 120
+        pool.get("b", credentials)
+        assert closed == []
+
+
+def test_new_credentials_replace_the_entry_after_holders_finish(closed):
+    pool = VertexClientPool(max_size=10, idle_ttl=3600)
+    old = pool.get("a", _Credentials())
+    with old.in_use():
+        new = pool.get("a", _Credentials())
+        assert new is not old
+        assert closed == []
+    # The last holder released the replaced clients
+    assert closed == ["a"]
+    assert pool.get("a", new.credentials) is new
+
+
+def test_retired_clients_refuse_use(closed):
+    pool = VertexClientPool(max_size=1, idle_ttl=3600)
+    credentials = _Credentials()
+    evicted = pool.get("a", credentials)
+    pool.get("b", credentials)
+    with pytest.raises(RuntimeError, match="closed"):
+        evicted.rag_data
+    with pytest.raises(RuntimeError, match="closed"):
+        with evicted.in_use():
+            pass
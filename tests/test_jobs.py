@@ -0,0 +1,304 @@
+import datetime
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+from core import config
+from core import jobs
+from core.jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, JobQueue
+
+calls = []
+
+
+def _cleanup(job, **payload):
+    calls.append(("cleanup", payload))
+
+
+@jobs.handler("test_echo")
+def _echo(job, value):
+    job.progress(0.5, "Halfway")
+    return {"value": value}
+
+
+@jobs.handler("test_fail", cleanup=_cleanup)
+def _fail(job, **payload):
+    calls.append(("run", job.attempts))
+    raise RuntimeError("boom")
+
+
+@jobs.handler("test_resume")
+def _resume(job, step=0):
+    # Fails once after saving progress; the retry must see it
+    if step == 0:
+        job.checkpoint(step=1)
+        raise RuntimeError("interrupted")
+    return {"resumed_at": step}
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "JOB_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(config, "JOB_RETRY_BACKOFF", 10)
+    monkeypatch.setattr(config, "JOB_LEASE", 300)
+    calls.clear()
+    return JobQueue(str(tmp_path / "jobs.db"), workers=0)
+
+
+def make_due(queue, job_id):
+    queue._update(job_id, run_after=0)
+
+
+def test_submit_rejects_unknown_kinds(queue):
+    with pytest.raises(ValueError):
+        queue.submit("no_such_kind", {})
+
+
+def test_claim_takes_the_oldest_due_job_and_leases_it(queue):
+    first = queue.submit("test_echo", {"value": 1}, owner="alice")
+    second = queue.submit("test_echo", {"value": 2}, owner="bob")
+    job = queue._claim()
+    assert (job.id, job.owner, job.attempts, job.payload) == (first, "alice", 1, {"value": 1})
+    row = queue.get(first)
+    assert row["status"] == RUNNING
+    assert row["lease_until"] == pytest.approx(time.time() + 300, abs=5)
+    assert queue._claim().id == second
+    assert queue._claim() is None
+
+
+def test_successful_run(queue):
+    job_id = queue.submit("test_echo", {"value": 7})
+    queue._run(queue._claim())
+    row = queue.get(job_id)
+    assert row["status"] == SUCCEEDED
+    assert row["result"] == {"value": 7}
+    assert row["progress"] == 1.0
+    assert row["lease_until"] is None
+
+
+def test_failed_attempt_is_retried_with_backoff(queue):
+    job_id = queue.submit("test_fail", {"path": "x"})
+    queue._run(queue._claim())
+    row = queue.get(job_id)
+    assert row["status"] == QUEUED
+    assert row["error"] == "boom"
+    assert row["run_after"] == pytest.approx(time.time() + 10, abs=5)
+    # Not due yet
+    assert queue._claim() is None
+
+    make_due(queue, job_id)
+    queue._run(queue._claim())
+    assert queue.get(job_id)["run_after"] == pytest.approx(time.time() + 20, abs=5)
+
+
+def test_job_fails_after_max_attempts_and_is_cleaned_up(queue):
+    job_id = queue.submit("test_fail", {"path": "staged.txt"})
+    for _ in range(3):
+        make_due(queue, job_id)
+        queue._run(queue._claim())
+    row = queue.get(job_id)
+    assert row["status"] == FAILED
+    assert row["attempts"] == 3
+    assert calls == [("run", 1), ("run", 2), ("run", 3), ("cleanup", {"path": "staged.txt"})]
+    assert queue._claim() is None
+
+
+def test_retry_requeues_a_failed_job_with_a_fresh_budget(queue):
+    job_id = queue.submit("test_fail", {})
+    for _ in range(3):
+        make_due(queue, job_id)
+        queue._run(queue._claim())
+    queue.retry(job_id)
+    row = queue.get(job_id)
+    assert (row["status"], row["attempts"], row["error"]) == (QUEUED, 0, None)
+    assert queue._claim().id == job_id
+
+
+def test_checkpointed_state_is_passed_to_the_retry(queue):
+    job_id = queue.submit("test_resume", {})
+    queue._run(queue._claim())
+    assert queue.get(job_id)["payload"] == {"step": 1}
+    make_due(queue, job_id)
+    queue._run(queue._claim())
+    assert queue.get(job_id)["result"] == {"resumed_at": 1}
+
+
+def test_expired_lease_is_claimed_again(queue):
+    job_id = queue.submit("test_echo", {"value": 1})
+    queue._claim()
+    # The worker is still inside its lease
+    assert queue._claim() is None
+    # ...then stops renewing it (e.g. its process died)
+    queue._update(job_id, lease_until=time.time() - 1)
+    job = queue._claim()
+    assert (job.id, job.attempts) == (job_id, 2)
+
+
+def test_progress_renews_the_lease(queue):
+    job_id = queue.submit("test_echo", {"value": 1})
+    job = queue._claim()
+    queue._update(job_id, lease_until=time.time() + 1)
+    job.progress(0.3, "Working")
+    row = queue.get(job_id)
+    assert (row["progress"], row["message"]) == (0.3, "Working")
+    assert row["lease_until"] == pytest.approx(time.time() + 300, abs=5)
+
+
+def test_concurrent_workers_never_claim_the_same_job(queue):
+    job_ids = [queue.submit("test_echo", {"value": i}) for i in range(20)]
+    claimed = []
+    lock = threading.Lock()
+
+    def work():
+        # A separate queue object, like another worker process on the same database
+        other = JobQueue(queue.path, workers=0)
+        while True:
+            job = other._claim()
+            if job is None:
+                return
+            with lock:
+                claimed.append(job.id)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == job_ids
+
+
+class _Clients:
+    def __init__(self):
+        self.uploads = 0
+
+    def upload_file(self, corpus_name, path, display_name):
+        self.uploads += 1
+        return {"name": f"{corpus_name}/ragFiles/1"}
+
+    def list_files(self, corpus_name):
+        return []
+
+
+class _FlakyAnswerStore:
+    def __init__(self):
+        self.calls = 0
+
+    def invalidate_corpus(self, corpus_name):
+        self.calls += 1
+        if self.calls == 1:
+            raise RuntimeError("store unavailable")
+
+
+def test_upload_is_not_repeated_when_post_processing_is_retried(queue, tmp_path, monkeypatch):
+    clients = _Clients()
+    monkeypatch.setattr(jobs, "_owner_clients", lambda job: clients)
+    store = _FlakyAnswerStore()
+    monkeypatch.setattr(jobs, "get_answer_store", lambda: store)
+    staged = tmp_path / "report.txt"
+    staged.write_text("text")
+    job_id = queue.submit("upload_file", {"corpus_name": "corpora/1", "path": str(staged), "display_name": "report.txt"})
+    queue._run(queue._claim())
+    assert queue.get(job_id)["payload"]["rag_file"] == "corpora/1/ragFiles/1"
+
+    make_due(queue, job_id)
+    queue._run(queue._claim())
+    row = queue.get(job_id)
+    assert row["status"] == SUCCEEDED
+    assert row["result"] == {"rag_file": "corpora/1/ragFiles/1", "display_name": "report.txt"}
+    assert clients.uploads == 1
+    assert not staged.exists()
+
+
+def test_failed_upload_removes_the_staged_file(queue, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "JOB_MAX_ATTEMPTS", 1)
+
+    class Failing(_Clients):
+        def upload_file(self, corpus_name, path, display_name):
+            raise RuntimeError("denied")
+
+    monkeypatch.setattr(jobs, "_owner_clients", lambda job: Failing())
+    staged = tmp_path / "report.txt"
+    staged.write_text("text")
+    job_id = queue.submit("upload_file", {"corpus_name": "corpora/1", "path": str(staged), "display_name": "report.txt"})
+    queue._run(queue._claim())
+    assert queue.get(job_id)["status"] == FAILED
+    assert not staged.exists()
+
+
+class _CorpusClients:
+    def __init__(self):
+        self.corpora = []
+
+    def list_corpora(self):
+        return list(self.corpora)
+
+    def create_corpus(self, display_name):
+        corpus = SimpleNamespace(
+            name=f"corpora/{len(self.corpora) + 1}", display_name=display_name,
+            create_time=datetime.datetime.now(datetime.timezone.utc),
+        )
+        self.corpora.append(corpus)
+        return corpus
+
+
+def _engines_store(monkeypatch, fail_saves=0):
+    saved = []
+
+    def save(engines):
+        if len(saved) < fail_saves:
+            saved.append(None)
+            raise OSError("disk full")
+        saved.append(engines)
+
+    monkeypatch.setattr(jobs, "load_rag_engines", lambda: next((s for s in reversed(saved) if s), []))
+    monkeypatch.setattr(jobs, "save_rag_engines", save)
+    return saved
+
+
+def test_create_engine_retry_reuses_the_checkpointed_corpus(queue, monkeypatch):
+    clients = _CorpusClients()
+    monkeypatch.setattr(jobs, "_owner_clients", lambda job: clients)
+    saved = _engines_store(monkeypatch, fail_saves=1)
+    job_id = queue.submit("create_engine", {"display_name": "Docs"})
+    queue._run(queue._claim())
+    assert queue.get(job_id)["payload"]["corpus_name"] == "corpora/1"
+
+    make_due(queue, job_id)
+    queue._run(queue._claim())
+    assert queue.get(job_id)["status"] == SUCCEEDED
+    assert len(clients.corpora) == 1
+    assert saved[-1][0]["corpus_id"] == "1"
+
+
+def test_create_engine_retry_finds_a_corpus_it_could_not_checkpoint(queue, monkeypatch):
+    clients = _CorpusClients()
+    monkeypatch.setattr(jobs, "_owner_clients", lambda job: clients)
+    _engines_store(monkeypatch)
+    job_id = queue.submit("create_engine", {"display_name": "Docs"})
+    queue._claim()
+    # The first attempt created the corpus and died before recording it
+    clients.create_corpus("Docs")
+    queue._update(job_id, status=QUEUED, lease_until=None)
+    queue._run(queue._claim())
+    assert queue.get(job_id)["result"] == {"corpus_id": "1"}
+    assert len(clients.corpora) == 1
+
+
+def test_database_error_while_recording_the_outcome_does_not_kill_the_worker(queue, monkeypatch):
+    job_id = queue.submit("test_echo", {"value": 1})
+    job = queue._claim()
+    update = queue._update
+
+    def failing_update(job_id, **fields):
+        if fields.get("status") == SUCCEEDED:
+            raise sqlite3.OperationalError("database is locked")
+        return update(job_id, **fields)
+
+    monkeypatch.setattr(queue, "_update", failing_update)
+    monkeypatch.setattr(queue, "_claim", lambda: job if not queue._stop.is_set() else None)
+    monkeypatch.setattr(queue, "_run", lambda job: (queue._stop.set(), JobQueue._run(queue, job)))
+    queue._work()
+    row = queue.get(job_id)
+    # The lease is left to expire so the job is claimed again
+    assert row["status"] == RUNNING
+    assert row["lease_until"] > time.time()
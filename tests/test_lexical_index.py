@@ -0,0 +1,91 @@
+import gzip
+import json
+from core.lexical_index import LexicalIndex, chunk_text, tokenize
+
+
+def make_index(tmp_path):
+    return LexicalIndex(str(tmp_path / "corpus.json.gz"))
+
+
+def test_tokenize_keeps_identifiers_and_other_scripts():
+    assert tokenize("See XR-200, v2.5 and ISO_9001.") == ["see", "xr-200", "v2.5", "and", "iso_9001"]
+    assert tokenize("Отчёт ÉCOLE Straße") == ["отчёт", "école", "strasse"]
+
+
+def test_chunk_text_overlaps_windows():
+    words = " ".join(str(i) for i in range(10))
+    assert chunk_text(words, size=4, overlap=2) == ["0 1 2 3", "2 3 4 5", "4 5 6 7", "6 7 8 9"]
+    assert chunk_text("", size=4, overlap=2) == []
+
+
+def test_search_ranks_by_bm25(tmp_path):
+    index = make_index(tmp_path)
+    index.add_document("f1", "manual.pdf", "The XR-200 pump needs a new gasket every year.")
+    index.add_document("f2", "faq.txt", "Pumps are serviced yearly. Pumps pumps pumps.")
+    index.add_document("f3", "misc.txt", "Nothing relevant here.")
+    hits = index.search("xr-200 gasket", top_k=5)
+    assert [h["title"] for h in hits] == ["manual.pdf"]
+    assert hits[0]["source"] == "lexical"
+    assert hits[0]["score"] > 0
+
+
+def test_search_prefers_rarer_terms(tmp_path):
+    index = make_index(tmp_path)
+    index.add_document("common", "common.txt", "pump pump")
+    index.add_document("rare", "rare.txt", "pump gasket")
+    index.add_document("other", "other.txt", "pump valve")
+    assert index.search("pump gasket")[0]["title"] == "rare.txt"
+
+
+def test_search_emits_the_source_uri(tmp_path):
+    index = make_index(tmp_path)
+    index.add_document("ragFiles/1", "report.pdf", "quarterly revenue", uri="gs://bucket/run/files/report.pdf")
+    index.add_document("ragFiles/2", "notes.txt", "quarterly plans")
+    uris = {h["title"]: h["uri"] for h in index.search("quarterly")}
+    assert uris == {"report.pdf": "gs://bucket/run/files/report.pdf", "notes.txt": "notes.txt"}
+
+
+def test_search_matches_non_ascii_text(tmp_path):
+    index = make_index(tmp_path)
+    index.add_document("ru", "отчёт.txt", "Годовой отчёт о продажах")
+    assert [h["title"] for h in index.search("ОТЧЁТ")] == ["отчёт.txt"]
+
+
+def test_search_respects_top_k(tmp_path):
+    index = make_index(tmp_path)
+    for i in range(5):
+        index.add_document(f"f{i}", f"{i}.txt", f"shared term {i}")
+    assert len(index.search("shared", top_k=2)) == 2
+
+
+def test_search_empty_index(tmp_path):
+    assert make_index(tmp_path).search("anything") == []
+
+
+def test_reindexing_replaces_a_document(tmp_path):
+    index = make_index(tmp_path)
+    index.add_document("f1", "a.txt", "old words")
+    index.add_document("f1", "a.txt", "new words")
+    assert index.search("old") == []
+    assert len(index.search("new")) == 1
+    assert len(index) == 1
+
+
+def test_removed_documents_are_not_found_and_compacted(tmp_path):
+    index = make_index(tmp_path)
+    index.add_document("f1", "a.txt", "alpha")
+    index.add_document("f2", "b.txt", "beta")
+    index.remove_document("f1")
+    assert index.search("alpha") == []
+    assert [h["title"] for h in index.search("beta")] == ["b.txt"]
+    # Half of the chunks were removed, so the index was compacted
+    assert None not in index.chunks
+
+
+def test_index_persists_and_reloads(tmp_path):
+    index = make_index(tmp_path)
+    index.add_document("f1", "a.txt", "persisted text")
+    with gzip.open(index.path, "rt", encoding="utf-8") as f:
+        assert set(json.load(f)) == {"docs", "chunks", "postings"}
+    reloaded = make_index(tmp_path)
+    assert [h["title"] for h in reloaded.search("persisted")] == ["a.txt"]
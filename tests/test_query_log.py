@@ -0,0 +1,50 @@
+import glob
+import gzip
+import json
+import os
+import socket
+import subprocess
+import sys
+from core.query_log import QueryLog, read_entries
+
+
+def _exited_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def _active_file(directory, pid, entries):
+    path = os.path.join(directory, f"queries-{socket.gethostname()}-{pid}.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+    return path
+
+
+def test_entries_are_written_and_read_back(tmp_path):
+    log = QueryLog(str(tmp_path))
+    log.log({"prompt": "What is XR-200?"})
+    log.close()
+    assert [e["prompt"] for e in read_entries(str(tmp_path))] == ["What is XR-200?"]
+
+
+def test_files_of_exited_processes_are_rotated_at_startup(tmp_path):
+    orphan = _active_file(str(tmp_path), _exited_pid(), [{"prompt": "old", "ts": 1}])
+    live = _active_file(str(tmp_path), os.getppid(), [{"prompt": "live", "ts": 1}])
+    log = QueryLog(str(tmp_path))
+    log.close()
+    assert not os.path.exists(orphan)
+    assert os.path.exists(live)
+    [rotated] = glob.glob(os.path.join(str(tmp_path), "*.jsonl.gz"))
+    with gzip.open(rotated, "rt", encoding="utf-8") as f:
+        assert json.loads(f.read())["prompt"] == "old"
+
+
+def test_rotated_orphans_count_towards_the_backups(tmp_path):
+    for _ in range(3):
+        _active_file(str(tmp_path), _exited_pid(), [{"prompt": "old", "ts": 1}])
+    log = QueryLog(str(tmp_path), backups=2)
+    log.close()
+    assert len(glob.glob(os.path.join(str(tmp_path), "*.jsonl.gz"))) == 2
+    assert glob.glob(os.path.join(str(tmp_path), "*.jsonl")) == []
@@ -0,0 +1,67 @@
+import pytest
+from core import config
+from core import rerank as rerank_module
+from core.rerank import lexical_scores, rerank
+
+
+@pytest.fixture(autouse=True)
+def lexical_only(monkeypatch):
+    # Never load a cross-encoder model in unit tests
+    monkeypatch.setattr(config, "RERANK_MODEL", "")
+    monkeypatch.setattr(config, "RERANK_RELEVANCE_WEIGHT", 0.7)
+
+
+def chunk(uri, text):
+    return {"uri": uri, "title": uri, "text": text}
+
+
+def test_lexical_scores_reward_query_terms():
+    scores = lexical_scores("gasket replacement", [chunk("a", "gasket replacement steps"), chunk("b", "warranty")])
+    assert scores[0] > 0
+    assert scores[1] == 0
+
+
+def test_lexical_scores_without_query_terms():
+    assert lexical_scores("", [chunk("a", "text")]) == [0.0]
+    assert lexical_scores("query", []) == []
+
+
+def test_rerank_promotes_relevant_chunks():
+    chunks = [chunk("a", "company history"), chunk("b", "office locations"), chunk("c", "XR-200 gasket replacement")]
+    ranked = rerank("XR-200 gasket", chunks, top_k=3, token_budget=1000)
+    assert ranked[0]["uri"] == "c"
+    assert all("rerank_score" in c for c in ranked)
+
+
+def test_rerank_keeps_retriever_order_without_overlap():
+    # A paraphrase or another script shares no term with any chunk
+    chunks = [chunk("a", "quarterly revenue grew"), chunk("b", "costs fell"), chunk("c", "headcount flat")]
+    ranked = rerank("Как изменилась выручка?", chunks, top_k=2, token_budget=1000)
+    assert [c["uri"] for c in ranked] == ["a", "b"]
+
+
+def test_rerank_respects_top_k_and_token_budget():
+    chunks = [chunk(str(i), "word " * 400) for i in range(5)]
+    assert len(rerank("word", chunks, top_k=3, token_budget=100000)) == 3
+    # The first chunk is always kept, even when it alone exceeds the budget
+    assert len(rerank("word", chunks, top_k=3, token_budget=10)) == 1
+
+
+def test_rerank_empty():
+    assert rerank("query", []) == []
+
+
+def test_rerank_does_not_modify_its_input():
+    chunks = [chunk("a", "text")]
+    rerank("text", chunks)
+    assert "rerank_score" not in chunks[0]
+
+
+def test_rerank_uses_the_cross_encoder_when_available(monkeypatch):
+    class CrossEncoder:
+        def predict(self, pairs):
+            return [-3.0 if "history" in text else 5.0 for _, text in pairs]
+
+    monkeypatch.setattr(rerank_module, "_get_cross_encoder", lambda: CrossEncoder())
+    ranked = rerank("anything", [chunk("a", "history"), chunk("b", "answer")], top_k=2, token_budget=1000)
+    assert [c["uri"] for c in ranked] == ["b", "a"]
@@ -0,0 +1,124 @@
+import pytest
+from core import retrieval
+from core.lexical_index import chunk_text
+from core.retrieval import RetrievalError, is_small_talk, multi_corpus_retrieve, reciprocal_rank_fusion
+
+
+def chunk(uri, text, **extra):
+    return dict({"uri": uri, "title": uri, "text": text}, **extra)
+
+
+def test_rrf_scores_by_rank_across_lists():
+    a, b, c = chunk("a", "alpha"), chunk("b", "beta"), chunk("c", "gamma")
+    fused = reciprocal_rank_fusion([[a, b], [b, c]], k=60)
+    assert [f["uri"] for f in fused] == ["b", "a", "c"]
+    assert fused[0]["fused_score"] == pytest.approx(1 / 62 + 1 / 61)
+    assert fused[1]["fused_score"] == pytest.approx(1 / 61)
+
+
+def _manual(sentences=60):
+    return " ".join(
+        f"Section {i} of the maintenance manual sets the torque for bolt group {i} to {20 + 3 * i} Nm."
+        for i in range(sentences)
+    )
+
+
+def test_rrf_merges_the_same_passage_chunked_differently():
+    words = _manual().split()
+    uri = "gs://bucket/manual.txt"
+    # Vertex cuts ~512-token chunks; the local index cuts 200-word windows of the same file
+    vector = [chunk(uri, "\n".join(words[0:380]), score=0.2), chunk(uri, "\n".join(words[305:685]), score=0.3)]
+    windows = chunk_text(" ".join(words))
+    lexical = [chunk(uri, windows[i], source="lexical") for i in (1, 3, 0, 5)]
+    other = chunk("gs://bucket/other.txt", windows[1], source="lexical")
+    fused = reciprocal_rank_fusion([vector, lexical + [other]], k=60)
+    assert [f["text"] for f in fused[:2]] == [vector[0]["text"], vector[1]["text"]]
+    assert fused[0]["fused_score"] == pytest.approx(2 / 61)
+    assert fused[1]["fused_score"] == pytest.approx(2 / 62)
+    # A window Vertex did not return, and the same text in another file, stay separate
+    assert [(f["uri"], f["text"]) for f in fused[2:]] == [(uri, windows[5]), (other["uri"], windows[1])]
+
+
+def test_rrf_keeps_distinct_text_from_the_same_file():
+    fused = reciprocal_rank_fusion([[chunk("a", "one"), chunk("a", "two")]])
+    assert len(fused) == 2
+
+
+def test_rrf_limit():
+    ranked = [chunk(str(i), str(i)) for i in range(10)]
+    assert [f["uri"] for f in reciprocal_rank_fusion([ranked], limit=3)] == ["0", "1", "2"]
+
+
+def test_rrf_does_not_modify_its_input():
+    original = chunk("a", "alpha")
+    reciprocal_rank_fusion([[original]])
+    assert "fused_score" not in original
+
+
+@pytest.mark.parametrize("prompt", ["Hello!", "thanks a lot", "ok", "Thank you very much."])
+def test_small_talk(prompt):
+    assert is_small_talk(prompt)
+
+
+@pytest.mark.parametrize("prompt", ["What is XR-200?", "hello, what is the refund policy?", "thanks for the summary of Q3"])
+def test_questions_are_not_small_talk(prompt):
+    assert not is_small_talk(prompt)
+
+
+class _Denied(Exception):
+    code = 403
+
+
+class _Unavailable(Exception):
+    code = 503
+
+
+def test_retrieval_error_access_denied():
+    assert RetrievalError({"a": _Denied(), "b": _Denied()}).access_denied
+    assert not RetrievalError({"a": _Denied(), "b": _Unavailable()}).access_denied
+
+
+def test_multi_corpus_retrieve_skips_a_failing_corpus(monkeypatch):
+    def retrieve(clients, name, *args):
+        if name == "broken":
+            raise _Unavailable(name)
+        return [chunk(name, "text")]
+
+    monkeypatch.setattr(retrieval, "retrieve_contexts", retrieve)
+    chunks, _ = multi_corpus_retrieve(None, ["ok", "broken"], "query")
+    assert [c["uri"] for c in chunks] == ["ok"]
+
+
+def test_multi_corpus_retrieve_raises_when_every_corpus_fails(monkeypatch):
+    def retrieve(clients, name, *args):
+        raise _Denied(name)
+
+    monkeypatch.setattr(retrieval, "retrieve_contexts", retrieve)
+    with pytest.raises(RetrievalError) as excinfo:
+        multi_corpus_retrieve(None, ["a", "b"], "query")
+    assert set(excinfo.value.errors) == {"a", "b"}
+
+
+class _Clients:
+    def __init__(self, readable):
+        self.readable = readable
+
+    def can_read(self, corpus_names):
+        return all(name in self.readable for name in corpus_names)
+
+
+@pytest.mark.parametrize("readable, expected", [(set(), ["ok"]), ({"down"}, ["ok", "down"])])
+def test_hybrid_serves_local_text_only_for_corpora_the_caller_may_read(monkeypatch, readable, expected):
+    def retrieve(clients, name, *args):
+        if name == "down":
+            raise _Unavailable(name)
+        if name == "denied":
+            raise _Denied(name)
+        return []
+
+    monkeypatch.setattr(retrieval, "retrieve_contexts", retrieve)
+    monkeypatch.setattr(retrieval, "lexical_retrieve", lambda names, query, top_k: [
+        [chunk(f"{name}.txt", f"{name} text", corpus=name, source="lexical")] for name in names
+    ])
+    chunks, _ = multi_corpus_retrieve(_Clients(readable), ["ok", "down", "denied"], "query", hybrid=True)
+    assert sorted(c["corpus"] for c in chunks) == sorted(expected)
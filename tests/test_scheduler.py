@@ -0,0 +1,94 @@
+import collections
+import threading
+import time
+import pytest
+from core.scheduler import QuotaScheduler, _Ticket
+
+QUOTAS = {
+    "default": {"requests_per_minute": 600, "tokens_per_minute": 1_000_000},
+    "slow-pro": {"requests_per_minute": 2, "tokens_per_minute": 1_000_000},
+}
+PROJECT = {"requests_per_minute": 600, "tokens_per_minute": 4_000_000}
+
+
+@pytest.fixture
+def scheduler():
+    return QuotaScheduler(model_quotas=QUOTAS, project_quota=PROJECT, max_wait=120, max_attempts=1)
+
+
+def queued(scheduler, *tickets):
+    for ticket in tickets:
+        scheduler._queues.setdefault(ticket.user_id, collections.deque()).append(ticket)
+    return tickets
+
+
+def test_exhausted_model_does_not_block_other_models(scheduler):
+    # Use up the pro model's quota, then queue one more pro call
+    for _ in range(2):
+        scheduler.submit("alice", lambda: None, model="slow-pro", tokens=10)
+    waiting = threading.Thread(target=scheduler.submit, args=("alice", lambda: "late", "slow-pro", 10), daemon=True)
+    waiting.start()
+    deadline = time.monotonic() + 5
+    while not scheduler.queue_length() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert scheduler.queue_length() == 1
+
+    started = time.monotonic()
+    assert scheduler.submit("bob", lambda: "flash", model="fast-flash", tokens=10) == "flash"
+    assert scheduler.submit("alice", lambda: "listed") == "listed"
+    assert time.monotonic() - started < 1
+    assert scheduler.queue_length() == 1
+
+    # Refill the pro bucket so the waiting call finishes
+    with scheduler._cond:
+        scheduler._bucket(("model", "slow-pro", "requests")).tokens = 2
+        scheduler._cond.notify_all()
+    waiting.join(5)
+    assert not waiting.is_alive()
+
+
+def test_tickets_for_a_busy_bucket_keep_their_fair_order(scheduler):
+    demands = scheduler._demands("slow-pro", 10)
+    a1, a2, b1 = _Ticket("alice", demands), _Ticket("alice", demands), _Ticket("bob", demands)
+    queued(scheduler, a1, a2, b1)
+    assert scheduler._service_order() == [a1, b1, a2]
+    now = time.monotonic()
+    # Two requests of quota: the first two in round-robin order may go, not alice's second
+    assert scheduler._may_go(a1, now)
+    assert scheduler._may_go(b1, now)
+    assert not scheduler._may_go(a2, now)
+
+
+def test_a_ticket_waiting_on_a_bucket_reserves_it(scheduler):
+    pro = scheduler._demands("slow-pro", 10)
+    scheduler._bucket(("model", "slow-pro", "requests")).tokens = 0
+    blocked, later_pro = _Ticket("alice", pro), _Ticket("bob", pro)
+    flash = _Ticket("carol", scheduler._demands("fast-flash", 10))
+    queued(scheduler, blocked, later_pro, flash)
+    now = time.monotonic()
+    assert not scheduler._may_go(blocked, now)
+    assert not scheduler._may_go(later_pro, now)
+    assert scheduler._may_go(flash, now)
+
+
+def test_position_counts_the_users_own_earlier_requests(scheduler):
+    demands = scheduler._demands(None, 0)
+    queued(scheduler, *[_Ticket("a", demands) for _ in range(3)])
+    queued(scheduler, *[_Ticket("b", demands) for _ in range(2)])
+    queued(scheduler, _Ticket("c", demands))
+    assert (scheduler.position("a"), scheduler.position("b"), scheduler.position("c")) == (5, 4, 2)
+    assert scheduler.position("nobody") is None
+
+
+def test_throttling_blocks_the_buckets_involved(scheduler):
+    class Throttled(Exception):
+        code = 429
+
+    def throttled():
+        raise Throttled()
+
+    with pytest.raises(Throttled):
+        scheduler.submit("alice", throttled, model="slow-pro", tokens=10)
+    now = time.monotonic()
+    assert scheduler._bucket(("model", "slow-pro", "requests")).time_until(1, now) > 0
+    assert scheduler.stats()["throttled"] == 1
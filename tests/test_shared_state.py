@@ -0,0 +1,105 @@
+import pytest
+from core import shared_state
+from core.shared_state import MemoryBackend
+
+
+class Clock:
+    """Stands in for time.monotonic so TTLs can expire without sleeping."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(shared_state.time, "monotonic", clock)
+    return clock
+
+
+def test_values_round_trip_as_json():
+    backend = MemoryBackend()
+    backend.set("k", {"text": "Привет", "n": [1, 2]})
+    assert backend.get("k") == {"text": "Привет", "n": [1, 2]}
+    assert backend.get("missing") is None
+
+
+def test_stored_values_are_copies():
+    backend = MemoryBackend()
+    value = {"items": [1]}
+    backend.set("k", value)
+    value["items"].append(2)
+    backend.get("k")["items"].append(3)
+    assert backend.get("k") == {"items": [1]}
+
+
+def test_ttl_expires_values(clock):
+    backend = MemoryBackend()
+    backend.set("short", "a", ttl=10)
+    backend.set("forever", "b")
+    clock.now += 9
+    assert backend.get("short") == "a"
+    clock.now += 1
+    assert backend.get("short") is None
+    assert backend.get("forever") == "b"
+    assert backend.stats()["keys"] == 1
+
+
+def test_get_many_skips_expired_and_missing_keys(clock):
+    backend = MemoryBackend()
+    backend.set("a", 1, ttl=5)
+    backend.set("b", 2)
+    clock.now += 5
+    assert backend.get_many(["a", "b", "c"]) == [None, 2, None]
+
+
+def test_incr_starts_at_one_and_counts_up():
+    backend = MemoryBackend()
+    assert backend.incr("counter") == 1
+    assert backend.incr("counter") == 2
+    assert backend.get("counter") == 2
+
+
+def test_incr_keeps_the_ttl(clock):
+    backend = MemoryBackend()
+    backend.set("counter", 5, ttl=10)
+    clock.now += 5
+    assert backend.incr("counter") == 6
+    clock.now += 5
+    assert backend.get("counter") is None
+
+
+def test_incr_restarts_after_expiry(clock):
+    backend = MemoryBackend()
+    backend.set("counter", 5, ttl=10)
+    clock.now += 10
+    assert backend.incr("counter") == 1
+    clock.now += 100
+    assert backend.get("counter") == 1
+
+
+def test_setdefault_keeps_the_first_value(clock):
+    backend = MemoryBackend()
+    assert backend.setdefault("k", "first") == "first"
+    assert backend.setdefault("k", "second") == "first"
+
+
+def test_delete():
+    backend = MemoryBackend()
+    backend.set("a", 1)
+    backend.set("b", 2)
+    backend.delete("a", "missing")
+    assert backend.get_many(["a", "b"]) == [None, 2]
+
+
+def test_corpus_generations_bump_per_corpus(monkeypatch):
+    backend = MemoryBackend()
+    monkeypatch.setattr(shared_state, "get_shared_state", lambda: backend)
+    names = ["projects/p/locations/l/ragCorpora/1", "projects/p/locations/l/ragCorpora/2"]
+    assert shared_state.corpus_generations(names) == {"1": 0, "2": 0}
+    shared_state.bump_corpus_generation(names[0])
+    shared_state.bump_corpus_generation(names[0])
+    assert shared_state.corpus_generations(names) == {"1": 2, "2": 0}
@@ -0,0 +1,12 @@
+from core.usage import UsageStore
+
+
+def test_rollup_can_be_limited_to_one_user(tmp_path):
+    store = UsageStore(str(tmp_path / "usage.db"))
+    store.record("alice@example.com", ["corpora/1"], "gemini-2.5-flash", None)
+    store.record("alice@example.com", ["corpora/2"], "gemini-2.5-flash", None)
+    store.record("bob@example.com", ["corpora/1"], "gemini-2.5-flash", None)
+    assert store.rollup(daily=False)[0]["turns"] == 3
+    assert store.rollup(daily=False, user_id="alice@example.com")[0]["turns"] == 2
+    rows = store.rollup(group_by=["user_id"], daily=False, user_id="bob@example.com")
+    assert [(r["user_id"], r["turns"]) for r in rows] == [("bob@example.com", 1)]